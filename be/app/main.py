@@ -1,68 +1,226 @@
-from google.cloud.pubsub_v1.subscriber.message import Message
-from google.cloud import pubsub_v1
-
-from concurrent.futures import TimeoutError
-from typing import Callable, List, Dict
+from concurrent.futures import TimeoutError, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, List, Dict, Tuple
+from utils import RequeueMessage
 from config import config
 from loguru import logger
 
-from routers import (
-    RFPGraphRouter,
-    DocumentRouter,
-    CrawlerRouter
-)
-
+import importlib
+import threading
 import asyncio
+import time
 import json
 import os
 
-# Initialize services
-rfp_graph_router = RFPGraphRouter()
-document_router = DocumentRouter()
-crawler_router = CrawlerRouter()
+# The Pub/Sub client pulls in gRPC and is imported by main() only. Processes spawned by the
+# worker, eg the OCR pool, re-import this module as __mp_main__ and must not repeat any setup
+if TYPE_CHECKING:
+    from google.cloud.pubsub_v1.subscriber.message import Message
 
-async def handle_message(message: Message) -> None:
-    """Route messages to appropriate handlers based on request_type"""
-    # Acknowledge the message
-    message.ack()
+# Router module, router class and method handling each request type. Routers, and the
+# services and libraries behind them, are only imported and built when first needed
+HANDLERS: Dict[str, Tuple[str, str, str]] = {
+    'rfp': ('routers.rfp', 'RFPGraphRouter', 'process_rfp_with_graph'),
+    'document_process': ('routers.document', 'DocumentRouter', 'process_document'),
+    'document_delete': ('routers.document', 'DocumentRouter', 'delete_document'),
+    'project_delete': ('routers.document', 'DocumentRouter', 'delete_project'),
+    'crawl': ('routers.crawler', 'CrawlerRouter', 'crawl_url')
+}
+
+routers: Dict[str, object] = {}
+routers_lock = threading.Lock()
+
+# Maximum number of messages of each request type handled at once
+DEFAULT_CONCURRENCY = {
+    'rfp': 2,
+    'document_process': 2,
+    'document_delete': 4,
+    'project_delete': 1,
+    'crawl': 2
+}
+
+# Request types whose messages are acknowledged only once handled successfully. They are
+# redelivered and resumed from their checkpoints if the handler fails or the worker dies midway
+DEFAULT_ACK_ON_COMPLETION = ['rfp']
+
+# Upper bound on how long the subscriber keeps extending the lease of a message being handled
+DEFAULT_MAX_LEASE_SECONDS = 4 * 60 * 60
+
+# How long a message of a request type with a full queue is held, waiting for room, before it
+# is handed back to Pub/Sub, so it isn't redelivered straight back in a loop
+DEFAULT_REQUEUE_DELAY_SECONDS = 10
+
+# Threads of the event loop's default executor, sized for every rfp row in flight at once,
+# WORKER_CONCURRENCY rfp x RFP_MAX_WORKERS with the defaults, with room to spare
+DEFAULT_EVENT_LOOP_THREADS = 32
+
+# A single long-lived event loop, running in its own thread, handles every message. Created by start_event_loop
+event_loop: asyncio.AbstractEventLoop = None
+concurrency_limits: Dict[str, int] = {}
+semaphores: Dict[str, asyncio.Semaphore] = {}
+in_flight: Dict[str, int] = {}
+handler_executor: ThreadPoolExecutor = None
+ack_on_completion_types: List[str] = []
+requeue_delay_seconds: float = DEFAULT_REQUEUE_DELAY_SECONDS
+
+def get_router(module_name: str, class_name: str) -> object:
+    """Import and build a router on first use, routers are shared by request types"""
+    with routers_lock:
+        if class_name not in routers:
+            start_time = time.perf_counter()
+            router_class = getattr(importlib.import_module(module_name), class_name)
+            routers[class_name] = router_class()
+            logger.info(f"Initialized {class_name} in {time.perf_counter() - start_time:.2f}s")
+        return routers[class_name]
+
+async def get_handler(request_type: str) -> Callable:
+    """Handler of a request type, its router is built in a worker thread so the event loop stays free"""
+    module_name, class_name, method_name = HANDLERS[request_type]
+    if class_name not in routers:
+        await event_loop.run_in_executor(handler_executor, get_router, module_name, class_name)
+    return getattr(routers[class_name], method_name)
+
+def preload_handlers(request_types: List[str]) -> None:
+    """Build the routers of request types in the background, eg to take the first message's latency off"""
+    def preload():
+        for request_type in request_types:
+            try:
+                module_name, class_name, _ = HANDLERS[request_type]
+                get_router(module_name, class_name)
+            except Exception:
+                logger.exception(f"Error preloading {request_type} handler")
     
+    threading.Thread(target=preload, name="handler-preload", daemon=True).start()
+
+def get_concurrency_limits() -> Dict[str, int]:
+    """Per request type concurrency limits, overridable with the WORKER_CONCURRENCY config table"""
+    env = os.environ['ENV']
+    limits = dict(DEFAULT_CONCURRENCY)
+    limits.update(config['env'][env].get('WORKER_CONCURRENCY', {}))
+    return limits
+
+async def handle_message(message: "Message") -> None:
+    """Route messages to appropriate handlers based on request_type"""
     try:
         data = json.loads(message.data.decode('utf-8'))
         request_type = data.get('request_type')
         
-        # Map request types to handlers
-        handler_mapping = {
-            'rfp': rfp_graph_router.process_rfp_with_graph,
-            'document_process': document_router.process_document,
-            'document_delete': document_router.delete_document,
-            'project_delete': document_router.delete_project,
-            'crawl': crawler_router.crawl_url
-        }
+        if request_type not in HANDLERS:
+            raise ValueError(f"Unknown request type: {request_type}")
+
+    except Exception as e:
+        message.ack()
+        logger.exception("Error parsing message")
+        return
+
+    # Only let each request type queue as many messages as it can run, and hand the
+    # rest back to Pub/Sub, so a burst of one type can't take every lease. The message is
+    # held for a while first, a nack is redelivered at once and would just come back
+    limit = concurrency_limits[request_type]
+    deadline = time.monotonic() + requeue_delay_seconds
+    while in_flight[request_type] >= 2 * limit:
+        if time.monotonic() >= deadline:
+            logger.debug(f"Too many {request_type} messages queued, returning message to Pub/Sub")
+            message.nack()
+            return
+        await asyncio.sleep(min(1, requeue_delay_seconds))
+
+    in_flight[request_type] += 1
+    try:
+        await run_handler(message, request_type, data)
+    finally:
+        in_flight[request_type] -= 1
+
+async def run_handler(message: "Message", request_type: str, data: dict) -> None:
+    """Run a handler once a slot for its request type is free"""
+    requeue = False
+    
+    # Wait for a free slot for this request type, the message stays leased until then
+    async with semaphores[request_type]:
+        # Acknowledge the message, unless it should be redelivered when the worker dies
+        ack_on_completion = request_type in ack_on_completion_types
+        if not ack_on_completion:
+            message.ack()
+
+        try:
+            logger.info(f"Routing {request_type} request to appropriate handler")
+            handler = await get_handler(request_type)
+            
+            # Handle async vs sync handlers, sync handlers must not block the event loop
+            if asyncio.iscoroutinefunction(handler):
+                await handler(data)
+            else:
+                await event_loop.run_in_executor(handler_executor, handler, data)
         
-        logger.info(f"Routing {request_type} request to appropriate handler")
-        handler = handler_mapping[request_type]
+        except RequeueMessage as e:
+            logger.info(f"Requeueing {request_type} message: {str(e)}")
+            requeue = True
+                
+        except Exception as e:
+            logger.exception("Error processing message")
+            if ack_on_completion:
+                # Redelivered as per the subscription's retry policy, and resumed from its checkpoints
+                message.nack()
         
-        # Handle async vs sync handlers
-        if asyncio.iscoroutinefunction(handler):
-            await handler(data)
         else:
-            handler(data)
-            
-    except Exception as e:
-        logger.exception("Error processing message")
+            if ack_on_completion:
+                message.ack()
+    
+    # Held outside the slot for a while before it is handed back, a nack is redelivered at once
+    if requeue:
+        if ack_on_completion:
+            await asyncio.sleep(requeue_delay_seconds)
+            message.nack()
+        else:
+            logger.warning(f"Can't requeue {request_type} message, it was acknowledged when received")
 
-def callback(message: Message):
-    """Wrapper function to run async handle_message"""
-    asyncio.run(handle_message(message))
+def callback(message: "Message"):
+    """Dispatch the message onto the worker event loop without blocking the subscriber thread"""
+    asyncio.run_coroutine_threadsafe(handle_message(message), event_loop)
+
+def start_event_loop() -> None:
+    """Create the per request type semaphores and run the worker event loop in a background thread"""
+    global event_loop, handler_executor, requeue_delay_seconds
+    
+    env = os.environ['ENV']
+    event_loop = asyncio.new_event_loop()
+    ack_on_completion_types.extend(config['env'][env].get('ACK_ON_COMPLETION', DEFAULT_ACK_ON_COMPLETION))
+    requeue_delay_seconds = float(config['env'][env].get('PUBSUB_REQUEUE_DELAY_SECONDS', DEFAULT_REQUEUE_DELAY_SECONDS))
+    concurrency_limits.update(get_concurrency_limits())
+    for request_type, limit in concurrency_limits.items():
+        semaphores[request_type] = asyncio.Semaphore(limit)
+        in_flight[request_type] = 0
+    handler_executor = ThreadPoolExecutor(
+        max_workers=sum(concurrency_limits.values()),
+        thread_name_prefix="handler"
+    )
+    # Blocking calls of async handlers (asyncio.to_thread), mostly the DB writes, searches and
+    # flushes of rfp rows. Python's default of min(32, cpus + 4) threads is too few on small
+    # machines for every row in flight
+    event_loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=int(config['env'][env].get('EVENT_LOOP_THREADS', DEFAULT_EVENT_LOOP_THREADS)),
+        thread_name_prefix="event-loop"
+    ))
+    
+    threading.Thread(
+        target=event_loop.run_forever,
+        name="worker-event-loop",
+        daemon=True
+    ).start()
+    logger.info(f"Worker event loop started with concurrency limits {concurrency_limits}")
 
 def main():
     """Main entry point for the application"""
+    from google.cloud import pubsub_v1
+    
     try:
         # Pub/Sub configuration
         env = os.environ['ENV']
         project_id = config['env'][env]['GCP_PROJECT_ID']
         subscription_id = config['env'][env]['GCP_SUBSCRIPTION_ID']
 
+        start_event_loop()
+        preload_handlers(config['env'][env].get('PRELOAD_HANDLERS', []))
+
         subscriber = pubsub_v1.SubscriberClient()
         subscription_path = subscriber.subscription_path(
             project_id,
@@ -71,7 +229,12 @@ def main():
         
         streaming_pull_future = subscriber.subscribe(
             subscription_path,
-            callback=callback
+            callback=callback,
+            # Every request type can run and queue up to its limit without using up another type's leases
+            flow_control=pubsub_v1.types.FlowControl(
+                max_messages=2 * sum(concurrency_limits.values()),
+                max_lease_duration=int(config['env'][env].get('PUBSUB_MAX_LEASE_SECONDS', DEFAULT_MAX_LEASE_SECONDS))
+            )
         )
         
         logger.info(f"Listening for messages on {subscription_path}")
@@ -1,9 +1,21 @@
-from .crawler import CrawlerRouter
-from .document import DocumentRouter
-from .rfp import RFPGraphRouter
+import importlib
+
+# Routers are only imported when first accessed, so a worker only loads what its request types need
+_ROUTERS = {
+    "CrawlerRouter": "routers.crawler",
+    "DocumentRouter": "routers.document",
+    "RFPGraphRouter": "routers.rfp"
+}
 
 __all__ = [
-    CrawlerRouter,
-    DocumentRouter,
-    RFPGraphRouter
-]
\ No newline at end of file
+    "CrawlerRouter",
+    "DocumentRouter",
+    "RFPGraphRouter"
+]
+
+def __getattr__(name):
+    if name in _ROUTERS:
+        value = getattr(importlib.import_module(_ROUTERS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -18,12 +18,19 @@ class CrawlerRouter:
         logger.debug(f"Received request: {request}")
         
         try:
-            for url in request['urls']:
-                result = await self.crawler_service.process_url(
+            # URLs are crawled concurrently, limited by the pages of the service's shared browser
+            results = await asyncio.gather(*[
+                self.crawler_service.process_url(
                     url=str(url),
                     project_id=request['project_id'],
                     user_id=request['user_id'],
                 )
+                for url in request['urls']
+            ])
+            
+            failed = len(results) - sum(1 for result in results if result)
+            if failed:
+                logger.warning(f"Failed to process {failed} out of {len(results)} URLs")
             return {"message": "Successfully processed all URLs"}
         
         except Exception as e:
@@ -1,9 +1,12 @@
 from services import DocumentService, VectorSearchService
 from utils import GCPStorageClient, Database
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
 from typing import List, Dict
+from config import config
 from loguru import logger
-from tqdm import tqdm
+
+import os
 
 class DocumentRequest(BaseModel):
     project_id: int
@@ -27,6 +30,27 @@ class DocumentRouter:
         self.vector_search_service = VectorSearchService()
         self.gcp_client = GCPStorageClient()
         self.db = Database.get_instance()
+        
+        # Files of one request indexed at once
+        env = os.environ['ENV']
+        self.max_parallel_files = int(config['env'][env].get('DOCUMENT_MAX_PARALLEL_FILES', 4))
+        
+        # Blob deletes in flight when deleting a project
+        self.gcs_delete_workers = int(config['env'][env].get('GCS_DELETE_WORKERS', 16))
+
+    def _process_file(self, gcp_file: Dict[str, str], project_id: int, user_id: int) -> bool:
+        """Download, extract, embed and upsert one file, a failure only affects this file"""
+        try:
+            return self.document_service.process_document(
+                bucket=gcp_file['bucket'],
+                gcp_file_path=gcp_file['path'],
+                file_type=gcp_file['type'],
+                project_id=project_id,
+                user_id=user_id
+            )
+        except Exception as e:
+            logger.exception(f"Error processing file {gcp_file['path']}")
+            return False
 
     def process_document(
         self,
@@ -37,23 +61,21 @@ class DocumentRouter:
         try:
             project_id = request['project_id']
             user_id = request['user_id']
+            gcp_files = request['gcp_files']
             
-            for gcp_file in request['gcp_files']:
-                
-                bucket = gcp_file['bucket']
-                gcp_file_path = gcp_file['path']
-                type = gcp_file['type']
-
-                success = self.document_service.process_document(
-                    bucket=bucket,
-                    gcp_file_path=gcp_file_path,
-                    file_type=type,
-                    project_id=project_id,
-                    user_id=user_id
-                )
-
-            if not success:
-                raise 
+            # Index the files concurrently, each file records its own indexing status
+            with ThreadPoolExecutor(
+                max_workers=max(1, min(self.max_parallel_files, len(gcp_files))),
+                thread_name_prefix="document"
+            ) as executor:
+                results = list(executor.map(
+                    lambda gcp_file: self._process_file(gcp_file, project_id, user_id),
+                    gcp_files
+                ))
+
+            failed_files = [gcp_file['path'] for gcp_file, success in zip(gcp_files, results) if not success]
+            if failed_files:
+                raise Exception(f"Failed to process {len(failed_files)} out of {len(gcp_files)} file/s: {failed_files}")
 
             return {"message": "Document processed and inserted successfully"}
         
@@ -104,35 +126,29 @@ class DocumentRouter:
 
         try:
 
+            project_id = request['project_id']
+            user_id = request['user_id']
+
             logger.debug("Getting all files for project")
-            files = self.db.get_project_files(request['project_id'], request['user_id'])
-            project = self.db.get_project_by_id(request['project_id'])
-
-            logger.info(f"Deleting all file/s from GCP for project {project['name']}")
-            for file in tqdm(files):
-                bucket, gcp_file_path = self.db.get_file_gcp_details(
-                    file_id=file['id'],
-                    user_id=request['user_id']
-                )
-                self.gcp_client.delete_file(
-                    bucket=bucket,
-                    gcp_file_path=gcp_file_path
-                )
-
-                logger.info("Deleting file from Vector Search and vector metadata from DB")
-                self.vector_search_service.delete(
-                    file_id=file['id'],
-                    user_id=request['user_id']
-                )
-                
-                logger.info("Removing file from database")
-                self.db.delete_file(
-                    file_id=file['id'],
-                    user_id=request['user_id']
-                )
+            files = self.db.get_project_files(project_id, user_id)
+            project = self.db.get_project_by_id(project_id)
+            file_ids = [file['id'] for file in files]
+
+            logger.info(f"Deleting {len(files)} file/s from GCP for project {project['name']}")
+            self.gcp_client.delete_files(
+                [(file['bucket'], file['gcp_path']) for file in files],
+                max_workers=self.gcs_delete_workers
+            )
+
+            logger.info("Deleting files from Vector Search and vector metadata from DB")
+            if not self.vector_search_service.delete_files(file_ids, user_id, project_id):
+                raise Exception(f"Failed to delete vectors of project {project['name']}")
+
+            logger.info("Removing files from database")
+            self.db.delete_files(file_ids, user_id)
 
             logger.info(f"Deleting project {project['name']}")
-            self.db.delete_project(request['project_id'], request['user_id'])
+            self.db.delete_project(project_id, user_id)
         
         except Exception as e:
 
@@ -1,6 +1,8 @@
 from services import RFPGraphService
 from utils.database import Database
+from utils import RequeueMessage
 from pydantic import BaseModel
+from typing import Optional, List
 from loguru import logger
 
 import json
@@ -14,6 +16,8 @@ class RFPRequest(BaseModel):
     user_id: int
     username: str
     timestamp: str
+    max_workers: Optional[int] = None
+    dedup_columns: Optional[List[str]] = None
 
 
 class RFPGraphRouter:
@@ -22,25 +26,30 @@ class RFPGraphRouter:
         self.rfp_graph_service = RFPGraphService()
         self.db = Database.get_instance()
 
-    def process_rfp_with_graph(
+    async def process_rfp_with_graph(
         self,
         request: RFPRequest
     ):
         logger.debug(f"Received graph processing request: {request}")
     
         try:
-            result = self.rfp_graph_service.process_rfp(
+            result = await self.rfp_graph_service.process_rfp(
                 rfp_name=request['rfp_name'],
                 bucket=request['bucket'],
                 gcp_path=request['gcp_path'],
                 project_id=request['project_id'],
                 project_name=request['project_name'],
                 user_id=request['user_id'],
-                username=request['username']
+                username=request['username'],
+                max_workers=request.get('max_workers'),
+                dedup_columns=request.get('dedup_columns')
             )
             
             return json.dumps(result)
 
+        except RequeueMessage:
+            raise
+
         except Exception as e:
             logger.exception("Error processing RFP with graph")
             raise
\ No newline at end of file
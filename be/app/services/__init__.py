@@ -1,9 +1,15 @@
-from services.vectorsearch_service import VectorSearchService
-from services.document_service import DocumentService
-from services.qdrant_service import QdrantService
-from services.llm_service import LLMService
-from services.rfp_graph_service import RFPGraphService
-from services.crawler_service import CrawlerService
+import importlib
+
+# Services pull in heavy dependencies (vertexai, langgraph, crawl4ai, pandas), so each
+# one is only imported when first accessed, eg by `from services import LLMService`
+_SERVICES = {
+    "QdrantService": "services.qdrant_service",
+    "DocumentService": "services.document_service",
+    "LLMService": "services.llm_service",
+    "VectorSearchService": "services.vectorsearch_service",
+    "RFPGraphService": "services.rfp_graph_service",
+    "CrawlerService": "services.crawler_service"
+}
 
 __all__ = [
     "QdrantService",
@@ -12,4 +18,11 @@ __all__ = [
     "VectorSearchService",
     "RFPGraphService",
     "CrawlerService"
-]
\ No newline at end of file
+]
+
+def __getattr__(name):
+    if name in _SERVICES:
+        value = getattr(importlib.import_module(_SERVICES[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
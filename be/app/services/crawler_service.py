@@ -1,10 +1,13 @@
 from utils.extractor_factory import ExtractorFactory
 from services import VectorSearchService
 from utils.database import Database
+from config import config
 
 from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
 from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import partial
 from loguru import logger
 
 import asyncio
@@ -15,6 +18,7 @@ import os
 
 class CrawlerService:
     def __init__(self):
+        self.env = os.environ['ENV']
         self.vector_search_service = VectorSearchService()
         self.db = Database.get_instance()
         
@@ -30,6 +34,169 @@ class CrawlerService:
             user_agent_mode="random",  # Helps avoid blocking
             java_script_enabled=True   # For dynamic content
         )
+        
+        # One long-lived browser shared by every crawl, with at most max_pages pages open at once.
+        # It is retired when it crashes, after consecutive failures, or after serving many pages.
+        # New crawls then get a new browser while the retired one drains, it is closed once the
+        # crawls still running in it finish
+        self.max_pages = int(config['env'][self.env].get('CRAWLER_MAX_PAGES', 4))
+        self.restart_after_failures = int(config['env'][self.env].get('CRAWLER_RESTART_AFTER_FAILURES', 3))
+        self.restart_after_pages = int(config['env'][self.env].get('CRAWLER_RESTART_AFTER_PAGES', 500))
+        self._page_semaphore = asyncio.Semaphore(self.max_pages)
+        self._crawler_lock = asyncio.Lock()
+        self._crawler = None
+        self._generation = 0
+        self._pages_served = 0
+        self._consecutive_failures = 0
+        # Crawls running in each browser generation, and retired browsers waiting for theirs
+        self._active_crawls: dict[int, int] = {}
+        self._draining: dict[int, AsyncWebCrawler] = {}
+        
+        # Indexing and DB writes of crawls run in threads of their own, so a burst of crawls,
+        # with their embedding backoffs, can't take the event loop's default executor from rfp runs
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(config['env'][self.env].get('CRAWLER_INDEX_WORKERS', 2)),
+            thread_name_prefix="crawl-index"
+        )
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """Run a blocking call in the crawler's own executor"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def _is_healthy(self) -> bool:
+        """Whether the shared browser is still connected, as far as crawl4ai exposes it"""
+        strategy = getattr(self._crawler, "crawler_strategy", None)
+        browser = getattr(getattr(strategy, "browser_manager", None), "browser", None)
+        if browser is None or not hasattr(browser, "is_connected"):
+            # Internals not exposed, crashes are caught by the consecutive failure count
+            return True
+        return browser.is_connected()
+
+    async def _start_crawler(self) -> None:
+        """Launch a new browser for new crawls. Caller holds the crawler lock"""
+        crawler = AsyncWebCrawler(browser_config=self.browser_config)
+        await crawler.__aenter__()
+        
+        self._crawler = crawler
+        self._generation += 1
+        self._pages_served = 0
+        self._consecutive_failures = 0
+        self._active_crawls[self._generation] = 0
+        logger.info(f"Started browser {self._generation} for crawling with up to {self.max_pages} page/s")
+
+    async def _retire_crawler(self) -> None:
+        """
+        Stop handing out the current browser, closing it once its crawls finish. Caller
+        holds the crawler lock
+        """
+        if self._crawler is None:
+            return
+        
+        self._draining[self._generation], self._crawler = self._crawler, None
+        await self._close_if_drained(self._generation)
+
+    async def _close_if_drained(self, generation: int) -> None:
+        """Close a retired browser if no crawl is running in it. Caller holds the crawler lock"""
+        if generation not in self._draining or self._active_crawls.get(generation):
+            return
+        
+        crawler = self._draining.pop(generation)
+        self._active_crawls.pop(generation, None)
+        try:
+            await crawler.__aexit__(None, None, None)
+        except Exception as e:
+            logger.warning(f"Error closing browser {generation}: {str(e)}")
+
+    async def _get_crawler(self) -> tuple[AsyncWebCrawler, int]:
+        """The shared crawler and its generation, a new one if the current one is retired"""
+        async with self._crawler_lock:
+            if self._crawler is not None and not self._is_healthy():
+                logger.warning(f"Browser {self._generation} is disconnected, replacing it")
+                await self._retire_crawler()
+            elif self._crawler is not None and self._pages_served >= self.restart_after_pages:
+                logger.info(f"Browser {self._generation} served {self._pages_served} pages, replacing it")
+                await self._retire_crawler()
+            
+            if self._crawler is None:
+                await self._start_crawler()
+            
+            self._pages_served += 1
+            self._active_crawls[self._generation] += 1
+            return self._crawler, self._generation
+
+    async def _release_crawler(self, generation: int, success: bool) -> None:
+        """
+        Record a finished crawl. Consecutive failures of the current browser retire it, and
+        a retired browser is closed once its last crawl finishes
+        """
+        async with self._crawler_lock:
+            self._active_crawls[generation] -= 1
+            
+            # Failures of a browser already retired don't count against its replacement
+            if generation == self._generation and self._crawler is not None:
+                if success:
+                    self._consecutive_failures = 0
+                else:
+                    self._consecutive_failures += 1
+                    if self._consecutive_failures >= self.restart_after_failures or not self._is_healthy():
+                        logger.warning(f"Browser {generation} failed {self._consecutive_failures} crawl/s in a row, replacing it")
+                        await self._retire_crawler()
+            
+            await self._close_if_drained(generation)
+
+    async def crawl(self, url: str, run_config: CrawlerRunConfig):
+        """
+        Crawl a URL in a page of the shared browser, waiting for a free page
+        
+        Args:
+            url (str): URL to crawl
+            run_config (CrawlerRunConfig): Run settings
+        
+        Returns:
+            CrawlResult: Result of the crawl
+        """
+        async with self._page_semaphore:
+            crawler, generation = await self._get_crawler()
+            success = False
+            try:
+                result = await crawler.arun(url=url, config=run_config)
+                success = bool(result and result.success)
+                return result
+            finally:
+                await self._release_crawler(generation, success)
+
+    async def close(self) -> None:
+        """Close the shared browser and any still draining"""
+        async with self._crawler_lock:
+            await self._retire_crawler()
+            for generation, crawler in list(self._draining.items()):
+                self._draining.pop(generation)
+                try:
+                    await crawler.__aexit__(None, None, None)
+                except Exception as e:
+                    logger.warning(f"Error closing browser {generation}: {str(e)}")
+
+    def _index_markdown(self, url: str, raw_markdown: str, project_id: int, user_id: int, file_id: int) -> None:
+        """Chunk, store and embed crawled markdown, blocking so it runs in a worker thread"""
+        extractor = ExtractorFactory.get_extractor('website')
+        
+        # Process the crawled content in micro-batches
+        for documents in extractor.stream_documents(
+            file_path=url,
+            project_id=project_id,
+            user_id=user_id,
+            file_id=file_id,
+            raw_markdown=raw_markdown
+        ):
+            self.vector_search_service.insert(
+                documents=documents
+            )
+        
+        self.db.update_file_indexing_status(
+            file_id=file_id,
+            is_indexed=True,
+            completed_at=datetime.now(timezone.utc)
+        )
 
     async def process_url(
         self,
@@ -39,12 +206,12 @@ class CrawlerService:
         cache_mode: bool = True,
         verbose: bool = True
     ) -> bool:
-        extractor = ExtractorFactory.get_extractor('website')
-        crawler = None
+        file_id = None
         
         try:
             # Insert into DB
-            file_id = self.db.insert_file(
+            file_id = await self._run_blocking(
+                self.db.insert_file,
                 project_id=project_id,
                 user_id=user_id,
                 type='website',
@@ -52,9 +219,9 @@ class CrawlerService:
                 gcp_path=None,
                 bucket=None
             )
-
+            
             logger.debug(f"File ID: {file_id}")
-
+            
             # Configure run settings
             run_config = CrawlerRunConfig(
                 cache_mode=CacheMode.ENABLED if cache_mode else CacheMode.DISABLED,
@@ -63,64 +230,54 @@ class CrawlerService:
                 ),
                 page_timeout=60000  # 60 seconds timeout
             )
-
-            # Create crawler instance and crawl with retry logic
-            async with AsyncWebCrawler(browser_config=self.browser_config) as crawler:
-                max_retries = 3
-                result = None
-                
-                for attempt in range(max_retries):
-                    try:
-                        result = await crawler.arun(
-                            url=url,
-                            config=run_config
-                        )
-                        
-                        if result and result.success:
-                            break
-                        
-                        logger.warning(f"Attempt {attempt + 1} failed for URL: {url}")
-                        if attempt < max_retries - 1:
-                            await asyncio.sleep(2 ** attempt)  # Exponential backoff
-                            
-                    except Exception as e:
-                        logger.error(f"Attempt {attempt + 1} error for URL {url}: {str(e)}")
-                        if attempt == max_retries - 1:
-                            raise
-
-                # Verify crawl result
-                if not result or not result.success:
-                    raise Exception(f"Failed to crawl URL after {max_retries} attempts: {url}")
-
-                if not result.markdown_v2 or not result.markdown_v2.raw_markdown:
-                    raise Exception(f"No content extracted from URL: {url}")
-
-                # Process the crawled content
-                documents = extractor.extract_documents(
-                    file_path=url,
-                    project_id=project_id,
-                    user_id=user_id,
-                    file_id=file_id,
-                    raw_markdown=result.markdown_v2.raw_markdown
-                )
-                
-                self.vector_search_service.insert(
-                    documents=documents
-                )
+            
+            # Crawl in the shared browser with retry logic
+            max_retries = 3
+            result = None
+            
+            for attempt in range(max_retries):
+                try:
+                    result = await self.crawl(url, run_config)
+                    
+                    if result and result.success:
+                        break
+                    
+                    logger.warning(f"Attempt {attempt + 1} failed for URL: {url}")
+                    if attempt < max_retries - 1:
+                        await asyncio.sleep(2 ** attempt)  # Exponential backoff
                 
-                self.db.update_file_indexing_status(
-                    file_id=file_id,
-                    is_indexed=True,
-                    completed_at=datetime.now(timezone.utc)
-                )
-                
-                return True
+                except Exception as e:
+                    logger.error(f"Attempt {attempt + 1} error for URL {url}: {str(e)}")
+                    if attempt == max_retries - 1:
+                        raise
+            
+            # Verify crawl result
+            if not result or not result.success:
+                raise Exception(f"Failed to crawl URL after {max_retries} attempts: {url}")
+            
+            if not result.markdown_v2 or not result.markdown_v2.raw_markdown:
+                raise Exception(f"No content extracted from URL: {url}")
+            
+            # Chunking, embedding and DB writes block, keep them off the event loop
+            await self._run_blocking(
+                self._index_markdown,
+                url,
+                result.markdown_v2.raw_markdown,
+                project_id,
+                user_id,
+                file_id
+            )
+            
+            return True
         
         except Exception as e:
             error_msg = f"Error processing URL {url}: {str(e)}"
             logger.error(error_msg)
-            self.db.update_file_indexing_status(
-                file_id=file_id,
-                is_indexed=False,
-                completed_at=datetime.now(timezone.utc)
-            )
\ No newline at end of file
+            if file_id is not None:
+                await self._run_blocking(
+                    self.db.update_file_indexing_status,
+                    file_id=file_id,
+                    is_indexed=False,
+                    completed_at=datetime.now(timezone.utc)
+                )
+            return False
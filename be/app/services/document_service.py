@@ -4,6 +4,7 @@ from services import VectorSearchService
 from datetime import datetime, timezone
 from utils.gcp import GCPStorageClient
 from utils.database import Database
+from loguru import logger
 
 import os
 
@@ -34,20 +35,24 @@ class DocumentService:
                 bucket=bucket
             )
 
-            # Download file to temp
-            tmp_file_path = self.gcp_client.download_blob_to_temp(bucket, gcp_file_path)
+            # Download file into memory, extractors read it straight from the buffer
+            file_buffer = self.gcp_client.download_blob_to_buffer(bucket, gcp_file_path)
 
-            documents = extractor.extract_documents(
-                file_path=tmp_file_path,
+            # Stream chunks through DB insert, embedding and upsert in micro-batches
+            is_indexed = True
+            for batch_number, documents in enumerate(extractor.stream_documents(
+                file_path=file_buffer,
                 project_id=project_id,
                 user_id=user_id,
                 file_id=file_id,
-            )
-            
-            # Update vectors in Vector Search and vector metadata in DB
-            is_indexed = self.vector_search_service.insert(
-                documents=documents
-            )
+                file_name=os.path.basename(gcp_file_path),
+            ), 1):
+                logger.debug(f"Indexing batch {batch_number} of {len(documents)} chunks for file {file_id}")
+                
+                # Update vectors in Vector Search
+                if not self.vector_search_service.insert(documents=documents):
+                    is_indexed = False
+                    break
             
             # Update DB
             self.db.update_file_indexing_status(
@@ -56,8 +61,8 @@ class DocumentService:
                 completed_at=datetime.now(timezone.utc)
             )
 
-            # Cleanup temp file
-            self.gcp_client.cleanup_temp_file(tmp_file_path)
+            # Release the file content
+            file_buffer.close()
             
             # Insert into Qdrant
             return is_indexed
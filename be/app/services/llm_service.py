@@ -1,21 +1,35 @@
 from google.api_core.exceptions import TooManyRequests
 
-from vertexai.preview.generative_models import GenerativeModel
+from vertexai.preview.generative_models import GenerativeModel, GenerationResponse
 from vertexai.preview.tokenization import get_tokenizer_for_model
 from vertexai import init
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from loguru import logger
-from time import sleep
 
+from utils.concurrency_controller import get_concurrency_controller
+from utils.rate_limiter import get_rate_limiter
 from utils.prompt_loader import PromptLoader
 from config import config
 
+import math
 import os
 
-class LLMService:
-    MAX_RETRIES = 3
-    RETRY_DELAY = 20  # seconds
+# Counting with the local tokenizer is CPU bound, keep it off the request path
+_token_count_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-count")
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name: str):
+    """Load the local tokenizer for a model once per process"""
+    return get_tokenizer_for_model(model_name)
+
+def approximate_token_count(text: str) -> int:
+    """Fast token estimate, roughly four characters per token for Gemini models"""
+    return math.ceil(len(text) / 4)
+
 
+class LLMService:
     def __init__(self, project: str = None, location: str = None):
         
         # Initialize Vertex AI
@@ -28,12 +42,31 @@ class LLMService:
         self.model = GenerativeModel(self.model_name)
         self.prompt_loader = PromptLoader()
 
+        # Requests and tokens per minute budget shared by every call to the model
+        self.rate_limiter = get_rate_limiter(self.model_name)
+
+        # Requests in flight to the model, adapted to its latency and 429s
+        self.concurrency_controller = get_concurrency_controller(self.model_name)
+
+        # How tokens are counted for cost tracking: "usage", "tokenizer" or "approx"
+        self.token_count_mode = config['env'][self.env].get('TOKEN_COUNT_MODE', 'usage')
+
         # Track approximate run cost
         self.run_cost = 0
 
-    def _handle_llm_request(self, prompt: str, temperature: float = 0.0, generation=None) -> str | None:
+    def _generation_config(self, temperature: float) -> dict:
+        """Generation config shared by sync and async requests"""
+        return {
+            "temperature": temperature,
+            "top_p": 1,
+            "top_k": 1,
+            "max_output_tokens": 2048,
+        }
+
+    def _handle_llm_request(self, prompt: str, temperature: float = 0.0, generation=None) -> GenerationResponse | None:
         """
-        Handle LLM request with retries for rate limiting
+        Handle LLM request, paced by the shared rate limiter and retried with jittered backoff on rate limiting,
+        up to the model's RATE_LIMITS max_retries attempts
         
         Args:
             prompt (str): The formatted prompt to send
@@ -41,48 +74,98 @@ class LLMService:
             generation (Generation): Langfuse generation object
             
         Returns:
-            str | None: Generated response or None on failure
+            GenerationResponse | None: Response with text and usage metadata, or None on failure
         """
-        for attempt in range(self.MAX_RETRIES):
-            try:
+        def generate() -> GenerationResponse:
+            with self.concurrency_controller.limit_call():
                 response = self.model.generate_content(
                     prompt,
-                    generation_config={
-                        "temperature": temperature,
-                        "top_p": 1,
-                        "top_k": 1,
-                        "max_output_tokens": 2048,
-                    }
+                    generation_config=self._generation_config(temperature)
                 )
-                return response.text
+            response.text  # Raises if the response has no text, eg when blocked
+            return response
+
+        try:
+            response = self.rate_limiter.call(
+                generate,
+                tokens=approximate_token_count(prompt)
+            )
+            self._record_rate_limited_tokens(prompt, response)
+            return response
+
+        except TooManyRequests as e:
+            self._log_rate_limit_exceeded(e, generation)
+            return None
+
+        except Exception as e:
+            self._log_request_error(e, generation)
+            return None
+
+    async def _ahandle_llm_request(self, prompt: str, temperature: float = 0.0, generation=None) -> GenerationResponse | None:
+        """
+        Async version of _handle_llm_request, waits on the event loop instead of blocking the thread
+        
+        Args:
+            prompt (str): The formatted prompt to send
+            temperature (float): Temperature setting for generation
+            generation (Generation): Langfuse generation object
+            
+        Returns:
+            GenerationResponse | None: Response with text and usage metadata, or None on failure
+        """
+        async def generate() -> GenerationResponse:
+            async with self.concurrency_controller.alimit_call():
+                response = await self.model.generate_content_async(
+                    prompt,
+                    generation_config=self._generation_config(temperature)
+                )
+            response.text  # Raises if the response has no text, eg when blocked
+            return response
 
-            except TooManyRequests as e:
-                if attempt < self.MAX_RETRIES - 1:
-                    error_msg = f"Rate limit hit, attempt {attempt + 1}/{self.MAX_RETRIES}. Waiting {self.RETRY_DELAY} seconds..."
-                    logger.warning(error_msg)
-                    sleep(self.RETRY_DELAY)
-                else:
-                    error_msg = f"Rate limit exceeded after {self.MAX_RETRIES} attempts"
-                    logger.error(error_msg)
-                    if generation:
-                        generation.update(
-                            level="ERROR",
-                            metadata={
-                                "error": str(e),
-                                "final_attempt": self.MAX_RETRIES
-                            }
-                        )
-                    return None
-
-            except Exception as e:
-                error_msg = f"Error generating completion: {str(e)}"
-                logger.exception(error_msg)
-                if generation:
-                    generation.update(
-                        level="ERROR",
-                        metadata={"error": error_msg}
-                    )
-                return None
+        try:
+            response = await self.rate_limiter.acall(
+                generate,
+                tokens=approximate_token_count(prompt)
+            )
+            self._record_rate_limited_tokens(prompt, response)
+            return response
+
+        except TooManyRequests as e:
+            self._log_rate_limit_exceeded(e, generation)
+            return None
+
+        except Exception as e:
+            self._log_request_error(e, generation)
+            return None
+
+    def _record_rate_limited_tokens(self, prompt: str, response: GenerationResponse) -> None:
+        """Charge the rate limiter for the tokens used beyond the prompt estimate reserved up front"""
+        try:
+            used = response.usage_metadata.total_token_count
+        except Exception:
+            used = approximate_token_count(prompt) + approximate_token_count(response.text)
+        self.rate_limiter.record_tokens(used - approximate_token_count(prompt))
+
+    def _log_rate_limit_exceeded(self, e: Exception, generation=None) -> None:
+        error_msg = f"Rate limit exceeded after {self.rate_limiter.max_retries} attempts"
+        logger.error(error_msg)
+        if generation:
+            generation.update(
+                level="ERROR",
+                metadata={
+                    "error": str(e),
+                    "final_attempt": self.rate_limiter.max_retries
+                }
+            )
+
+    def _log_request_error(self, e: Exception, generation=None) -> None:
+        error_msg = f"Error generating completion: {str(e)}"
+        logger.exception(error_msg)
+        if generation:
+            generation.update(
+                level="ERROR",
+                metadata={"error": error_msg}
+            )
 
     def _calculate_token_cost(self, token_count: int, is_input: bool) -> float:
         """
@@ -105,6 +188,116 @@ class LLMService:
         
         return round(token_count * rate, 6)
 
+    def _start_generation(self, name: str, prompt: str, temperature: float, trace=None) -> dict:
+        """
+        Open a Langfuse generation for the prompt. Tokens are counted once the
+        response is back, so nothing here delays the request
+        
+        Args:
+            name (str): Name of the generation in Langfuse
+            prompt (str): The formatted prompt
+            temperature (float): Temperature setting for generation
+            trace (StatefulTraceClient): Langfuse trace, if any
+            
+        Returns:
+            dict: Prompt and generation
+        """
+        # Create a generation if trace is provided
+        generation = None
+        if trace:
+            generation = trace.generation(
+                name=name,
+                model=self.model_name,
+                input=prompt,
+                metadata={
+                    "temperature": temperature,
+                }
+            )
+        
+        return {
+            "prompt": prompt,
+            "generation": generation
+        }
+
+    def _end_generation(self, request: dict, response: GenerationResponse) -> None:
+        """
+        Record token usage and cost, and close the Langfuse generation opened by _start_generation.
+        
+        Counts come from the response's usage metadata, a character based estimate, or the
+        local tokenizer in a background thread, depending on TOKEN_COUNT_MODE
+        
+        Args:
+            request (dict): Result of _start_generation
+            response (GenerationResponse): Response from the model
+        """
+        # Accounting only, a failure here must not turn a valid answer into a failed call
+        try:
+            if self.token_count_mode == "tokenizer":
+                _token_count_executor.submit(self._record_usage_with_tokenizer, request, response.text)
+                return
+            
+            if self.token_count_mode == "approx":
+                input_tokens = approximate_token_count(request["prompt"])
+                output_tokens = approximate_token_count(response.text)
+            else:
+                input_tokens = response.usage_metadata.prompt_token_count
+                output_tokens = response.usage_metadata.candidates_token_count
+            
+            self._record_usage(request, response.text, input_tokens, output_tokens)
+        except Exception as e:
+            logger.exception(f"Error recording token usage: {e}")
+
+    def _record_usage_with_tokenizer(self, request: dict, response_text: str) -> None:
+        """Count tokens with the cached local tokenizer, runs off the request path"""
+        try:
+            tokenizer = get_tokenizer(self.model_name)
+            input_tokens = tokenizer.count_tokens(request["prompt"]).total_tokens
+            output_tokens = tokenizer.count_tokens(response_text).total_tokens
+            self._record_usage(request, response_text, input_tokens, output_tokens)
+        except Exception as e:
+            logger.exception(f"Error counting tokens: {e}")
+
+    def _record_usage(self, request: dict, response_text: str, input_tokens: int, output_tokens: int) -> None:
+        """Log token counts and cost and end the Langfuse generation"""
+        input_cost = self._calculate_token_cost(input_tokens, is_input=True)
+        output_cost = self._calculate_token_cost(output_tokens, is_input=False)
+        total_cost = input_cost + output_cost
+        total_tokens = input_tokens + output_tokens
+        
+        logger.info(f"Token count: {input_tokens} input, {output_tokens} output")
+        logger.info(f"COST FOR THIS REQUEST: {total_cost}")
+
+        if request["generation"]:
+            request["generation"].end(
+                output=response_text,
+                usage_details={
+                    "input_tokens": input_tokens,
+                    "output_tokens": output_tokens,
+                    "total": total_tokens
+                },
+                cost_details={
+                    "input": input_cost,
+                    "output": output_cost,
+                    "total": total_cost
+                }
+            )
+
+    def _format_rfp_prompt(self, context: str, new_requirements: str) -> str:
+        prompt = self.prompt_loader.format_prompt(
+            key="rfp_expert",
+            historical_rfps=context,
+            requirement=new_requirements
+        )
+        logger.info(f"Sending prompt to LLM: \n\n{prompt}")
+        return prompt
+
+    def _format_sufficiency_prompt(self, context: str, question: str) -> str:
+        return self.prompt_loader.format_prompt(
+            key="sufficiency_evaluator",
+            context=context,
+            question=question
+        )
+
     def get_rfp_completion(self, context: str, new_requirements: str, temperature: float = 0.0, trace=None) -> str | None:
         """
         Get a completion from Gemini using Vertex AI
@@ -118,72 +311,47 @@ class LLMService:
             str: The generated response
         """
         try:
-            # Format prompt using loader
-            prompt = self.prompt_loader.format_prompt(
-                key="rfp_expert",
-                historical_rfps=context,
-                requirement=new_requirements
-            )
+            prompt = self._format_rfp_prompt(context, new_requirements)
+            request = self._start_generation("rfp-completion", prompt, temperature, trace)
             
-            logger.info(f"Sending prompt to LLM: \n\n{prompt}")
+            # Get response with retry handling
+            response = self._handle_llm_request(prompt, temperature, request["generation"])
             
-            # Get token count and calculate cost
-            tokenizer = get_tokenizer_for_model(self.model_name)
-            input_tokens = tokenizer.count_tokens(prompt)
-            input_cost = self._calculate_token_cost(input_tokens.total_tokens, is_input=True)
+            if response:
+                self._end_generation(request, response)
+                return response.text
+            return None
             
-            logger.info(f"Token count: {input_tokens.total_tokens}")
-            logger.info(f"INPUT COST FOR THIS REQUEST: {input_cost}")
-
-            # Create a generation if trace is provided
-            generation = None
-            if trace:
-                generation = trace.generation(
-                    name="rfp-completion",
-                    model=self.model_name,
-                    input=prompt,
-                    metadata={
-                        "temperature": temperature,
-                    },
-                    usage_details={
-                        "input_tokens": input_tokens.total_tokens,
-                        "total": input_tokens.total_tokens
-                    },
-                    cost_details={
-                        "input": input_cost,
-                        "total": input_cost
-                    }
-                )
+        except Exception as e:
+            logger.exception(f"Error in get_rfp_completion: {e}")
+            return None
+
+    async def aget_rfp_completion(self, context: str, new_requirements: str, temperature: float = 0.0, trace=None) -> str | None:
+        """
+        Async version of get_rfp_completion
+        
+        Args:
+            context (str): Historical RFPs context
+            new_requirements (str): New requirement to analyze
+            temperature (float): Controls randomness (0.0 to 1.0)
+        
+        Returns:
+            str: The generated response
+        """
+        try:
+            prompt = self._format_rfp_prompt(context, new_requirements)
+            request = self._start_generation("rfp-completion", prompt, temperature, trace)
             
             # Get response with retry handling
-            response_text = self._handle_llm_request(prompt, temperature, generation)
+            response = await self._ahandle_llm_request(prompt, temperature, request["generation"])
             
-            if response_text:
-                # Calculate response tokens and cost
-                output_tokens = tokenizer.count_tokens(response_text)
-                output_cost = self._calculate_token_cost(output_tokens.total_tokens, is_input=False)
-                total_cost = input_cost + output_cost
-                total_tokens = input_tokens.total_tokens + output_tokens.total_tokens
-
-                if generation:
-                    generation.end(
-                        output=response_text,
-                        usage_details={
-                            "input_tokens": input_tokens.total_tokens,
-                            "output_tokens": output_tokens.total_tokens,
-                            "total": total_tokens
-                        },
-                        cost_details={
-                            "input": input_cost,
-                            "output": output_cost,
-                            "total": total_cost
-                        }
-                    )
-                return response_text
+            if response:
+                self._end_generation(request, response)
+                return response.text
             return None
             
         except Exception as e:
-            logger.exception(f"Error in get_rfp_completion: {e}")
+            logger.exception(f"Error in aget_rfp_completion: {e}")
             return None
     
     def get_sufficiency_completion(self, context: str, question: str, temperature: float = 0.7, trace=None) -> str | None:
@@ -199,68 +367,45 @@ class LLMService:
             str: The generated response
         """
         try:
-            # Format prompt using loader
-            prompt = self.prompt_loader.format_prompt(
-                key="sufficiency_evaluator",
-                context=context,
-                question=question
-            )
-
-            # Get token count and calculate cost
-            tokenizer = get_tokenizer_for_model(self.model_name)
-            input_tokens = tokenizer.count_tokens(prompt)
-            input_cost = self._calculate_token_cost(input_tokens.total_tokens, is_input=True)
-            
-            logger.info(f"Token count: {input_tokens.total_tokens}")
-            logger.info(f"INPUT COST FOR THIS REQUEST: {input_cost}")
-
-            # Create a generation if trace is provided
-            generation = None
-            if trace:
-                generation = trace.generation(
-                    name="sufficiency-evaluation",
-                    model=self.model_name,
-                    input=prompt,
-                    metadata={
-                        "temperature": temperature,
-                    },
-                    usage_details={
-                        "input_tokens": input_tokens.total_tokens,
-                        "total": input_tokens.total_tokens
-                    },
-                    cost_details={
-                        "input": input_cost,
-                        "total": input_cost
-                    }
-                )
+            prompt = self._format_sufficiency_prompt(context, question)
+            request = self._start_generation("sufficiency-evaluation", prompt, temperature, trace)
             
             # Get response with retry handling
-            response_text = self._handle_llm_request(prompt, temperature, generation)
+            response = self._handle_llm_request(prompt, temperature, request["generation"])
             
-            if response_text:
-                # Calculate response tokens and cost
-                output_tokens = tokenizer.count_tokens(response_text)
-                output_cost = self._calculate_token_cost(output_tokens.total_tokens, is_input=False)
-                total_cost = input_cost + output_cost
-                total_tokens = input_tokens.total_tokens + output_tokens.total_tokens
-
-                if generation:
-                    generation.end(
-                        output=response_text,
-                        usage_details={
-                            "input_tokens": input_tokens.total_tokens,
-                            "output_tokens": output_tokens.total_tokens,
-                            "total": total_tokens
-                        },
-                        cost_details={
-                            "input": input_cost,
-                            "output": output_cost,
-                            "total": total_cost
-                        }
-                    )
-                return response_text
+            if response:
+                self._end_generation(request, response)
+                return response.text
             return None
             
         except Exception as e:
             logger.exception(f"Error in get_sufficiency_completion: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    async def aget_sufficiency_completion(self, context: str, question: str, temperature: float = 0.7, trace=None) -> str | None:
+        """
+        Async version of get_sufficiency_completion
+        
+        Args:
+            context (str): Supporting documents
+            question (str): Question to answer
+            temperature (float): Controls randomness (0.0 to 1.0)
+        
+        Returns:
+            str: The generated response
+        """
+        try:
+            prompt = self._format_sufficiency_prompt(context, question)
+            request = self._start_generation("sufficiency-evaluation", prompt, temperature, trace)
+            
+            # Get response with retry handling
+            response = await self._ahandle_llm_request(prompt, temperature, request["generation"])
+            
+            if response:
+                self._end_generation(request, response)
+                return response.text
+            return None
+            
+        except Exception as e:
+            logger.exception(f"Error in aget_sufficiency_completion: {e}")
+            return None
@@ -6,19 +6,31 @@ from langgraph.graph import StateGraph, END, START
 from langfuse.decorators import observe, langfuse_context
 from langfuse import Langfuse
 
-from typing import TypedDict, Literal, List, Dict, Any
+from typing import TypedDict, Literal, List, Dict, Any, Optional, Callable, Awaitable, Tuple
 from typing_extensions import TypedDict
 from datetime import datetime, timezone
 from loguru import logger
 
-from utils import PromptLoader, GCPStorageClient, Database
+from utils import PromptLoader, GCPStorageClient, Database, RequeueMessage
+from utils.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from utils.dataframe_formatter import format_rows
+from utils.answer_cache import AnswerCache
 from services import VectorSearchService, LLMService
 from config import config
 
 import pandas as pd
+import tempfile
+import hashlib
+import asyncio
 import os
 import re
 
+FALLBACK_RESPONSE = "I apologize, but I was unable to generate a response at this time."
+NO_RESPONSE = "No response generated"
+
+# Neighbours retrieved on the first round, each retrieve_more round adds one
+INITIAL_NEIGHBOURS = 3
+
 class AgentState(TypedDict):
     supporting_docs: List[Dict[str, Any]]
     remaining_steps: RemainingSteps
@@ -27,6 +39,8 @@ class AgentState(TypedDict):
     requirements: str
     project_id: int
     user_id: int
+    trace: Any
+    prefetched_matches: Optional[List[MatchNeighbor]]
 
 
 class RFPGraphService:
@@ -37,6 +51,11 @@ class RFPGraphService:
         self.db = Database.get_instance()
         self.llm_service = LLMService()
         self.prompt_loader = PromptLoader()
+        self.answer_cache = AnswerCache()
+        self.lexical_index = LexicalIndex()
+        self.rrf_k = int(config['env'][self.env].get('RRF_K', 60))
+        self.heartbeat_seconds = int(config['env'][self.env].get('RFP_HEARTBEAT_SECONDS', 60))
+        self.claim_timeout_seconds = int(config['env'][self.env].get('RFP_CLAIM_TIMEOUT_SECONDS', 300))
         self.graph = self._create_graph()
         
         # Configure the Langfuse client
@@ -52,7 +71,7 @@ class RFPGraphService:
         #     enabled=True,
         # )
 
-    def _has_supporting_documents(self, state) -> Literal["retrieve", "direct_answer"]:
+    async def _has_supporting_documents(self, state) -> Literal["retrieve", "direct_answer"]:
         """
         Determine if we need to retrieve supporting documents by checking if
         the user has any indexed files in the project
@@ -65,7 +84,8 @@ class RFPGraphService:
         """
         try:
             # Get files for this user and project
-            files = self.db.get_project_files(
+            files = await asyncio.to_thread(
+                self.db.get_project_files,
                 project_id=state["project_id"],
                 user_id=state["user_id"]
             )
@@ -109,7 +129,7 @@ class RFPGraphService:
             "additional_info_needed": additional_info_match.group(1).strip() if additional_info_match else None
         }
 
-    def _is_sufficient_info(self, state) -> Literal["generate", "retrieve_more"]:
+    async def _is_sufficient_info(self, state) -> Literal["generate", "retrieve_more"]:
         """
         Check if we have sufficient information to answer using LLM evaluation
         
@@ -136,10 +156,10 @@ class RFPGraphService:
             question = state["requirements"]
             
             # Get LLM evaluation
-            response = self.llm_service.get_sufficiency_completion(
+            response = await self.llm_service.aget_sufficiency_completion(
                 context=context,
                 question=question,
-                trace=self.current_trace
+                trace=state["trace"]
             )
             
             # Parse response
@@ -161,82 +181,91 @@ class RFPGraphService:
             # Fallback to generate on error
             return "generate"
 
-    def _process_match_neighbors(self, match_group: List[MatchNeighbor]) -> List[str]:
+    async def _process_match_neighbors(self, match_group: List[MatchNeighbor], user_id: int) -> List[Dict[str, str]]:
         """
         Process match neighbors to get document texts within a window around matching chunks
         
         Args:
             match_group: Group of MatchNeighbor objects from vector search
+            user_id: ID of the user who owns the matched files
             
         Returns:
-            List[str]: List of document texts within the configured window
+            List[Dict[str, str]]: Source and text of each window, overlapping windows merged
         """
-        processed_files = set()  # Track which files we've already processed
-        documents = []
+        windows = []
         
         # Configure the window size - 8
         window_before = 4  # Number of chunks to include before match
         window_after = 3  # Number of chunks to include after match
         
         for neighbor in match_group:
-            # Extract file_id, user_id and chunk_number from restricts
+            # Extract file_id and chunk_number from restricts
             file_id = None
-            user_id = None
             chunk_number = None
             for restrict in neighbor.restricts:
                 if restrict.name == "file_id":
                     file_id = int(restrict.allow_tokens[0])
-                elif restrict.name == "user_id":
-                    user_id = int(restrict.allow_tokens[0])
                 elif restrict.name == "chunk_number":
                     chunk_number = int(restrict.allow_tokens[0])
             
-            # Skip if we've already processed this file or missing required info
-            if not all([file_id, user_id, chunk_number]):
+            # Skip if missing required info
+            if not all([file_id, chunk_number]):
                 continue
             
             # Calculate window boundaries
             start_chunk = max(1, chunk_number - window_before)  # Ensure we don't go below 1
             end_chunk = chunk_number + window_after
-            
-            # Get vectors within the window, ordered by chunk number
-            vectors = self.db.get_file_vectors_ordered(
-                file_id=file_id,
-                user_id=user_id,
-                start_chunk=start_chunk,
-                end_chunk=end_chunk
-            )
-            
-            if vectors:  # Only process if we found vectors
-                file_name = self.db.get_file_name(file_id, user_id)
-                complete_text = "\n\n".join(vector['text'] for vector in vectors)
-                documents.append({
-                    "source": file_name,
-                    "text": complete_text
-                })
-                
-                processed_files.add(file_id)
+            windows.append((file_id, start_chunk, end_chunk))
         
-        return documents
+        # Fetch every window, with its file name, in one query
+        vector_windows = await asyncio.to_thread(self.db.get_vector_windows, user_id, windows)
+        
+        return [
+            {
+                "source": window["source"],
+                "text": "\n\n".join(window["texts"])
+            }
+            for window in vector_windows
+        ]
 
     @observe(as_type="retrieval") 
-    def _retrieve_documents(self, state):
+    async def _retrieve_documents(self, state):
         try:
             query = state["requirements"]
             
             # Create a retrieval span
-            retrieval_span = self.current_trace.span(
+            retrieval_span = state["trace"].span(
                 name="document-retrieval",
                 input=query
             )
             
-            # Get search results
-            results = self.vector_search.search(
-                query=query,
-                user_id=state["user_id"],
-                project_id=state["project_id"],
-                limit=state["neighbours"]
-            )
+            # Get search results, the first round may have been fetched with the rest of the RFP
+            vector_results = state.get("prefetched_matches")
+            if vector_results is not None:
+                # Prefetched results are final even if empty, None means they weren't fetched
+                vector_results = vector_results[:state["neighbours"]]
+            else:
+                vector_results = await self.vector_search.asearch(
+                    query=query,
+                    user_id=state["user_id"],
+                    project_id=state["project_id"],
+                    limit=state["neighbours"]
+                )
+            
+            # Exact terms like part numbers, standards codes and acronyms, fused with the vector hits
+            lexical_results = []
+            if self.lexical_index.enabled:
+                try:
+                    lexical_results = await asyncio.to_thread(
+                        self.lexical_index.search,
+                        query,
+                        state["user_id"],
+                        state["project_id"],
+                        state["neighbours"]
+                    )
+                except Exception as e:
+                    logger.exception(f"Error searching lexical index: {e}")
+            results = reciprocal_rank_fusion([vector_results, lexical_results], limit=state["neighbours"], k=self.rrf_k)
             
             # Process each match group and track metadata
             supporting_docs = []
@@ -248,14 +277,16 @@ class RFPGraphService:
                     metadata[restrict.name] = restrict.allow_tokens[0]
                 retrieval_metadata.append(metadata)
                 
-            documents = self._process_match_neighbors(results)
+            documents = await self._process_match_neighbors(results, state["user_id"])
             supporting_docs.extend(documents)
             
             # Update retrieval span with results
             retrieval_span.end(
                 output=supporting_docs,
                 metadata={
-                    "retrieved_chunks": retrieval_metadata
+                    "retrieved_chunks": retrieval_metadata,
+                    "vector_hits": len(vector_results),
+                    "lexical_hits": len(lexical_results)
                 }
             )
             
@@ -267,7 +298,8 @@ class RFPGraphService:
                     metadata={"warning": error_msg}
                 )
             
-            return {"supporting_docs": supporting_docs}
+            # Later rounds search again with more neighbours
+            return {"supporting_docs": supporting_docs, "prefetched_matches": None}
             
         except Exception as e:
             error_msg = f"Error retrieving documents: {str(e)}"
@@ -277,10 +309,10 @@ class RFPGraphService:
                     level="ERROR",
                     metadata={"error": error_msg}
                 )
-            return {"supporting_docs": []}
+            return {"supporting_docs": [], "prefetched_matches": None}
 
     @observe(as_type="generation")
-    def _generate_answer(self, state):
+    async def _generate_answer(self, state):
         try:
             # Format context with source information
             context_parts = []
@@ -293,7 +325,7 @@ class RFPGraphService:
             context = "\n\n".join(context_parts)
             
             # # Create final generation
-            # final_generation = self.current_trace.generation(
+            # final_generation = state["trace"].generation(
             #     name="final-response",
             #     model=config['env'][self.env]['GCP_LLM_MODEL_NAME'],
             #     input={
@@ -303,10 +335,10 @@ class RFPGraphService:
             # )
             
             # Get completion from LLM
-            response = self.llm_service.get_rfp_completion(
+            response = await self.llm_service.aget_rfp_completion(
                 context=context,
                 new_requirements=state["requirements"],
-                trace=self.current_trace
+                trace=state["trace"]
             )
             
             if not response:
@@ -317,14 +349,14 @@ class RFPGraphService:
                 #     status_message="Response not received from LLM",
                 #     metadata={"error": error_msg}
                 # )
-                response = "I apologize, but I was unable to generate a response at this time."
+                response = FALLBACK_RESPONSE
             
             # End the generation with the response
             # final_generation.end(
             #     output=response
             # )
 
-            self.current_trace.update(
+            state["trace"].update(
                 level="INFO",
                 input=state["requirements"],
                 output=response
@@ -340,7 +372,7 @@ class RFPGraphService:
                 #     level="ERROR",
                 #     metadata={"error": error_msg}
                 # )
-            return {"ai_response": "I apologize, but I was unable to generate a response at this time."}
+            return {"ai_response": FALLBACK_RESPONSE}
 
     def _increase_neighbours(self, state):
         return {"neighbours": state["neighbours"] + 1}
@@ -375,99 +407,474 @@ class RFPGraphService:
         
         return workflow.compile()
 
+    async def _process_row(
+        self,
+        row_number: int,
+        requirements: str,
+        session_id: str,
+        rfp_name: str,
+        project_id: int,
+        project_name: str,
+        user_id: int,
+        username: str,
+        file_set_hash: str,
+        cache_key: Optional[str] = None,
+        embed: Optional[Callable[[], Awaitable[List[float]]]] = None,
+        prefetch: Optional[Callable[[], Awaitable[Optional[List[MatchNeighbor]]]]] = None
+    ) -> str:
+        """
+        Run the graph for a single RFP row, unless the answer cache already has an answer
+        
+        Every row gets its own trace and graph state so rows can safely run
+        concurrently on the same event loop
+        
+        Args:
+            row_number: 1-based row number in the RFP
+            requirements: Formatted requirements text for the row
+            session_id: Langfuse session ID shared by all rows of the RFP
+            file_set_hash: Fingerprint of the project's files, scopes cached answers
+            cache_key: Requirement columns of the row the answer is cached under, the cache is skipped if None
+            embed: Returns the row's query embedding, embedded in a batch with other rows
+            prefetch: Returns the row's first round of neighbours, searched in a batch with other rows,
+                      or None if the batch search failed
+            
+        Returns:
+            str: The AI response for the row
+        """
+        # Create a new trace for each row
+        trace = self.langfuse_client.trace(
+            name=f"RFP Row {row_number}",
+            session_id=session_id,
+            user_id=username,
+            metadata={
+                "row_number": row_number,
+                "project_id": project_id,
+                "project_name": project_name,
+                "file_name": rfp_name,
+                "user_id": user_id
+            }
+        )
+        
+        # Reuse the answer to an identical, or in similarity mode a close enough, requirement
+        query_embedding = None
+        if cache_key is not None and self.answer_cache.uses_embeddings:
+            try:
+                # Embedded once with the prefetch chunk when there is one, and the batched search reuses it
+                query_embedding = await embed() if embed else await self.vector_search.aembed_query(requirements)
+            except Exception as e:
+                logger.exception(f"Error embedding requirement for answer cache lookup: {e}")
+        
+        cached_answer = None
+        if cache_key is not None:
+            try:
+                cached_answer = await asyncio.to_thread(
+                    self.answer_cache.get,
+                    project_id,
+                    file_set_hash,
+                    cache_key,
+                    query_embedding
+                )
+            except Exception as e:
+                logger.exception(f"Error looking up cached answer for row {row_number}, treating it as a miss: {e}")
+        if cached_answer is not None:
+            logger.debug(f"Answer cache hit for row {row_number}")
+            trace.update(
+                level="INFO",
+                input=requirements,
+                output=cached_answer
+            )
+            return cached_answer
+        
+        # Only wait for the batched search once the row actually needs retrieval
+        prefetched_matches = None
+        if prefetch:
+            prefetched_matches = await prefetch()
+        
+        # Initialize graph state
+        state = {
+            "requirements": requirements,
+            "supporting_docs": [],
+            "user_id": user_id,
+            "project_id": project_id,
+            "neighbours": INITIAL_NEIGHBOURS,
+            "ai_response": NO_RESPONSE,
+            "trace": trace,
+            "prefetched_matches": prefetched_matches
+        }
+        
+        # Run the graph
+        logger.debug(f"Running graph for row {row_number}")
+        final_state = await self.graph.ainvoke(state, {"recursion_limit": int(config['env'][self.env]['RECURSION_LIMIT'])})
+        answer = final_state["ai_response"]
+        
+        if cache_key is not None and answer not in (FALLBACK_RESPONSE, NO_RESPONSE):
+            try:
+                await asyncio.to_thread(
+                    self.answer_cache.put,
+                    project_id,
+                    file_set_hash,
+                    cache_key,
+                    answer,
+                    query_embedding
+                )
+            except Exception as e:
+                logger.exception(f"Error caching answer for row {row_number}: {e}")
+        
+        return answer
+
+    def _group_duplicate_rows(self, df: pd.DataFrame, columns: List[str]) -> List[List[int]]:
+        """
+        Group the positions of rows that share the same requirement
+        
+        Rows are fingerprinted on the given columns, with case and whitespace normalized
+        
+        Args:
+            df: RFP DataFrame
+            columns: Columns that identify a requirement
+            
+        Returns:
+            List[List[int]]: Row positions per unique requirement, in order of first occurrence
+        """
+        missing_columns = [column for column in columns if column not in df.columns]
+        if missing_columns:
+            logger.warning(f"Dedup columns {missing_columns} not found in RFP, fingerprinting on the others")
+            columns = [column for column in columns if column in df.columns]
+            if not columns:
+                logger.warning("None of the dedup columns are in the RFP, every row is processed")
+                return [[i] for i in range(len(df))]
+        
+        groups = {}
+        for position, values in enumerate(df[columns].itertuples(index=False, name=None)):
+            fingerprint = hashlib.sha256("\x1f".join(
+                re.sub(r"\s+", " ", str(value)).strip().lower() for value in values
+            ).encode('utf-8')).hexdigest()
+            groups.setdefault(fingerprint, []).append(position)
+        
+        return list(groups.values())
+
+    def _answer_cache_keys(self, df: pd.DataFrame, columns: Optional[List[str]]) -> List[Optional[str]]:
+        """
+        Text each row's answer is cached under, its requirement columns only so row IDs and
+        other per-row columns do not make every requirement unique
+        
+        Args:
+            df: RFP DataFrame
+            columns: Columns that identify a requirement
+            
+        Returns:
+            List[Optional[str]]: Cache key per row, all None when the cache can't be used
+        """
+        if not self.answer_cache.enabled:
+            return [None] * len(df)
+        
+        present_columns = [column for column in columns or [] if column in df.columns]
+        if not present_columns:
+            logger.info(f"Answer cache skipped, none of the requirement columns {columns} are in the RFP")
+            return [None] * len(df)
+        
+        return format_rows(df[present_columns])
+
+    def _read_rfp(self, file_buffer, gcp_path: str) -> Tuple[pd.DataFrame, str]:
+        """
+        Parse the RFP sheet, blocking so it runs in a worker thread
+        
+        Args:
+            file_buffer: Binary file object with the sheet
+            gcp_path: Path of the sheet in the bucket, for its extension
+            
+        Returns:
+            Tuple[pd.DataFrame, str]: The rows and the extension to save the answers with
+        """
+        with file_buffer:
+            if gcp_path.lower().endswith('.csv'):
+                return pd.read_csv(file_buffer), 'csv'
+            return pd.read_excel(file_buffer), 'xlsx'
+
+    def _save_rfp(self, df: pd.DataFrame, processed_filename: str, output_extension: str,
+                  bucket: str, username: str, project_name: str) -> str:
+        """
+        Write the answered RFP and upload it, blocking so it runs in a worker thread
+        
+        Args:
+            df: RFP rows with their answers
+            processed_filename: Name of the file in the bucket
+            output_extension: "csv" or "xlsx"
+            bucket: GCP bucket name
+            username: Username, first part of the path in the bucket
+            project_name: Project name, second part of the path in the bucket
+            
+        Returns:
+            str: Path of the uploaded file in the bucket
+        """
+        # A temporary file of its own, so concurrent runs of same-named RFPs don't overwrite each other's output
+        fd, temp_output_path = tempfile.mkstemp(suffix=f"_{processed_filename}")
+        os.close(fd)
+        
+        try:
+            if output_extension == 'csv':
+                df.to_csv(temp_output_path, index=False)
+            else:
+                df.to_excel(temp_output_path, index=False)
+            
+            # Upload to GCP
+            return self.gcp_client._upload_to_gcp(
+                filename=processed_filename,
+                bucket=bucket,
+                username=username,
+                project_name=project_name,
+                file_path=temp_output_path
+            )
+        finally:
+            # Cleanup
+            self.gcp_client.cleanup_temp_file(temp_output_path)
+
+    async def _claim_rfp(self, rfp_id: int) -> None:
+        """
+        Claim an unfinished RFP for this run. If another run holds it, eg the message was
+        redelivered while still being processed, the message is handed back to Pub/Sub rather
+        than waiting here in one of the rfp slots. A redelivery takes the RFP over once the
+        other run's heartbeat is older than RFP_CLAIM_TIMEOUT_SECONDS, eg after its worker died
+        
+        Args:
+            rfp_id: ID of the RFP
+            
+        Raises:
+            RequeueMessage: If another run is still processing the RFP
+        """
+        if not await asyncio.to_thread(self.db.claim_rfp, rfp_id, self.claim_timeout_seconds):
+            raise RequeueMessage(f"RFP {rfp_id} is still being processed by another run")
+
+    async def _heartbeat(self, rfp_id: int) -> None:
+        """Keep this run's claim on an RFP until cancelled"""
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await asyncio.to_thread(self.db.heartbeat_rfp, rfp_id)
+            except Exception as e:
+                logger.warning(f"Failed to update heartbeat of RFP {rfp_id}: {str(e)}")
+
     @observe()
-    def process_rfp(self, rfp_name: str, bucket: str, gcp_path: str, 
-                         project_id: int, project_name: str, user_id: int, username: str):
+    async def process_rfp(self, rfp_name: str, bucket: str, gcp_path: str, 
+                         project_id: int, project_name: str, user_id: int, username: str,
+                         max_workers: int = None, dedup_columns: List[str] = None):
         """Process RFP using the graph workflow"""
+        rfp_id = None
+        heartbeat_task = None
         try:
-            # Insert into DB
-            rfp_id = self.db.insert_rfp(
+            # Resume an unfinished or failed run of the same RFP, or insert a new one into DB
+            unfinished_rfp = await asyncio.to_thread(
+                self.db.get_unfinished_rfp,
                 name=rfp_name,
                 gcp_path=gcp_path,
                 bucket=bucket,
                 project_id=project_id,
                 user_id=user_id
             )
+            if unfinished_rfp:
+                await self._claim_rfp(unfinished_rfp['id'])
+                rfp_id = unfinished_rfp['id']
+                logger.info(f"Resuming {unfinished_rfp['status']} processing of RFP {rfp_id}")
+            else:
+                rfp_id = await asyncio.to_thread(
+                    self.db.insert_rfp,
+                    name=rfp_name,
+                    gcp_path=gcp_path,
+                    bucket=bucket,
+                    project_id=project_id,
+                    user_id=user_id
+                )
+            heartbeat_task = asyncio.ensure_future(self._heartbeat(rfp_id))
+            
             # Create a unique session ID for this RFP processing
             rfp_name_stripped = rfp_name.replace(" ", "_")
             project_name_stripped = project_name.replace(" ", "_")
             date_time = datetime.now(timezone.utc).strftime("%Y-%m-%d_%H%M%S")
             session_id = f"{rfp_name_stripped}_{project_name_stripped}_{date_time}"
 
-            # Download and read file
-            temp_file_path = self.gcp_client.download_blob_to_temp(bucket, gcp_path)
+            # Download and read file from memory
+            file_buffer = await asyncio.to_thread(self.gcp_client.download_blob_to_buffer, bucket, gcp_path)
+            
+            df, output_extension = await asyncio.to_thread(self._read_rfp, file_buffer, gcp_path)
+            
+            # Build the requirements text for each row up front
+            requirements_list = await asyncio.to_thread(format_rows, df)
+            
+            # Cached answers are only valid for the project's current set of files
+            project_files = await asyncio.to_thread(self.db.get_project_files, project_id=project_id, user_id=user_id)
+            file_set_hash = AnswerCache.hash_file_set(project_files)
             
-            if temp_file_path.endswith('.csv'):
-                df = pd.read_csv(temp_file_path)
-                output_extension = 'csv'
+            # Run the graph once per unique requirement and fan answers out to duplicate rows. Rows are
+            # only fingerprinted on named requirement columns, ID and row number columns would make
+            # every row unique
+            dedup_columns = dedup_columns or config['env'][self.env].get('RFP_DEDUP_COLUMNS', [])
+            if dedup_columns:
+                row_groups = await asyncio.to_thread(self._group_duplicate_rows, df, dedup_columns)
             else:
-                df = pd.read_excel(temp_file_path)
-                output_extension = 'xlsx'
-            
-            answers = []
-            
-            # Process each row
-            for idx, row in df.iterrows():
-                # Create a new trace for each row
-                self.current_trace = self.langfuse_client.trace(
-                    name=f"RFP Row {idx+1}",
-                    session_id=session_id,
-                    user_id=username,
-                    metadata={
-                        "row_number": idx + 1,
-                        "project_id": project_id,
-                        "project_name": project_name,
-                        "file_name": rfp_name,
-                        "user_id": user_id
-                    }
+                logger.info("Skipping duplicate rows detection, no dedup_columns passed or RFP_DEDUP_COLUMNS configured")
+                row_groups = [[i] for i in range(len(df))]
+            
+            saved_calls = len(requirements_list) - len(row_groups)
+            if saved_calls:
+                logger.info(f"Found {len(row_groups)} unique requirements in {len(requirements_list)} rows, skipping {saved_calls} duplicate graph run/s")
+            elif dedup_columns:
+                logger.info(f"No duplicate rows found on columns {dedup_columns}")
+            
+            # Answers are cached under the requirement columns, set in config or the ones rows are deduplicated on
+            cache_keys = await asyncio.to_thread(
+                self._answer_cache_keys,
+                df,
+                config['env'][self.env].get('ANSWER_CACHE_COLUMNS') or dedup_columns
+            )
+            
+            # Reuse answers checkpointed by a previous run, as long as the row is unchanged
+            requirement_hashes = [
+                hashlib.sha256(requirements.encode('utf-8')).hexdigest()
+                for requirements in requirements_list
+            ]
+            checkpoints = await asyncio.to_thread(self.db.get_rfp_row_answers, rfp_id)
+            
+            def checkpointed_answer(group: List[int]) -> Optional[str]:
+                records = [checkpoints.get(position) for position in group]
+                if all(record and record['requirement_hash'] == requirement_hashes[position] for position, record in zip(group, records)):
+                    return records[0]['answer']
+                return None
+            
+            answers = [None] * len(requirements_list)
+            pending_groups = []
+            for group in row_groups:
+                answer = checkpointed_answer(group)
+                if answer is None:
+                    pending_groups.append(group)
+                else:
+                    for position in group:
+                        answers[position] = answer
+            
+            if len(pending_groups) < len(row_groups):
+                logger.info(f"Skipping {len(row_groups) - len(pending_groups)} requirement/s answered by a previous run")
+            
+            max_workers = max_workers or int(config['env'][self.env].get('RFP_MAX_WORKERS', 1))
+            logger.info(f"Processing {len(pending_groups)} rows with up to {max_workers} row/s in flight")
+            
+            # Keep at most max_workers rows in flight
+            semaphore = asyncio.Semaphore(max_workers)
+
+            # First round neighbours are searched for a chunk of rows at a time, in one embedding
+            # request and one find_neighbors call. The next chunk is fetched while this one runs.
+            # The chunk's embeddings also serve the answer cache's similarity lookups
+            prefetch_chunk_size = int(config['env'][self.env].get('RFP_PREFETCH_CHUNK_SIZE', 32))
+            if not any(file['is_indexed'] for file in project_files):
+                prefetch_chunk_size = 0  # Rows are answered without retrieval
+            embed_tasks = {}
+            prefetch_tasks = {}
+
+            def chunk_queries(chunk: int) -> List[str]:
+                chunk_groups = pending_groups[chunk * prefetch_chunk_size:(chunk + 1) * prefetch_chunk_size]
+                return [requirements_list[group[0]] for group in chunk_groups]
+
+            def embed_chunk(chunk: int) -> asyncio.Task:
+                if chunk not in embed_tasks:
+                    embed_tasks[chunk] = asyncio.ensure_future(self.vector_search.aembed_queries(chunk_queries(chunk)))
+                return embed_tasks[chunk]
+
+            async def search_chunk(chunk: int) -> List[Optional[List[MatchNeighbor]]]:
+                queries = chunk_queries(chunk)
+                try:
+                    query_vectors = await embed_chunk(chunk)
+                except Exception as e:
+                    logger.exception(f"Error embedding {len(queries)} prefetched requirements: {e}")
+                    return [None] * len(queries)
+                return await self.vector_search.asearch_many(
+                    queries=queries,
+                    user_id=user_id,
+                    project_id=project_id,
+                    limit=INITIAL_NEIGHBOURS,
+                    query_vectors=query_vectors
                 )
+
+            def prefetch_chunk(chunk: int) -> asyncio.Task:
+                if chunk not in prefetch_tasks:
+                    prefetch_tasks[chunk] = asyncio.ensure_future(search_chunk(chunk))
+                return prefetch_tasks[chunk]
+
+            async def prefetched_embedding(index: int) -> List[float]:
+                embeddings = await embed_chunk(index // prefetch_chunk_size)
+                return embeddings[index % prefetch_chunk_size]
+
+            async def prefetched_matches(index: int) -> Optional[List[MatchNeighbor]]:
+                chunk = index // prefetch_chunk_size
+                if (chunk + 1) * prefetch_chunk_size < len(pending_groups):
+                    prefetch_chunk(chunk + 1)
+                matches = await prefetch_chunk(chunk)
+                return matches[index % prefetch_chunk_size]
+
+            async def process_group(index: int, group: List[int]) -> None:
+                async with semaphore:
+                    answer = await self._process_row(
+                        row_number=group[0] + 1,
+                        requirements=requirements_list[group[0]],
+                        session_id=session_id,
+                        rfp_name=rfp_name,
+                        project_id=project_id,
+                        project_name=project_name,
+                        user_id=user_id,
+                        username=username,
+                        file_set_hash=file_set_hash,
+                        cache_key=cache_keys[group[0]],
+                        embed=(lambda: prefetched_embedding(index)) if prefetch_chunk_size > 0 else None,
+                        prefetch=(lambda: prefetched_matches(index)) if prefetch_chunk_size > 0 else None
+                    )
                 
-                requirements = ""
-                for column in row.index:
-                    requirements += f"{column}: \n{row[column]}\n\n"
-                
-                # Initialize graph state
-                state = {
-                    "requirements": requirements,
-                    "supporting_docs": [],
-                    "user_id": user_id,
-                    "project_id": project_id,
-                    "neighbours": 3,
-                    "ai_response": "No response generated"
-                }
+                for position in group:
+                    answers[position] = answer
                 
-                # Run the graph
-                logger.debug(f"Running graph for row {idx+1}")
-                final_state = self.graph.invoke(state, {"recursion_limit": int(config['env'][self.env]['RECURSION_LIMIT'])})
-                answers.append(final_state["ai_response"])
+                # Checkpoint the rows so a retried message can skip them, failed answers are retried
+                if answer not in (FALLBACK_RESPONSE, NO_RESPONSE):
+                    await asyncio.to_thread(
+                        self.db.save_rfp_row_answers,
+                        rfp_id,
+                        [(position, requirement_hashes[position], answer) for position in group]
+                    )
 
+            # If a row fails, the others are cancelled so they stop calling the LLM and writing
+            # checkpoints once the RFP is marked failed and its message can be redelivered
+            group_tasks = [asyncio.ensure_future(process_group(index, group)) for index, group in enumerate(pending_groups)]
+            try:
+                await asyncio.gather(*group_tasks)
+            except BaseException:
+                for task in group_tasks:
+                    task.cancel()
+                await asyncio.gather(*group_tasks, return_exceptions=True)
+                search_tasks = [*embed_tasks.values(), *prefetch_tasks.values()]
+                for task in search_tasks:
+                    task.cancel()
+                await asyncio.gather(*search_tasks, return_exceptions=True)
+                raise
+
+            logger.info(f"Answer cache stats: {self.answer_cache.stats()}")
+            logger.info(
+                f"LLM concurrency: {self.llm_service.concurrency_controller.metrics()}, "
+                f"embedding concurrency: {self.vector_search.embedding_concurrency.metrics()}"
+            )
             
             # Make sure all events are sent to Langfuse
-            self.langfuse_client.flush()
+            await asyncio.to_thread(self.langfuse_client.flush)
             
             # Add answers column and save
             df['AI Response'] = answers
             processed_filename = f"{rfp_name_stripped}_processed.{output_extension}"
-            temp_output_path = f"/tmp/{processed_filename}"
-            
-            if output_extension == 'csv':
-                df.to_csv(temp_output_path, index=False)
-            else:
-                df.to_excel(temp_output_path, index=False)
             
-            # Upload to GCP
-            processed_gcp_path = self.gcp_client._upload_to_gcp(
-                filename=processed_filename,
-                bucket=bucket,
-                username=username,
-                project_name=project_name
+            processed_gcp_path = await asyncio.to_thread(
+                self._save_rfp,
+                df,
+                processed_filename,
+                output_extension,
+                bucket,
+                username,
+                project_name
             )
             
-            # Cleanup
-            self.gcp_client.cleanup_temp_file(temp_file_path)
-            self.gcp_client.cleanup_temp_file(temp_output_path)
-            
-            self.db.update_rfp_status(
+            await asyncio.to_thread(
+                self.db.update_rfp_status,
                 rfp_id=rfp_id,
                 status='completed',
                 processed_file_path=processed_gcp_path
@@ -479,20 +886,27 @@ class RFPGraphService:
                     "bucket": bucket,
                     "gcp_path": processed_gcp_path
                 },
-                "processed_file": df.to_dict('records')
+                "processed_file": await asyncio.to_thread(df.to_dict, 'records'),
+                "duplicate_rows_skipped": saved_calls
             }
         
 
             
+        except RequeueMessage:
+            raise
+        
         except Exception as e:
             error_msg = f"Error processing RFP with graph: {str(e)}"
             logger.exception(error_msg)
-            self.current_trace.update(
-                level="ERROR",
-                metadata={"error": error_msg}
-            )
-            self.db.update_rfp_status(
-                rfp_id=rfp_id,
-                status='failed'
-            )
-            raise 
\ No newline at end of file
+            await asyncio.to_thread(self.langfuse_client.flush)
+            if rfp_id is not None:
+                await asyncio.to_thread(
+                    self.db.update_rfp_status,
+                    rfp_id=rfp_id,
+                    status='failed'
+                )
+            raise
+        
+        finally:
+            if heartbeat_task:
+                heartbeat_task.cancel() 
\ No newline at end of file
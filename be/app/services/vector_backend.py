@@ -0,0 +1,322 @@
+from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import MatchNeighbor
+from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import Namespace
+from google.cloud.aiplatform.compat.types import (  # type: ignore[attr-defined, unused-ignore]
+    matching_engine_index as meidx_types,
+)
+from google.cloud import aiplatform
+
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any
+from loguru import logger
+
+import numpy as np
+import threading
+import json
+import os
+
+
+class VectorBackend(ABC):
+    """Storage and nearest neighbour search for document embeddings"""
+
+    @abstractmethod
+    def upsert(self, datapoints: List[meidx_types.IndexDatapoint]) -> None:
+        """Insert or replace datapoints"""
+        pass
+
+    @abstractmethod
+    def remove(self, datapoint_ids: List[str]) -> None:
+        """Remove datapoints by ID"""
+        pass
+
+    @abstractmethod
+    def find_neighbors(
+        self,
+        queries: List[List[float]],
+        num_neighbors: int,
+        filter: List[Namespace]
+    ) -> List[List[MatchNeighbor]]:
+        """Find the nearest datapoints for each query among those allowed by filter"""
+        pass
+
+
+class VertexVectorBackend(VectorBackend):
+    """Vertex AI Vector Search (Matching Engine) backend"""
+
+    def __init__(self, env_config: Dict[str, Any]):
+        # Get the index instance
+        self.index = aiplatform.MatchingEngineIndex(
+            index_name=env_config['GCP_VECTOR_SEARCH_INDEX_NAME']
+        )
+        self.index_endpoint = aiplatform.MatchingEngineIndexEndpoint(
+            index_endpoint_name=env_config['GCP_VECTOR_SEARCH_INDEX_ENDPOINT_NAME']
+        )
+        self.deployed_index_id = env_config['GCP_VECTOR_SEARCH_DEPLOYED_INDEX_ID']
+
+    def upsert(self, datapoints: List[meidx_types.IndexDatapoint]) -> None:
+        self.index.upsert_datapoints(datapoints=datapoints)
+
+    def remove(self, datapoint_ids: List[str]) -> None:
+        self.index.remove_datapoints(datapoint_ids=datapoint_ids)
+
+    def find_neighbors(
+        self,
+        queries: List[List[float]],
+        num_neighbors: int,
+        filter: List[Namespace]
+    ) -> List[List[MatchNeighbor]]:
+        return self.index_endpoint.find_neighbors(
+            deployed_index_id=self.deployed_index_id,
+            queries=queries,
+            num_neighbors=num_neighbors,
+            filter=filter,
+            return_full_datapoint=True
+        )
+
+
+class LocalVectorBackend(VectorBackend):
+    """
+    In-process brute-force backend for small tenants and CI.
+
+    Vectors live in a memory-mapped .npy file preallocated with spare rows, next to an
+    append-only JSON lines log of datapoint IDs, rows and restricts. Upserts write their
+    rows in place and append to the log, the files are only rewritten when the capacity
+    runs out or datapoints are removed. Scores are dot products, like the default Vector
+    Search index.
+    """
+
+    VECTORS_FILE = "vectors.npy"
+    DATAPOINTS_FILE = "datapoints.jsonl"
+    LEGACY_DATAPOINTS_FILE = "datapoints.json"
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._vectors_path = os.path.join(self.path, self.VECTORS_FILE)
+        self._datapoints_path = os.path.join(self.path, self.DATAPOINTS_FILE)
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        """Memory-map the vectors and replay the datapoint log into the ID and restrict lookups"""
+        self._migrate_legacy_datapoints()
+
+        self._datapoints: List[Dict[str, Any]] = []
+        self._positions: Dict[str, int] = {}
+        if os.path.exists(self._datapoints_path):
+            valid_bytes = 0
+            with open(self._datapoints_path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn last line of an append interrupted by a crash
+                        break
+                    valid_bytes += len(line)
+                    row = record.pop('row')
+                    if row < len(self._datapoints):
+                        self._datapoints[row] = record
+                    else:
+                        self._datapoints.append(record)
+                    self._positions[record['id']] = row
+
+            if valid_bytes < os.path.getsize(self._datapoints_path):
+                logger.warning(f"Dropping a partially written datapoint from {self._datapoints_path}")
+                os.truncate(self._datapoints_path, valid_bytes)
+
+        if os.path.exists(self._vectors_path):
+            self._vectors = np.lib.format.open_memmap(self._vectors_path, mode='r+')
+        else:
+            self._vectors = None
+
+        # (namespace, token) -> rows whose restrict for namespace allows token
+        self._token_rows: Dict[tuple, List[int]] = {}
+        for i, datapoint in enumerate(self._datapoints):
+            self._index_restricts(i, datapoint)
+
+        logger.info(f"Loaded local vector index from {self.path} with {len(self._datapoints)} datapoints")
+
+    def _migrate_legacy_datapoints(self) -> None:
+        """Convert the JSON list of datapoints written by earlier versions into the log"""
+        legacy_path = os.path.join(self.path, self.LEGACY_DATAPOINTS_FILE)
+        if not os.path.exists(legacy_path) or os.path.exists(self._datapoints_path):
+            return
+
+        with open(legacy_path, 'r') as f:
+            datapoints = json.load(f)
+        self._write_datapoints(datapoints)
+        os.remove(legacy_path)
+        logger.info(f"Migrated {len(datapoints)} datapoints of {self.path} to {self.DATAPOINTS_FILE}")
+
+    def _index_restricts(self, row: int, datapoint: Dict[str, Any]) -> None:
+        for namespace, tokens in datapoint['restricts'].items():
+            for token in tokens:
+                self._token_rows.setdefault((namespace, token), []).append(row)
+
+    def _unindex_restricts(self, row: int, datapoint: Dict[str, Any]) -> None:
+        for namespace, tokens in datapoint['restricts'].items():
+            for token in tokens:
+                self._token_rows[(namespace, token)].remove(row)
+
+    def _write_datapoints(self, datapoints: List[Dict[str, Any]]) -> None:
+        """Atomically replace the log with one record per row"""
+        with open(self._datapoints_path + ".tmp", 'w') as f:
+            for row, datapoint in enumerate(datapoints):
+                f.write(json.dumps({**datapoint, "row": row}) + "\n")
+        os.replace(self._datapoints_path + ".tmp", self._datapoints_path)
+
+    def _write_vectors(self, vectors: np.ndarray, capacity: int) -> None:
+        """Atomically replace the vectors file with vectors followed by spare rows, and map it"""
+        tmp_path = self._vectors_path + ".tmp.npy"
+        resized = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(capacity, vectors.shape[1]))
+        resized[:len(vectors)] = vectors
+        resized.flush()
+        del resized
+
+        os.replace(tmp_path, self._vectors_path)
+        self._vectors = np.lib.format.open_memmap(self._vectors_path, mode='r+')
+
+    def _ensure_capacity(self, rows: int, dimensions: int) -> None:
+        """Grow the vectors file, doubling it, until it has room for rows"""
+        if self._vectors is None:
+            self._write_vectors(np.zeros((0, dimensions), dtype=np.float32), max(self.INITIAL_CAPACITY, rows))
+            return
+
+        if self._vectors.shape[1] != dimensions:
+            raise ValueError(f"Expected vectors of {self._vectors.shape[1]} dimensions, got {dimensions}")
+
+        if rows > len(self._vectors):
+            used = len(self._datapoints)
+            self._write_vectors(self._vectors[:used], max(rows, 2 * len(self._vectors)))
+
+    def upsert(self, datapoints: List[meidx_types.IndexDatapoint]) -> None:
+        if not datapoints:
+            return
+
+        with self._lock:
+            new_vectors = np.array([list(datapoint.feature_vector) for datapoint in datapoints], dtype=np.float32)
+            records = [
+                {
+                    "id": datapoint.datapoint_id,
+                    "restricts": {
+                        restrict.namespace: list(restrict.allow_list)
+                        for restrict in datapoint.restricts
+                    }
+                }
+                for datapoint in datapoints
+            ]
+
+            # Existing IDs keep their row, new ones are appended after the used rows
+            rows = []
+            next_row = len(self._datapoints)
+            new_positions = {}
+            for record in records:
+                row = self._positions.get(record['id'], new_positions.get(record['id']))
+                if row is None:
+                    row = new_positions[record['id']] = next_row
+                    next_row += 1
+                rows.append(row)
+
+            self._ensure_capacity(next_row, new_vectors.shape[1])
+
+            # Vectors are written before the log, so the log never points at a row not yet written
+            self._vectors[rows] = new_vectors
+            self._vectors.flush()
+            with open(self._datapoints_path, 'a') as f:
+                for row, record in zip(rows, records):
+                    f.write(json.dumps({**record, "row": row}) + "\n")
+
+            for row, record in zip(rows, records):
+                if row < len(self._datapoints):
+                    self._unindex_restricts(row, self._datapoints[row])
+                    self._datapoints[row] = record
+                else:
+                    self._datapoints.append(record)
+                self._positions[record['id']] = row
+                self._index_restricts(row, record)
+
+    def remove(self, datapoint_ids: List[str]) -> None:
+        with self._lock:
+            to_remove = {self._positions[datapoint_id] for datapoint_id in datapoint_ids if datapoint_id in self._positions}
+            if not to_remove:
+                return
+
+            # Compact both files, keeping spare rows for the next upserts
+            keep = [i for i in range(len(self._datapoints)) if i not in to_remove]
+            self._write_vectors(
+                np.array(self._vectors[keep], dtype=np.float32),
+                max(self.INITIAL_CAPACITY, 2 * len(keep))
+            )
+            self._write_datapoints([self._datapoints[i] for i in keep])
+            self._load()
+
+    def _filter_mask(self, filter: List[Namespace]) -> np.ndarray:
+        """Rows allowed by every namespace of the filter and denied by none"""
+        mask = np.ones(len(self._datapoints), dtype=bool)
+
+        for namespace in filter:
+            if namespace.allow_tokens:
+                allowed = np.zeros(len(self._datapoints), dtype=bool)
+                for token in namespace.allow_tokens:
+                    allowed[np.asarray(self._token_rows.get((namespace.name, token), []), dtype=np.int64)] = True
+                mask &= allowed
+            for token in namespace.deny_tokens or []:
+                mask[np.asarray(self._token_rows.get((namespace.name, token), []), dtype=np.int64)] = False
+
+        return mask
+
+    def find_neighbors(
+        self,
+        queries: List[List[float]],
+        num_neighbors: int,
+        filter: List[Namespace]
+    ) -> List[List[MatchNeighbor]]:
+        with self._lock:
+            vectors = self._vectors
+            datapoints = self._datapoints
+            candidates = np.flatnonzero(self._filter_mask(filter)) if datapoints else np.array([], dtype=np.int64)
+
+        results = []
+        for query in queries:
+            if not len(candidates):
+                results.append([])
+                continue
+
+            scores = vectors[candidates] @ np.asarray(query, dtype=np.float32)
+            k = min(num_neighbors, len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            results.append([
+                MatchNeighbor(
+                    id=datapoints[candidates[i]]['id'],
+                    distance=float(scores[i]),
+                    restricts=[
+                        Namespace(name=namespace, allow_tokens=tokens, deny_tokens=[])
+                        for namespace, tokens in datapoints[candidates[i]]['restricts'].items()
+                    ]
+                )
+                for i in top
+            ])
+
+        return results
+
+
+def create_vector_backend(env_config: Dict[str, Any]) -> VectorBackend:
+    """
+    Build the backend selected by VECTOR_BACKEND ("vertex" by default, or "local")
+
+    Args:
+        env_config (Dict[str, Any]): Config of the current environment
+
+    Returns:
+        VectorBackend: The configured backend
+    """
+    backend = env_config.get('VECTOR_BACKEND', 'vertex')
+
+    if backend == 'vertex':
+        return VertexVectorBackend(env_config)
+    if backend == 'local':
+        return LocalVectorBackend(env_config.get('LOCAL_VECTOR_INDEX_PATH', '/tmp/vector_index'))
+
+    raise ValueError(f"Unknown vector backend: {backend}")
@@ -1,16 +1,23 @@
 from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import MatchNeighbor
 from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import Namespace
-from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel, TextEmbedding
+from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
 from google.cloud.aiplatform.compat.types import (  # type: ignore[attr-defined, unused-ignore]
     matching_engine_index as meidx_types,
 )
 from google.cloud import aiplatform
 
+from services.vector_backend import create_vector_backend
+from utils.embedding_cache import EmbeddingCache
+from utils.lexical_index import LexicalIndex
+from utils.concurrency_controller import get_concurrency_controller
+from utils.rate_limiter import get_rate_limiter
 from utils.database import Database
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional
 from loguru import logger
 from config import config
 
+import asyncio
 import math
 import os
 import time
@@ -18,6 +25,12 @@ import time
 class VectorSearchService:
     _instance = None
 
+    # Per-request limits of the Vertex AI text embedding models
+    EMBEDDING_MAX_INSTANCES = 250
+    EMBEDDING_MAX_TOKENS = 20000
+    EMBEDDING_CHARS_PER_TOKEN = 3
+    EMBEDDING_DIMENSIONALITY = 768
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(VectorSearchService, cls).__new__(cls)
@@ -36,16 +49,28 @@ class VectorSearchService:
             location=config['env'][self.env]['GCP_LOCATION']
         )
         
-        self.model = TextEmbeddingModel.from_pretrained(config['env'][self.env]['GCP_EMBEDDING_MODEL_NAME'])
+        self.model_name = config['env'][self.env]['GCP_EMBEDDING_MODEL_NAME']
+        self.model = TextEmbeddingModel.from_pretrained(self.model_name)
+        self.embedding_cache = EmbeddingCache()
         
-        # Get the index instance
-        self.index = aiplatform.MatchingEngineIndex(
-            index_name=config['env'][self.env]['GCP_VECTOR_SEARCH_INDEX_NAME']
-        )
-        self.index_endpoint = aiplatform.MatchingEngineIndexEndpoint(
-            index_endpoint_name=config['env'][self.env]['GCP_VECTOR_SEARCH_INDEX_ENDPOINT_NAME']
-        )
-        self.deployed_index_id = config['env'][self.env]['GCP_VECTOR_SEARCH_DEPLOYED_INDEX_ID']
+        # Vector storage and search, Vertex AI Vector Search or a local index
+        self.backend = create_vector_backend(config['env'][self.env])
+
+        # Budgets shared by every embedding request and every index call of the process
+        self.embedding_rate_limiter = get_rate_limiter(self.model_name)
+        self.vector_search_rate_limiter = get_rate_limiter("vector_search")
+
+        # Calls in flight, adapted to latency and 429s
+        self.embedding_concurrency = get_concurrency_controller(self.model_name)
+        self.vector_search_concurrency = get_concurrency_controller("vector_search")
+
+        # Embedding batching
+        env_config = config['env'][self.env]
+        self.embedding_max_instances = int(env_config.get('EMBEDDING_BATCH_MAX_INSTANCES', self.EMBEDDING_MAX_INSTANCES))
+        self.embedding_max_tokens = int(env_config.get('EMBEDDING_BATCH_MAX_TOKENS', self.EMBEDDING_MAX_TOKENS))
+
+        # Datapoints per remove_datapoints call when deleting many files
+        self.vector_remove_batch_size = int(env_config.get('VECTOR_REMOVE_BATCH_SIZE', 1000))
 
         # Database
         self.db = Database.get_instance()
@@ -54,7 +79,7 @@ class VectorSearchService:
     
     def prepare_vector_search_datapoints(
         self,
-        embeddings: List[TextEmbedding],
+        embeddings: List[List[float]],
         documents: List[Dict[str, Any]],
     ) -> Dict[str, Any]:
         """
@@ -107,7 +132,7 @@ class VectorSearchService:
 
             datapoint = meidx_types.IndexDatapoint(
                 datapoint_id=doc['vector_id'],
-                feature_vector=embedding.values,
+                feature_vector=embedding,
                 restricts=restricts
             )
 
@@ -115,6 +140,84 @@ class VectorSearchService:
             
         return datapoints
     
+    def _search_filter(self, user_id: int, project_id: int) -> List[Namespace]:
+        """Restrictions limiting search results to the user's project"""
+        return [
+            Namespace(
+                name="project_id",
+                allow_tokens=[str(project_id)],
+                deny_tokens=[]
+            ),
+            Namespace(
+                name="user_id",
+                allow_tokens=[str(user_id)],
+                deny_tokens=[]
+            )
+        ]
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Embed a search query, consulting the embedding cache first
+        
+        Args:
+            query (str): The query to embed
+            
+        Returns:
+            List[float]: Query embedding values
+        """
+        cached = self.embedding_cache.get_many(self.model_name, "QUESTION_ANSWERING", self.EMBEDDING_DIMENSIONALITY, [query])[0]
+        if cached is not None:
+            return cached
+        
+        input = [TextEmbeddingInput(query, "QUESTION_ANSWERING")]
+        
+        # Paced by the shared rate limiter, retried with jittered backoff
+        embedding = self.embedding_rate_limiter.call(
+            self.embedding_concurrency.wrap(self.model.get_embeddings),
+            input,
+            output_dimensionality=self.EMBEDDING_DIMENSIONALITY,
+            tokens=self._estimate_tokens(query),
+            retry_on=(Exception,)
+        )
+        query_vector = embedding[0].values
+        
+        self.embedding_cache.put_many(self.model_name, "QUESTION_ANSWERING", self.EMBEDDING_DIMENSIONALITY, [query], [query_vector])
+        return query_vector
+
+    async def aembed_query(self, query: str) -> List[float]:
+        """
+        Async version of embed_query
+        
+        Args:
+            query (str): The query to embed
+            
+        Returns:
+            List[float]: Query embedding values
+        """
+        # The cache is a SQLite file, read and written in a worker thread
+        cached = (await asyncio.to_thread(
+            self.embedding_cache.get_many, self.model_name, "QUESTION_ANSWERING", self.EMBEDDING_DIMENSIONALITY, [query]
+        ))[0]
+        if cached is not None:
+            return cached
+        
+        input = [TextEmbeddingInput(query, "QUESTION_ANSWERING")]
+        
+        # Paced by the shared rate limiter, retried with jittered backoff
+        embedding = await self.embedding_rate_limiter.acall(
+            self.embedding_concurrency.awrap(self.model.get_embeddings_async),
+            input,
+            output_dimensionality=self.EMBEDDING_DIMENSIONALITY,
+            tokens=self._estimate_tokens(query),
+            retry_on=(Exception,)
+        )
+        query_vector = embedding[0].values
+        
+        await asyncio.to_thread(
+            self.embedding_cache.put_many, self.model_name, "QUESTION_ANSWERING", self.EMBEDDING_DIMENSIONALITY, [query], [query_vector]
+        )
+        return query_vector
+
     def search(self, query: str, user_id: int, project_id: int, limit: int = 5) -> List[MatchNeighbor]:
         """
         Search for the most relevant documents in the index
@@ -130,61 +233,308 @@ class VectorSearchService:
         """
         try:
             # Encode query
-            input = [TextEmbeddingInput(query, "QUESTION_ANSWERING")]
-            
-            # Add retry mechanism with exponential backoff for embedding generation
-            max_retries = 5
-            base_sleep_time = 20  # seconds
-            for retry in range(max_retries):
-                try:
-                    embedding = self.model.get_embeddings(input, output_dimensionality=768)
-                    query_vector = embedding[0].values
-                    break
-                except Exception as e:
-                    if retry == max_retries - 1:  # Last retry
-                        raise e
-                    
-                    sleep_time = base_sleep_time * (2 ** retry)  # Exponential backoff
-                    logger.warning(f"Rate limit hit while generating embeddings, retrying in {sleep_time} seconds... (Attempt {retry + 1}/{max_retries})")
-                    time.sleep(sleep_time)
+            query_vector = self.embed_query(query)
             
             # Prepare restrictions for filtering
-            filter = [
-                Namespace(
-                    name="project_id",
-                    allow_tokens=[str(project_id)],
-                    deny_tokens=[]
-                ),
-                Namespace(
-                    name="user_id",
-                    allow_tokens=[str(user_id)],
-                    deny_tokens=[]
-                )
-            ]
+            filter = self._search_filter(user_id, project_id)
             
-            # Add retry mechanism with exponential backoff for search
-            for retry in range(max_retries):
-                try:
-                    response = self.index_endpoint.find_neighbors(
-                        deployed_index_id=self.deployed_index_id,
-                        queries=[query_vector],
-                        num_neighbors=limit,
-                        filter=filter,
-                        return_full_datapoint=True
-                    )
-                    return response[0]
-                except Exception as e:
-                    if retry == max_retries - 1:  # Last retry
-                        raise e
-                    
-                    sleep_time = base_sleep_time * (2 ** retry)  # Exponential backoff
-                    logger.warning(f"Rate limit hit while searching, retrying in {sleep_time} seconds... (Attempt {retry + 1}/{max_retries})")
-                    time.sleep(sleep_time)
+            # Paced by the shared rate limiter, retried with jittered backoff
+            response = self.vector_search_rate_limiter.call(
+                self.vector_search_concurrency.wrap(self.backend.find_neighbors),
+                queries=[query_vector],
+                num_neighbors=limit,
+                filter=filter,
+                retry_on=(Exception,)
+            )
+            return response[0]
             
         except Exception as e:
             logger.exception(f"Error searching vector index: {e}")
             return []
 
+    async def asearch(self, query: str, user_id: int, project_id: int, limit: int = 5) -> List[MatchNeighbor]:
+        """
+        Async version of search. The embedding is requested with the async
+        Vertex client and the backend search runs in a worker thread, so the
+        event loop is free while waiting on the network
+        
+        Args:
+            query (str): The query to search for
+            user_id (int): User ID for filtering
+            project_id (int): Project ID for filtering
+            limit (int): Number of results to return
+            
+        Returns:
+            List[MatchNeighbor]: List of matched documents with scores
+        """
+        try:
+            # Encode query
+            query_vector = await self.aembed_query(query)
+            
+            # Prepare restrictions for filtering
+            filter = self._search_filter(user_id, project_id)
+            
+            # Paced by the shared rate limiter, retried with jittered backoff
+            response = await self.vector_search_rate_limiter.acall(
+                self.vector_search_concurrency.awrap(asyncio.to_thread),
+                self.backend.find_neighbors,
+                queries=[query_vector],
+                num_neighbors=limit,
+                filter=filter,
+                retry_on=(Exception,)
+            )
+            return response[0]
+            
+        except Exception as e:
+            logger.exception(f"Error searching vector index: {e}")
+            return []
+
+    async def asearch_many(
+        self,
+        queries: List[str],
+        user_id: int,
+        project_id: int,
+        limit: int = 5,
+        query_vectors: Optional[List[List[float]]] = None
+    ) -> List[Optional[List[MatchNeighbor]]]:
+        """
+        Search for several queries at once, embedding them in as few requests as the model
+        limits allow and querying the index with a single find_neighbors call. Failed searches
+        are None rather than empty, so callers can tell them from queries with no matches
+        
+        Args:
+            queries (List[str]): The queries to search for
+            user_id (int): User ID for filtering
+            project_id (int): Project ID for filtering
+            limit (int): Number of results to return per query
+            query_vectors (List[List[float]], optional): Embeddings of the queries, if already computed
+            
+        Returns:
+            List[Optional[List[MatchNeighbor]]]: Matched documents for each query, in the same order,
+                                                 None for every query if the search failed
+        """
+        if not queries:
+            return []
+        
+        try:
+            # Encode queries, cached ones are reused
+            if query_vectors is None:
+                query_vectors = await self.aembed_queries(queries)
+            
+            # Paced by the shared rate limiter, retried with jittered backoff
+            return await self.vector_search_rate_limiter.acall(
+                self.vector_search_concurrency.awrap(asyncio.to_thread),
+                self.backend.find_neighbors,
+                queries=query_vectors,
+                num_neighbors=limit,
+                filter=self._search_filter(user_id, project_id),
+                retry_on=(Exception,)
+            )
+            
+        except Exception as e:
+            logger.exception(f"Error searching vector index for {len(queries)} queries: {e}")
+            return [None for _ in queries]
+
+    async def aembed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Async embedding of several search queries. Cached embeddings are reused and the
+        distinct missing queries are packed into as few requests as the model limits allow
+        
+        Args:
+            queries (List[str]): The queries to embed
+            
+        Returns:
+            List[List[float]]: Query embedding values, in the same order as queries
+        """
+        embeddings = await asyncio.to_thread(
+            self.embedding_cache.get_many, self.model_name, "QUESTION_ANSWERING", self.EMBEDDING_DIMENSIONALITY, queries
+        )
+        missing_queries = list(dict.fromkeys(
+            query for query, embedding in zip(queries, embeddings) if embedding is None
+        ))
+        if not missing_queries:
+            return embeddings
+        
+        batches = self._pack_embedding_batches(missing_queries)
+        batch_embeddings = await asyncio.gather(*[
+            self._aembed_batch([missing_queries[i] for i in batch], "QUESTION_ANSWERING")
+            for batch in batches
+        ])
+        
+        new_embeddings = [None] * len(missing_queries)
+        for batch, values in zip(batches, batch_embeddings):
+            for i, embedding in zip(batch, values):
+                new_embeddings[i] = embedding
+        await asyncio.to_thread(
+            self.embedding_cache.put_many, self.model_name, "QUESTION_ANSWERING", self.EMBEDDING_DIMENSIONALITY, missing_queries, new_embeddings
+        )
+        
+        embeddings_by_query = dict(zip(missing_queries, new_embeddings))
+        return [
+            embedding if embedding is not None else embeddings_by_query[query]
+            for query, embedding in zip(queries, embeddings)
+        ]
+
+    def _estimate_tokens(self, text: str) -> int:
+        """
+        Cheap upper-bound estimate of the embedding model's token count for a text.
+        Errs on the high side so packed batches stay under the per-request token limit
+        """
+        return math.ceil(len(text) / self.EMBEDDING_CHARS_PER_TOKEN) + 1
+
+    def _pack_embedding_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Pack texts into batches that respect the model's per-request instance and token limits
+        
+        Args:
+            texts (List[str]): Texts to embed
+            
+        Returns:
+            List[List[int]]: Batches of indexes into texts, in the original order
+        """
+        batches = []
+        batch = []
+        batch_tokens = 0
+        
+        for i, text in enumerate(texts):
+            tokens = self._estimate_tokens(text)
+            if batch and (
+                len(batch) >= self.embedding_max_instances or
+                batch_tokens + tokens > self.embedding_max_tokens
+            ):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            
+            batch.append(i)
+            batch_tokens += tokens
+        
+        if batch:
+            batches.append(batch)
+        
+        return batches
+
+    def _embed_batch(self, batch_texts: List[str], task_type: str) -> List[List[float]]:
+        """
+        Embed a single packed batch, paced by the shared rate limiter
+        
+        Args:
+            batch_texts (List[str]): Texts in the batch
+            task_type (str): Embedding task type, eg RETRIEVAL_DOCUMENT
+            
+        Returns:
+            List[List[float]]: Embedding values for each text
+        """
+        batch_inputs = [TextEmbeddingInput(text, task_type) for text in batch_texts]
+        
+        # Paced by the shared rate limiter, retried with jittered backoff
+        batch_embeddings = self.embedding_rate_limiter.call(
+            self.embedding_concurrency.wrap(self.model.get_embeddings),
+            batch_inputs,
+            output_dimensionality=self.EMBEDDING_DIMENSIONALITY,
+            auto_truncate=False,
+            tokens=sum(self._estimate_tokens(text) for text in batch_texts),
+            retry_on=(Exception,)
+        )
+        return [embedding.values for embedding in batch_embeddings]
+
+    async def _aembed_batch(self, batch_texts: List[str], task_type: str) -> List[List[float]]:
+        """
+        Async version of _embed_batch
+        
+        Args:
+            batch_texts (List[str]): Texts in the batch
+            task_type (str): Embedding task type, eg QUESTION_ANSWERING
+            
+        Returns:
+            List[List[float]]: Embedding values for each text
+        """
+        batch_inputs = [TextEmbeddingInput(text, task_type) for text in batch_texts]
+        
+        # Paced by the shared rate limiter, retried with jittered backoff
+        batch_embeddings = await self.embedding_rate_limiter.acall(
+            self.embedding_concurrency.awrap(self.model.get_embeddings_async),
+            batch_inputs,
+            output_dimensionality=self.EMBEDDING_DIMENSIONALITY,
+            auto_truncate=False,
+            tokens=sum(self._estimate_tokens(text) for text in batch_texts),
+            retry_on=(Exception,)
+        )
+        return [embedding.values for embedding in batch_embeddings]
+
+    def generate_embeddings(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[List[float]]:
+        """
+        Generate embeddings for texts. Cached embeddings are reused and only
+        the distinct texts missing from the cache are sent to the model
+        
+        Args:
+            texts (List[str]): Texts to embed
+            task_type (str): Embedding task type
+            
+        Returns:
+            List[List[float]]: Embedding values, in the same order as texts
+        """
+        embeddings = self.embedding_cache.get_many(self.model_name, task_type, self.EMBEDDING_DIMENSIONALITY, texts)
+        missing_texts = list(dict.fromkeys(
+            text for text, embedding in zip(texts, embeddings) if embedding is None
+        ))
+        
+        if missing_texts:
+            new_embeddings = self._embed_texts(missing_texts, task_type)
+            self.embedding_cache.put_many(self.model_name, task_type, self.EMBEDDING_DIMENSIONALITY, missing_texts, new_embeddings)
+            
+            embeddings_by_text = dict(zip(missing_texts, new_embeddings))
+            embeddings = [
+                embedding if embedding is not None else embeddings_by_text[text]
+                for text, embedding in zip(texts, embeddings)
+            ]
+        
+        logger.info(f"Embedding cache: {len(texts) - len(missing_texts)} of {len(texts)} texts reused, totals {self.embedding_cache.stats()}")
+        return embeddings
+
+    def _embed_texts(self, texts: List[str], task_type: str) -> List[List[float]]:
+        """
+        Embed texts with the model, packing them into as few requests as the model
+        limits allow and dispatching them concurrently, as many at once as the adaptive
+        concurrency controller allows
+        
+        Args:
+            texts (List[str]): Texts to embed
+            task_type (str): Embedding task type
+            
+        Returns:
+            List[List[float]]: Embedding values, in the same order as texts
+        """
+        embeddings = [None] * len(texts)
+        batches = self._pack_embedding_batches(texts)
+        start_time = time.perf_counter()
+        
+        logger.debug(f"Generating embeddings for {len(texts)} texts in {len(batches)} batch/es, {self.embedding_concurrency.metrics()}")
+        
+        # Threads are capped by the controller's max limit, the controller decides how many send at once
+        with ThreadPoolExecutor(max_workers=min(len(batches), self.embedding_concurrency.max_limit) or 1) as executor:
+            futures = {
+                executor.submit(self._embed_batch, [texts[i] for i in batch], task_type): batch
+                for batch in batches
+            }
+            for batch_number, future in enumerate(as_completed(futures), 1):
+                batch = futures[future]
+                for i, values in zip(batch, future.result()):
+                    embeddings[i] = values
+                logger.debug(f"Generated embeddings for batch {batch_number} out of {len(batches)}")
+        
+        # Report throughput so batch limits and concurrency can be tuned per environment
+        elapsed = time.perf_counter() - start_time
+        if texts and elapsed > 0:
+            total_tokens = sum(self._estimate_tokens(text) for text in texts)
+            logger.info(
+                f"Embedded {len(texts)} texts (~{total_tokens} tokens) in {elapsed:.2f}s: "
+                f"{len(texts) / elapsed:.1f} texts/sec, ~{total_tokens / elapsed:.0f} tokens/sec, "
+                f"concurrency {self.embedding_concurrency.metrics()}"
+            )
+        
+        return embeddings
+
     def insert(self, documents: Dict[str, Any]) -> bool:
         """
         Insert documents into the vector index
@@ -197,45 +547,18 @@ class VectorSearchService:
         """
         try:
             # Generate embeddings for all documents
-            embeddings = []
-            batch_size = 2
             texts = [doc['page_content'] for doc in documents]
-            number_of_batches = math.ceil(len(texts) / batch_size)
-            batch_number = 0
-            
-            # Generate embeddings in batches
-            for i in range(0, len(texts), batch_size):
-                batch_number += 1
-                logger.debug(f"Generating embeddings for batch {batch_number} out of {number_of_batches}")
-
-                batch_texts = texts[i:i + batch_size]
-                batch_inputs = [TextEmbeddingInput(text, "RETRIEVAL_DOCUMENT") for text in batch_texts]
-                
-                # Add retry mechanism with exponential backoff
-                max_retries = 3
-                base_sleep_time = 20  # seconds
-                for retry in range(max_retries):
-                    try:
-                        batch_embeddings = self.model.get_embeddings(
-                            batch_inputs, 
-                            output_dimensionality=768, 
-                            auto_truncate=False
-                        )
-                        embeddings.extend(batch_embeddings)
-                        break
-                    except Exception as e:
-                        if retry == max_retries - 1:  # Last retry
-                            raise e
-                        
-                        sleep_time = base_sleep_time * (2 ** retry)  # Exponential backoff
-                        logger.warning(f"Rate limit hit, retrying in {sleep_time} seconds... (Attempt {retry + 1}/{max_retries})")
-                        time.sleep(sleep_time)
+            embeddings = self.generate_embeddings(texts, "RETRIEVAL_DOCUMENT")
 
             # Prepare datapoints
             datapoints = self.prepare_vector_search_datapoints(embeddings, documents)
 
             # Upsert datapoints to the index
-            self.index.upsert_datapoints(datapoints=datapoints)
+            self.vector_search_rate_limiter.call(
+                self.vector_search_concurrency.wrap(self.backend.upsert),
+                datapoints,
+                retry_on=(Exception,)
+            )
             
             return True
             
@@ -262,13 +585,53 @@ class VectorSearchService:
                 
             # Delete from Vector Search
             vector_ids = [record['vector_id'] for record in vector_records]
-            self.index.remove_datapoints(datapoint_ids=vector_ids)
+            self.vector_search_rate_limiter.call(
+                self.vector_search_concurrency.wrap(self.backend.remove),
+                vector_ids,
+                retry_on=(Exception,)
+            )
             
-            # Delete from database
+            # Delete from database and the lexical index
             self.db.delete_vectors_by_file(file_id, user_id)
+            LexicalIndex().remove_file(file_id, user_id)
             
             return True
             
         except Exception as e:
             logger.exception(f"Error deleting documents: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    def delete_files(self, file_ids: List[int], user_id: int, project_id: int) -> bool:
+        """
+        Delete the documents of several files, eg a whole project, from the vector index
+        
+        Args:
+            file_ids (List[int]): IDs of the files whose vectors to delete
+            user_id (int): ID of the user who owns the files
+            project_id (int): ID of the project the files belong to
+            
+        Returns:
+            bool: True if deletion was successful, False otherwise
+        """
+        try:
+            # Get every vector ID in one query
+            vector_ids = self.db.get_vector_ids_by_files(file_ids, user_id)
+            
+            # Delete from Vector Search in large chunks
+            for i in range(0, len(vector_ids), self.vector_remove_batch_size):
+                self.vector_search_rate_limiter.call(
+                    self.vector_search_concurrency.wrap(self.backend.remove),
+                    vector_ids[i:i + self.vector_remove_batch_size],
+                    retry_on=(Exception,)
+                )
+            logger.info(f"Removed {len(vector_ids)} datapoints of {len(file_ids)} file/s from the index")
+            
+            # Delete from database and the lexical index
+            self.db.delete_vectors_by_files(file_ids, user_id)
+            LexicalIndex().invalidate(project_id, user_id)
+            
+            return True
+            
+        except Exception as e:
+            logger.exception(f"Error deleting documents of {len(file_ids)} file/s: {e}")
+            return False
@@ -1,8 +1,24 @@
-from .gcp import GCPStorageClient
-from .database import Database
-from .prompt_loader import PromptLoader
+import importlib
+
+class RequeueMessage(Exception):
+    """Raised by a handler to hand its message back to Pub/Sub for a later redelivery, eg while another run holds the work"""
+
+# Imported when first accessed, google-cloud-storage and mysql-connector are slow to import
+_UTILS = {
+    "GCPStorageClient": "utils.gcp",
+    "Database": "utils.database",
+    "PromptLoader": "utils.prompt_loader"
+}
 
 __all__ = [
     "GCPStorageClient",
-    "Database"
-]
\ No newline at end of file
+    "Database",
+    "RequeueMessage"
+]
+
+def __getattr__(name):
+    if name in _UTILS:
+        value = getattr(importlib.import_module(_UTILS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
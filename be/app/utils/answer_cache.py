@@ -0,0 +1,218 @@
+from typing import List, Optional, Dict
+from array import array
+from loguru import logger
+from config import config
+
+import numpy as np
+import threading
+import hashlib
+import sqlite3
+import time
+import re
+import os
+
+class AnswerCache:
+    """
+    Cache of generated RFP answers stored in a local SQLite file.
+
+    Entries are keyed by project_id and the hash of the normalized requirement text, and are
+    tied to a fingerprint of the project's file set so they are dropped when files change.
+    In "similarity" mode a miss falls back to the previously answered requirement whose
+    query embedding is closest, if it is above the similarity threshold.
+    """
+    _instance = None
+
+    MODES = ("off", "exact", "similarity")
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AnswerCache, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        env = os.environ['ENV']
+        self.mode = config['env'][env].get('ANSWER_CACHE_MODE', 'off')
+        self.path = config['env'][env].get('ANSWER_CACHE_PATH', '/tmp/answer_cache.sqlite3')
+        self.similarity_threshold = float(config['env'][env].get('ANSWER_CACHE_SIMILARITY_THRESHOLD', 0.97))
+
+        if self.mode not in self.MODES:
+            raise ValueError(f"Unknown answer cache mode: {self.mode}. Supported modes: {self.MODES}")
+
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if self.enabled:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS answer_cache (
+                    project_id INTEGER NOT NULL,
+                    requirement_hash TEXT NOT NULL,
+                    file_set_hash TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    embedding BLOB,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (project_id, requirement_hash)
+                )
+            """)
+            self._connection.commit()
+            logger.info(f"Answer cache enabled in {self.mode} mode at {self.path}")
+
+        self._initialized = True
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @property
+    def uses_embeddings(self) -> bool:
+        return self.mode == "similarity"
+
+    @staticmethod
+    def hash_requirement(requirements: str) -> str:
+        """sha256 of the requirement text with case and whitespace normalized"""
+        normalized = re.sub(r"\s+", " ", requirements).strip().lower()
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def hash_file_set(files: List[Dict]) -> str:
+        """
+        Fingerprint of a project's files, changes whenever a file is added, removed or re-indexed
+
+        Args:
+            files (List[Dict]): File records of the project
+
+        Returns:
+            str: sha256 hex digest
+        """
+        fingerprint = sorted(
+            (file['id'], bool(file['is_indexed']), str(file.get('index_completed_at')))
+            for file in files
+        )
+        return hashlib.sha256(repr(fingerprint).encode('utf-8')).hexdigest()
+
+    def _invalidate_stale(self, project_id: int, file_set_hash: str) -> None:
+        """Drop the project's entries created for a different file set. Caller holds the lock"""
+        deleted = self._connection.execute(
+            "DELETE FROM answer_cache WHERE project_id = ? AND file_set_hash != ?",
+            (project_id, file_set_hash)
+        ).rowcount
+        if deleted:
+            self._connection.commit()
+            logger.info(f"Invalidated {deleted} cached answers for project {project_id} after its files changed")
+
+    def get(
+        self,
+        project_id: int,
+        file_set_hash: str,
+        requirements: str,
+        query_embedding: Optional[List[float]] = None
+    ) -> Optional[str]:
+        """
+        Look up a cached answer for a requirement
+
+        Args:
+            project_id (int): ID of the project
+            file_set_hash (str): Current fingerprint of the project's files
+            requirements (str): Requirement text
+            query_embedding (List[float], optional): Query embedding, used in similarity mode
+
+        Returns:
+            Optional[str]: The cached answer, or None on a miss
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            self._invalidate_stale(project_id, file_set_hash)
+
+            row = self._connection.execute(
+                "SELECT answer FROM answer_cache WHERE project_id = ? AND requirement_hash = ?",
+                (project_id, self.hash_requirement(requirements))
+            ).fetchone()
+            if row:
+                self.hits += 1
+                return row[0]
+
+            if self.uses_embeddings and query_embedding is not None:
+                answer = self._find_similar(project_id, query_embedding)
+                if answer is not None:
+                    self.similar_hits += 1
+                    return answer
+
+            self.misses += 1
+            return None
+
+    def _find_similar(self, project_id: int, query_embedding: List[float]) -> Optional[str]:
+        """Answer of the most similar cached requirement above the threshold. Caller holds the lock"""
+        rows = self._connection.execute(
+            "SELECT answer, embedding FROM answer_cache WHERE project_id = ? AND embedding IS NOT NULL",
+            (project_id,)
+        ).fetchall()
+        if not rows:
+            return None
+
+        # Stored with array('f'), native float32, so the blobs are read without decoding them one by one
+        query = np.asarray(query_embedding, dtype=np.float32)
+        rows = [row for row in rows if len(row[1]) == query.nbytes]
+        if not rows:
+            return None
+        embeddings = np.frombuffer(b"".join(embedding for _, embedding in rows), dtype=np.float32).reshape(len(rows), -1)
+        similarities = embeddings @ query / (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query) + 1e-12)
+
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            logger.debug(f"Reusing answer of a similar requirement, similarity {similarities[best]:.4f}")
+            return rows[best][0]
+        return None
+
+    def put(
+        self,
+        project_id: int,
+        file_set_hash: str,
+        requirements: str,
+        answer: str,
+        query_embedding: Optional[List[float]] = None
+    ) -> None:
+        """
+        Store the answer to a requirement
+
+        Args:
+            project_id (int): ID of the project
+            file_set_hash (str): Fingerprint of the project's files the answer was generated from
+            requirements (str): Requirement text
+            answer (str): Generated answer
+            query_embedding (List[float], optional): Query embedding, kept for similarity mode
+        """
+        if not self.enabled:
+            return
+
+        embedding = array('f', query_embedding).tobytes() if query_embedding is not None else None
+        with self._lock:
+            self._connection.execute(
+                """
+                    INSERT OR REPLACE INTO answer_cache
+                    (project_id, requirement_hash, file_set_hash, answer, embedding, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (project_id, self.hash_requirement(requirements), file_set_hash, answer, embedding, time.time())
+            )
+            self._connection.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Hit/miss counters since process start
+
+        Returns:
+            Dict[str, int]: exact hits, similarity hits and misses
+        """
+        return {
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses
+        }
@@ -1,25 +1,103 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Union, BinaryIO
+from itertools import islice
 from abc import ABC, abstractmethod
 
+from utils.lexical_index import LexicalIndex
 from utils.database import Database
+from config import config
+
+import os
 
 
 class BaseExtractor(ABC):
 
     def __init__(self):
         self.db = Database.get_instance()
+        env = os.environ['ENV']
+        self.vector_insert_batch_size = int(config['env'][env].get('VECTOR_INSERT_BATCH_SIZE', 500))
+        self.extraction_batch_size = int(config['env'][env].get('EXTRACTION_BATCH_SIZE', 250))
     
+    @staticmethod
+    def get_file_extension(file_path: Union[str, BinaryIO], file_name: str = None) -> str:
+        """
+        Lowercase extension of the file, eg ".pdf"
+
+        Args:
+            file_path (Union[str, BinaryIO]): Path to the file, or a binary file object with its content
+            file_name (str, optional): Name of the file, required when file_path is a file object
+        Returns:
+            str: The extension, including the dot
+        """
+        if file_name is None:
+            if not isinstance(file_path, str):
+                raise ValueError("file_name is required to extract content from a file object")
+            file_name = file_path
+        return os.path.splitext(file_name)[1].lower()
+
     @abstractmethod
+    def iter_documents(
+        self, 
+        file_path: Union[str, BinaryIO], 
+        project_id: int, 
+        user_id: int,
+        file_id: int,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """Lazily extract content and format it for Vector Search insertion, one chunk at a time"""
+        pass
+
     def extract_documents(
         self, 
-        file_path: str, 
+        file_path: Union[str, BinaryIO], 
         project_id: int, 
         user_id: int,
         file_id: int,
         **kwargs
     ) -> List[Dict[str, Any]]:
-        """Extract content and format for Vector Search insertion"""
-        pass
+        """Extract content, format for Vector Search insertion and store the chunks in the database"""
+        documents = list(self.iter_documents(
+            file_path=file_path,
+            project_id=project_id,
+            user_id=user_id,
+            file_id=file_id,
+            **kwargs
+        ))
+        self.insert_vectors(documents)
+        return documents
+
+    def stream_documents(
+        self, 
+        file_path: Union[str, BinaryIO], 
+        project_id: int, 
+        user_id: int,
+        file_id: int,
+        batch_size: int = None,
+        **kwargs
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Extract content in micro-batches. Each batch is stored in the database before
+        it is yielded, so memory stays proportional to batch_size rather than file size
+
+        Args:
+            batch_size (int, optional): Documents per batch, defaults to EXTRACTION_BATCH_SIZE
+        Returns:
+            Iterator[List[Dict[str, Any]]]: Batches of documents with page_content and metadata
+        """
+        batch_size = batch_size or self.extraction_batch_size
+        documents = self.iter_documents(
+            file_path=file_path,
+            project_id=project_id,
+            user_id=user_id,
+            file_id=file_id,
+            **kwargs
+        )
+
+        while True:
+            batch = list(islice(documents, batch_size))
+            if not batch:
+                break
+            self.insert_vectors(batch)
+            yield batch
     
     def insert_vector(self, document: Dict[str, Any]):
         """
@@ -49,4 +127,33 @@ class BaseExtractor(ABC):
             file_type=file_type,
             sheet_name=sheet_name
         )
-        
\ No newline at end of file
+
+    def insert_vectors(self, documents: List[Dict[str, Any]]) -> int:
+        """
+        Bulk insert chunks into the database in one transaction
+
+        Args:
+            documents (List[Dict[str, Any]]): List of documents with page_content and metadata
+        Returns:
+            int: Number of inserted rows
+        """
+        vectors = [
+            {
+                "vector_id": document['vector_id'],
+                "file_id": document['metadata']['file_id'],
+                "user_id": document['metadata']['user_id'],
+                "project_id": document['metadata']['project_id'],
+                "text": document['page_content'],
+                "chunk_number": document['metadata']['chunk_number'],
+                "file_type": document['metadata']['file_type'],
+                "sheet_name": document['metadata'].get('sheet_name', None)
+            }
+            for document in documents
+        ]
+
+        inserted = self.db.insert_vectors(vectors, batch_size=self.vector_insert_batch_size)
+
+        # Keep loaded lexical indexes in step with the vectors table
+        LexicalIndex().add_vectors(vectors)
+
+        return inserted
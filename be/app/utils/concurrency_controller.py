@@ -0,0 +1,256 @@
+from google.api_core.exceptions import TooManyRequests
+
+from contextlib import contextmanager, asynccontextmanager
+from typing import Callable, Awaitable, Dict, List, Any
+from collections import deque
+from functools import wraps
+from loguru import logger
+from config import config
+
+import statistics
+import threading
+import asyncio
+import time
+import os
+
+class AdaptiveConcurrencyController:
+    """
+    AIMD limit on the number of calls in flight to one model or API, shared by threads and coroutines.
+
+    Every healthy call, fast and without error, grows the limit by 1/limit, so about one extra
+    slot per limit's worth of calls, as long as at least half the limit was in use when it
+    finished. A limit that isn't being reached isn't shown to be safe, so it isn't grown. A
+    429, or an error rate above the threshold, cuts the limit by decrease_factor, at most
+    once per observed latency so a burst of failures from the same window only backs off once.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        error_rate_threshold: float = 0.1,
+        window: int = 100
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.error_rate_threshold = error_rate_threshold
+
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._async_waiters: deque = deque()
+
+        # Recent latencies of successful calls and outcomes of all calls
+        self._latencies: deque = deque(maxlen=window)
+        self._outcomes: deque = deque(maxlen=window)
+        self._last_decrease_at = 0.0
+
+        self.successes = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.cancelled = 0
+
+    @property
+    def limit(self) -> int:
+        """Current number of calls allowed in flight"""
+        return int(self._limit)
+
+    def _try_acquire(self) -> bool:
+        """Take a slot if one is free. Caller holds the condition"""
+        if self._in_flight < int(self._limit):
+            self._in_flight += 1
+            return True
+        return False
+
+    def _wake_waiters(self) -> None:
+        """Wake sync and async waiters to compete for free slots. Caller holds the condition"""
+        self._condition.notify_all()
+        while self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+
+    def acquire(self) -> None:
+        """Block until a slot is free"""
+        with self._condition:
+            while not self._try_acquire():
+                self._condition.wait()
+
+    async def aacquire(self) -> None:
+        """Wait on the event loop until a slot is free"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._try_acquire():
+                    return
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            await future
+
+    def release(self, latency: float, error: Exception = None, cancelled: bool = False) -> None:
+        """
+        Free a slot and adjust the limit from the call's outcome
+
+        Args:
+            latency (float): Seconds the call took
+            error (Exception, optional): Error raised by the call, if any
+            cancelled (bool): The call was cancelled, or interrupted by a BaseException, before
+                finishing. Counted as a non-error outcome, its latency and the limit are left alone
+        """
+        with self._condition:
+            # Counted before this call's slot is freed, the load the call's latency was observed under
+            utilized = self._in_flight >= self._limit / 2
+            self._in_flight -= 1
+            previous_limit = self.limit
+
+            if cancelled:
+                self.cancelled += 1
+                self._outcomes.append(True)
+            elif isinstance(error, TooManyRequests):
+                self.rate_limited += 1
+                self._outcomes.append(False)
+                self._decrease(latency)
+            elif error is not None:
+                self.errors += 1
+                self._outcomes.append(False)
+                if self._error_rate() > self.error_rate_threshold:
+                    self._decrease(latency)
+            else:
+                self.successes += 1
+                self._outcomes.append(True)
+                healthy = self._is_healthy(latency)
+                self._latencies.append(latency)
+                if utilized and healthy and self._error_rate() <= self.error_rate_threshold:
+                    self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+            self._wake_waiters()
+
+        if self.limit != previous_limit:
+            logger.info(f"{self.name} concurrency limit {previous_limit} -> {self.limit}, {self.metrics()}")
+
+    def _decrease(self, latency: float) -> None:
+        """Multiplicative decrease, once per observed latency. Caller holds the condition"""
+        now = time.monotonic()
+        if now - self._last_decrease_at < max(latency, self._p50()):
+            return
+        self._last_decrease_at = now
+        self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+
+    def _is_healthy(self, latency: float) -> bool:
+        """Latency within tolerance of the recent median. Caller holds the condition"""
+        if not self._latencies:
+            return True
+        return latency <= self.latency_tolerance * self._p50()
+
+    def _error_rate(self) -> float:
+        """Share of recent calls that failed. Caller holds the condition"""
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def _p50(self) -> float:
+        return statistics.median(self._latencies) if self._latencies else 0.0
+
+    @contextmanager
+    def limit_call(self):
+        """Hold a slot for the duration of a call, timing it and recording its outcome"""
+        self.acquire()
+        start_time = time.perf_counter()
+        error, cancelled = None, True
+        try:
+            yield
+            cancelled = False
+        except Exception as e:
+            error, cancelled = e, False
+            raise
+        finally:
+            self.release(time.perf_counter() - start_time, error, cancelled=cancelled)
+
+    @asynccontextmanager
+    async def alimit_call(self):
+        """Async version of limit_call"""
+        await self.aacquire()
+        start_time = time.perf_counter()
+        error, cancelled = None, True
+        try:
+            yield
+            cancelled = False
+        except Exception as e:
+            error, cancelled = e, False
+            raise
+        finally:
+            self.release(time.perf_counter() - start_time, error, cancelled=cancelled)
+
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """Wrap func so every call of it holds a slot"""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.limit_call():
+                return func(*args, **kwargs)
+        return wrapper
+
+    def awrap(self, func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """Wrap func, returning an awaitable, so every call of it holds a slot while awaited"""
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with self.alimit_call():
+                return await func(*args, **kwargs)
+        return wrapper
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Current limit, load and observed latencies
+
+        Returns:
+            Dict[str, Any]: limit, in_flight, latency percentiles in seconds and outcome counters
+        """
+        with self._condition:
+            latencies: List[float] = sorted(self._latencies)
+            return {
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "latency_p50": round(latencies[len(latencies) // 2], 3) if latencies else None,
+                "latency_p95": round(latencies[int(len(latencies) * 0.95)], 3) if latencies else None,
+                "error_rate": round(self._error_rate(), 3),
+                "successes": self.successes,
+                "rate_limited": self.rate_limited,
+                "errors": self.errors,
+                "cancelled": self.cancelled
+            }
+
+
+_controllers: Dict[str, AdaptiveConcurrencyController] = {}
+_controllers_lock = threading.Lock()
+
+def get_concurrency_controller(name: str) -> AdaptiveConcurrencyController:
+    """
+    Get the process-wide concurrency controller for a model or API, configured by the
+    CONCURRENCY_LIMITS.<name> config table with initial_limit, min_limit, max_limit,
+    decrease_factor, latency_tolerance and error_rate_threshold
+
+    Args:
+        name (str): Model or API name, eg the Vertex model name
+
+    Returns:
+        AdaptiveConcurrencyController: The shared controller
+    """
+    with _controllers_lock:
+        if name not in _controllers:
+            env = os.environ['ENV']
+            limits = config['env'][env].get('CONCURRENCY_LIMITS', {}).get(name, {})
+            _controllers[name] = AdaptiveConcurrencyController(
+                name=name,
+                initial_limit=int(limits.get('initial_limit', 4)),
+                min_limit=int(limits.get('min_limit', 1)),
+                max_limit=int(limits.get('max_limit', 64)),
+                decrease_factor=float(limits.get('decrease_factor', 0.5)),
+                latency_tolerance=float(limits.get('latency_tolerance', 2.0)),
+                error_rate_threshold=float(limits.get('error_rate_threshold', 0.1))
+            )
+        return _controllers[name]
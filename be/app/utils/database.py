@@ -1,9 +1,11 @@
-from datetime import datetime, timezone
-from typing import Optional, List, Dict
+from datetime import datetime, timezone, timedelta
+from typing import Optional, List, Dict, Tuple
 from config import config
 from loguru import logger
 
 import mysql.connector
+from mysql.connector.errors import PoolError
+import time
 import os
 
 class Database:
@@ -25,18 +27,34 @@ class Database:
                 "password": config['env'][env]["MYSQL_PASSWORD"],
                 "database": config['env'][env]["MYSQL_DB"],
                 "pool_name": "mypool",
-                "pool_size": 5
+                "pool_size": int(config['env'][env].get("MYSQL_POOL_SIZE", 5))
             }
             Database._pool = mysql.connector.pooling.MySQLConnectionPool(**dbconfig)
+        self.pool_wait_seconds = float(config['env'][env].get("MYSQL_POOL_WAIT_SECONDS", 30))
 
     def get_connection(self):
         """
-        Get a connection from the MySQL connection pool.
+        Get a connection from the MySQL connection pool, waiting for one to be
+        returned while the pool is exhausted.
         
         Returns:
             MySQLConnection: A connection object from the pool
-        """
-        return self._pool.get_connection()
+
+        Raises:
+            PoolError: If no connection frees up within MYSQL_POOL_WAIT_SECONDS
+        """
+        deadline = time.monotonic() + self.pool_wait_seconds
+        delay = 0.01
+        while True:
+            try:
+                return self._pool.get_connection()
+            except PoolError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.error(f"MySQL pool exhausted for {self.pool_wait_seconds}s")
+                    raise
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.5)
     
     def execute_query(self, query, params=None):
         """
@@ -360,14 +378,58 @@ class Database:
         return self.execute_query(query, (file_id, user_id))
     
     def insert_rfp(self, name: str, gcp_path: str, bucket: str, project_id: int, user_id: int) -> int:
-        """Insert new RFP record and return its ID"""
+        """Insert new RFP record, claimed by the caller's run, and return its ID"""
         query = """
-            INSERT INTO rfps (name, status, original_file_path, bucket, project_id, user_id)
-            VALUES (%s, %s, %s, %s, %s, %s)
+            INSERT INTO rfps (name, status, original_file_path, bucket, project_id, user_id, heartbeat_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
         """
-        values = (name, 'processing', gcp_path, bucket, project_id, user_id)
+        values = (name, 'processing', gcp_path, bucket, project_id, user_id, datetime.now(timezone.utc))
         return self.execute_query(query, values)
 
+    def claim_rfp(self, rfp_id: int, stale_after_seconds: int) -> bool:
+        """
+        Claim an unfinished RFP for a run, unless another run is still processing it. A run
+        holds its claim by updating heartbeat_at, see migrations/002_add_rfps_heartbeat_at.sql
+        
+        Args:
+            rfp_id (int): ID of the RFP
+            stale_after_seconds (int): Age of the last heartbeat after which the run holding the claim is presumed dead
+            
+        Returns:
+            bool: Whether the RFP was claimed
+        """
+        now = datetime.now(timezone.utc)
+        query = """
+            UPDATE rfps
+            SET status = 'processing',
+                heartbeat_at = %s
+            WHERE id = %s
+            AND status != 'completed'
+            AND (status != 'processing' OR heartbeat_at IS NULL OR heartbeat_at < %s)
+        """
+        
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(query, (now, rfp_id, now - timedelta(seconds=stale_after_seconds)))
+            connection.commit()
+            return cursor.rowcount == 1
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            cursor.close()
+            connection.close()
+
+    def heartbeat_rfp(self, rfp_id: int) -> None:
+        """Keep the claim of a run on an RFP it is processing"""
+        query = """
+            UPDATE rfps
+            SET heartbeat_at = %s
+            WHERE id = %s
+        """
+        self.execute_query(query, (datetime.now(timezone.utc), rfp_id))
+
     def update_rfp_status(self, rfp_id: int, status: str, processed_file_path: str = None):
         """Update RFP status and related fields"""
         query = """
@@ -380,6 +442,80 @@ class Database:
         values = (status, processed_file_path, datetime.now(timezone.utc), rfp_id)
         self.execute_query(query, values)
 
+    def get_unfinished_rfp(self, name: str, gcp_path: str, bucket: str, project_id: int, user_id: int) -> Optional[Dict]:
+        """
+        Get the latest RFP record for a file that was not completed, eg after the worker died or the run failed
+        
+        Args:
+            name (str): Name of the RFP
+            gcp_path (str): Path of the original file in the bucket
+            bucket (str): GCP bucket name
+            project_id (int): ID of the project
+            user_id (int): ID of the user
+            
+        Returns:
+            Optional[Dict]: The RFP record, or None if every run of the file completed
+        """
+        query = """
+            SELECT * FROM rfps
+            WHERE name = %s
+            AND original_file_path = %s
+            AND bucket = %s
+            AND project_id = %s
+            AND user_id = %s
+            AND status != 'completed'
+            ORDER BY id DESC
+            LIMIT 1
+        """
+        return self.fetch_one(query, (name, gcp_path, bucket, project_id, user_id))
+
+    def save_rfp_row_answers(self, rfp_id: int, answers: List[Tuple[int, str, str]]) -> None:
+        """
+        Checkpoint answers of processed RFP rows, in the table created by migrations/001_create_rfp_row_answers.sql
+        
+        Args:
+            rfp_id (int): ID of the RFP
+            answers (List[Tuple[int, str, str]]): (row_index, requirement_hash, answer) per row
+        """
+        if not answers:
+            return
+        
+        query = """
+            INSERT INTO rfp_row_answers (rfp_id, row_index, requirement_hash, answer)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE requirement_hash = VALUES(requirement_hash), answer = VALUES(answer)
+        """
+        values = [(rfp_id, row_index, requirement_hash, answer) for row_index, requirement_hash, answer in answers]
+        
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.executemany(query, values)
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            cursor.close()
+            connection.close()
+
+    def get_rfp_row_answers(self, rfp_id: int) -> Dict[int, Dict]:
+        """
+        Get the checkpointed answers of an RFP
+        
+        Args:
+            rfp_id (int): ID of the RFP
+            
+        Returns:
+            Dict[int, Dict]: Records with requirement_hash and answer, by row index
+        """
+        query = """
+            SELECT row_index, requirement_hash, answer
+            FROM rfp_row_answers
+            WHERE rfp_id = %s
+        """
+        return {row['row_index']: row for row in self.fetch_all(query, (rfp_id,))}
+
     def get_file_gcp_details(self, file_id: int, user_id: int) -> tuple[str, str]:
         """
         Get the GCP bucket and path for a file by its ID and user ID.
@@ -459,6 +595,61 @@ class Database:
             logger.exception(f"Error inserting vector: {e}")
             raise
     
+    def insert_vectors(self, vectors: List[Dict], batch_size: int = 500) -> int:
+        """
+        Bulk insert vector chunks into the database in a single transaction,
+        flushing multi-row INSERTs of batch_size rows at a time
+        
+        Args:
+            vectors (List[Dict]): Vector records with the same fields as insert_vector
+            batch_size (int): Number of rows sent per INSERT
+            
+        Returns:
+            int: Number of inserted rows
+        """
+        if not vectors:
+            return 0
+        
+        query = """
+            INSERT INTO vectors 
+            (file_id, user_id, project_id, vector_id, text, chunk_number, 
+            file_type, industry, sheet_name) 
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        values = [
+            (
+                vector['file_id'],
+                vector['user_id'],
+                vector['project_id'],
+                vector['vector_id'],
+                vector['text'],
+                vector['chunk_number'],
+                vector['file_type'],
+                vector.get('industry'),
+                vector.get('sheet_name')
+            )
+            for vector in vectors
+        ]
+        
+        start_time = time.perf_counter()
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        try:
+            for i in range(0, len(values), batch_size):
+                cursor.executemany(query, values[i:i + batch_size])
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            logger.exception(f"Error bulk inserting vectors: {e}")
+            raise
+        finally:
+            cursor.close()
+            connection.close()
+        
+        elapsed = time.perf_counter() - start_time
+        logger.info(f"Inserted {len(values)} vector rows in {elapsed:.2f}s (batch size {batch_size})")
+        return len(values)
+
     def get_vectors_by_file(self, file_id: int, user_id: int) -> List[Dict]:
         """
         Get all vector IDs associated with a file
@@ -499,6 +690,66 @@ class Database:
             logger.exception(f"Error deleting vector records: {e}")
             return False
         
+    # MySQL handles long IN lists, but keep statements and their packets a reasonable size
+    IN_CLAUSE_CHUNK_SIZE = 1000
+
+    def get_vector_ids_by_files(self, file_ids: List[int], user_id: int) -> List[str]:
+        """
+        Get the vector IDs of several files in one query per chunk of file IDs
+        
+        Args:
+            file_ids (List[int]): IDs of the files
+            user_id (int): ID of the user (for verification)
+            
+        Returns:
+            List[str]: Vector IDs
+        """
+        vector_ids = []
+        for i in range(0, len(file_ids), self.IN_CLAUSE_CHUNK_SIZE):
+            chunk = file_ids[i:i + self.IN_CLAUSE_CHUNK_SIZE]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            query = f"""
+                SELECT vector_id 
+                FROM vectors 
+                WHERE user_id = %s AND file_id IN ({placeholders})
+            """
+            vector_ids.extend(row['vector_id'] for row in self.fetch_all(query, (user_id, *chunk)))
+        return vector_ids
+
+    def delete_vectors_by_files(self, file_ids: List[int], user_id: int) -> None:
+        """
+        Delete the vector records of several files with set-based statements
+        
+        Args:
+            file_ids (List[int]): IDs of the files
+            user_id (int): ID of the user (for verification)
+        """
+        for i in range(0, len(file_ids), self.IN_CLAUSE_CHUNK_SIZE):
+            chunk = file_ids[i:i + self.IN_CLAUSE_CHUNK_SIZE]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            query = f"""
+                DELETE FROM vectors 
+                WHERE user_id = %s AND file_id IN ({placeholders})
+            """
+            self.execute_query(query, (user_id, *chunk))
+
+    def delete_files(self, file_ids: List[int], user_id: int) -> None:
+        """
+        Permanently delete several files from the database with set-based statements
+        
+        Args:
+            file_ids (List[int]): IDs of the files to delete
+            user_id (int): ID of the user who owns the files
+        """
+        for i in range(0, len(file_ids), self.IN_CLAUSE_CHUNK_SIZE):
+            chunk = file_ids[i:i + self.IN_CLAUSE_CHUNK_SIZE]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            query = f"""
+                DELETE FROM files 
+                WHERE user_id = %s AND id IN ({placeholders})
+            """
+            self.execute_query(query, (user_id, *chunk))
+
     def get_file_vectors_ordered(
         self,
         file_id: int,
@@ -531,6 +782,103 @@ class Database:
         return self.fetch_all(query, (file_id, user_id, start_chunk, end_chunk))
 
 
+    def get_project_vector_texts(self, project_id: int, user_id: int) -> List[Dict]:
+        """
+        Get the text of every chunk of a project
+        
+        Args:
+            project_id (int): ID of the project
+            user_id (int): ID of the user who owns the project
+            
+        Returns:
+            List[Dict]: Records with vector_id, file_id, chunk_number and text
+        """
+        query = """
+            SELECT vector_id, file_id, chunk_number, text
+            FROM vectors
+            WHERE project_id = %s AND user_id = %s
+        """
+        return self.fetch_all(query, (project_id, user_id))
+
+    def get_vector_windows(
+        self,
+        user_id: int,
+        windows: List[Tuple[int, int, int]]
+    ) -> List[Dict]:
+        """
+        Get the texts of several chunk windows, and the names of their files, in a single query.
+        Overlapping or touching windows of the same file are merged so no chunk is returned twice
+        
+        Args:
+            user_id (int): ID of the user who owns the files
+            windows (List[Tuple[int, int, int]]): (file_id, start_chunk, end_chunk) per window, inclusive
+            
+        Returns:
+            List[Dict]: One record per merged window with file_id, start_chunk, end_chunk,
+                        source (file name, or link for websites) and the window's chunk texts,
+                        ordered by the first requested window each one covers
+        """
+        # Merge windows per file, remembering the position of the earliest window in each
+        windows_by_file = {}
+        for position, (file_id, start_chunk, end_chunk) in enumerate(windows):
+            windows_by_file.setdefault(file_id, []).append((start_chunk, end_chunk, position))
+        
+        merged = []
+        for file_id, file_windows in windows_by_file.items():
+            file_windows.sort()
+            current = list(file_windows[0])
+            for start_chunk, end_chunk, position in file_windows[1:]:
+                if start_chunk <= current[1] + 1:
+                    current[1] = max(current[1], end_chunk)
+                    current[2] = min(current[2], position)
+                else:
+                    merged.append((file_id, *current))
+                    current = [start_chunk, end_chunk, position]
+            merged.append((file_id, *current))
+        
+        if not merged:
+            return []
+        
+        merged.sort(key=lambda window: window[3])
+        
+        conditions = " OR ".join(
+            ["(v.file_id = %s AND v.chunk_number BETWEEN %s AND %s)"] * len(merged)
+        )
+        query = f"""
+            SELECT v.file_id, v.chunk_number, v.text, f.name, f.type, f.link
+            FROM vectors v
+            JOIN files f ON f.id = v.file_id AND f.user_id = v.user_id
+            WHERE v.user_id = %s
+            AND ({conditions})
+            ORDER BY v.file_id, v.chunk_number ASC
+        """
+        params = [user_id]
+        for file_id, start_chunk, end_chunk, _ in merged:
+            params.extend([file_id, start_chunk, end_chunk])
+        
+        rows = self.fetch_all(query, tuple(params))
+        
+        # Assign rows back to their merged window, merged windows never overlap
+        results = [
+            {
+                "file_id": file_id,
+                "start_chunk": start_chunk,
+                "end_chunk": end_chunk,
+                "source": None,
+                "texts": []
+            }
+            for file_id, start_chunk, end_chunk, _ in merged
+        ]
+        for row in rows:
+            for result in results:
+                if result["file_id"] == row["file_id"] and result["start_chunk"] <= row["chunk_number"] <= result["end_chunk"]:
+                    # For websites, the source is the link
+                    result["source"] = row["link"] if row["type"] == 'website' else row["name"]
+                    result["texts"].append(row["text"])
+                    break
+        
+        return [result for result in results if result["texts"]]
+
     def get_file_name(self, file_id: int, user_id: int) -> str:
         """
         Get the name or link of a file
@@ -0,0 +1,68 @@
+from typing import List, Optional
+
+import pandas as pd
+import numpy as np
+import numbers
+
+# Kinds whose numpy scalars format the same with astype(str) as in an f-string: bool and ints.
+# Only float64 among floats, the others are formatted as the Python float they convert to
+_NUMPY_FORMATTED_KINDS = "biu"
+
+
+def _format_cells(values: np.ndarray) -> np.ndarray:
+    """
+    f-string of every value of a column, as iterrows would hand it out
+
+    Args:
+        values (np.ndarray): One column of DataFrame.values
+
+    Returns:
+        np.ndarray: Object array of strings
+    """
+    if values.dtype.kind in _NUMPY_FORMATTED_KINDS or values.dtype == np.float64:
+        return values.astype(str).astype(object)
+    if values.dtype.kind in "mM":
+        # A row Series boxes datetimes and timedeltas as Timestamp and Timedelta
+        return np.array([f"{value}" for value in pd.Series(values)], dtype=object)
+    return np.array([f"{value}" for value in values], dtype=object)
+
+
+def format_rows(df: pd.DataFrame, na_rep: Optional[str] = None) -> List[str]:
+    """
+    Format every row as "{column}: \\n{value}\\n\\n" for each of its columns, the text
+    chunks and requirements are built from. Cells are formatted a column at a time from
+    DataFrame.values, whose common dtype is the one iterrows gives each row, so the output
+    is the same as formatting the rows of iterrows one by one
+
+    Args:
+        df (pd.DataFrame): Rows to format
+        na_rep (str, optional): Text of missing values, eg "None". Missing values are
+                                formatted as they are, eg "nan", if not given
+
+    Returns:
+        List[str]: Text of each row, in order
+    """
+    if df.empty:
+        return [""] * len(df)
+
+    values = df.values
+    cells = [_format_cells(values[:, position]) for position in range(values.shape[1])]
+
+    if na_rep is not None:
+        missing = pd.isna(values)
+        for position, column_cells in enumerate(cells):
+            column_cells[missing[:, position]] = na_rep
+    elif values.dtype == object:
+        # A row Series infers its dtype from its values, eg datetime64 when they are only
+        # Timestamps and missing values, which changes how the missing ones are formatted.
+        # Rows holding a number stay object
+        for row in np.flatnonzero(pd.isna(values).any(axis=1)):
+            if any(isinstance(value, numbers.Number) and value == value for value in values[row]):
+                continue
+            series = pd.Series(values[row], index=df.columns)
+            if series.dtype != object:
+                for position, column_cells in enumerate(cells):
+                    column_cells[row] = f"{series.iloc[position]}"
+
+    columns = [f"{column}: \n" + column_cells + "\n\n" for column, column_cells in zip(df.columns, cells)]
+    return ["".join(parts) for parts in zip(*columns)]
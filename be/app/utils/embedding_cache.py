@@ -0,0 +1,214 @@
+from typing import List, Optional, Dict
+from array import array
+from loguru import logger
+from config import config
+
+import threading
+import hashlib
+import sqlite3
+import time
+import os
+
+class EmbeddingCache:
+    """
+    Persistent, size-bounded embedding cache stored in a local SQLite file.
+
+    Entries are keyed by (model name, task type, output dimensionality, sha256 of text)
+    and evicted least recently used first once the cache grows past max_entries. Recency
+    is only refreshed for hits last used more than touch_interval seconds ago, so repeated
+    hits don't each cost a write, and the number of entries is tracked as they are added
+    so it is only counted in the file when eviction is due.
+    """
+    _instance = None
+
+    # SQLite limits the number of bound parameters per statement
+    QUERY_CHUNK_SIZE = 500
+
+    # Share of max_entries kept by an eviction, so evictions don't run on every put
+    EVICT_TO_RATIO = 0.9
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(EmbeddingCache, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        env = os.environ['ENV']
+        self.enabled = bool(config['env'][env].get('EMBEDDING_CACHE_ENABLED', True))
+        self.path = config['env'][env].get('EMBEDDING_CACHE_PATH', '/tmp/embedding_cache.sqlite3')
+        self.max_entries = int(config['env'][env].get('EMBEDDING_CACHE_MAX_ENTRIES', 100000))
+        self.touch_interval = float(config['env'][env].get('EMBEDDING_CACHE_TOUCH_SECONDS', 3600))
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if self.enabled:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model_name TEXT NOT NULL,
+                    task_type TEXT NOT NULL,
+                    dimensionality INTEGER NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    PRIMARY KEY (model_name, task_type, dimensionality, text_hash)
+                )
+            """)
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used_at)"
+            )
+            self._connection.commit()
+            self._count = self._connection.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            logger.info(f"Embedding cache enabled at {self.path} with {self._count} entries (max {self.max_entries})")
+
+        self._initialized = True
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """sha256 hex digest of a text"""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(
+        self,
+        model_name: str,
+        task_type: str,
+        dimensionality: int,
+        texts: List[str]
+    ) -> List[Optional[List[float]]]:
+        """
+        Look up cached embeddings for texts
+
+        Args:
+            model_name (str): Embedding model name
+            task_type (str): Embedding task type, eg RETRIEVAL_DOCUMENT
+            dimensionality (int): Output dimensionality of the embeddings
+            texts (List[str]): Texts to look up
+
+        Returns:
+            List[Optional[List[float]]]: Embedding values for each text, None on a miss
+        """
+        if not self.enabled or not texts:
+            return [None] * len(texts)
+
+        hashes = [self.hash_text(text) for text in texts]
+        found = {}
+        stale = []
+        now = time.time()
+        stale_before = now - self.touch_interval
+
+        with self._lock:
+            unique_hashes = list(dict.fromkeys(hashes))
+            for i in range(0, len(unique_hashes), self.QUERY_CHUNK_SIZE):
+                chunk = unique_hashes[i:i + self.QUERY_CHUNK_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"""
+                        SELECT text_hash, embedding, last_used_at FROM embedding_cache
+                        WHERE model_name = ? AND task_type = ? AND dimensionality = ?
+                        AND text_hash IN ({placeholders})
+                    """,
+                    (model_name, task_type, dimensionality, *chunk)
+                ).fetchall()
+                for text_hash, embedding, last_used_at in rows:
+                    found[text_hash] = array('f', embedding).tolist()
+                    if last_used_at < stale_before:
+                        stale.append(text_hash)
+
+            # Refresh recency of the hits not refreshed recently, in one transaction
+            if stale:
+                self._connection.executemany(
+                    """
+                        UPDATE embedding_cache SET last_used_at = ?
+                        WHERE model_name = ? AND task_type = ? AND dimensionality = ? AND text_hash = ?
+                    """,
+                    [(now, model_name, task_type, dimensionality, text_hash) for text_hash in stale]
+                )
+                self._connection.commit()
+
+            results = [found.get(text_hash) for text_hash in hashes]
+            hits = sum(1 for result in results if result is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+
+        return results
+
+    def put_many(
+        self,
+        model_name: str,
+        task_type: str,
+        dimensionality: int,
+        texts: List[str],
+        embeddings: List[List[float]]
+    ) -> None:
+        """
+        Store embeddings for texts and evict least recently used entries over the size bound
+
+        Args:
+            model_name (str): Embedding model name
+            task_type (str): Embedding task type, eg RETRIEVAL_DOCUMENT
+            dimensionality (int): Output dimensionality of the embeddings
+            texts (List[str]): Embedded texts
+            embeddings (List[List[float]]): Embedding values for each text
+        """
+        if not self.enabled or not texts:
+            return
+
+        now = time.time()
+        rows = [
+            (model_name, task_type, dimensionality, self.hash_text(text), array('f', embedding).tobytes(), now)
+            for text, embedding in zip(texts, embeddings)
+        ]
+
+        with self._lock:
+            # The embedding of a text already stored, eg by a concurrent miss, is the same one
+            inserted = self._connection.executemany(
+                """
+                    INSERT OR IGNORE INTO embedding_cache
+                    (model_name, task_type, dimensionality, text_hash, embedding, last_used_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            ).rowcount
+            self._count += max(inserted, 0)
+            if self._count > self.max_entries:
+                self._evict()
+            self._connection.commit()
+
+    def _evict(self) -> None:
+        """
+        Delete least recently used entries down to EVICT_TO_RATIO of max_entries. The count is
+        taken from the file, which other processes may share. Caller holds the lock
+        """
+        self._count = self._connection.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        overflow = self._count - int(self.max_entries * self.EVICT_TO_RATIO)
+        if self._count > self.max_entries and overflow > 0:
+            self._connection.execute(
+                """
+                    DELETE FROM embedding_cache WHERE rowid IN (
+                        SELECT rowid FROM embedding_cache ORDER BY last_used_at ASC LIMIT ?
+                    )
+                """,
+                (overflow,)
+            )
+            self._count -= overflow
+            logger.debug(f"Evicted {overflow} entries from embedding cache")
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Hit/miss counters since process start
+
+        Returns:
+            Dict[str, float]: hits, misses and hit_rate
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
@@ -1,4 +1,5 @@
-from typing import Dict, List, Union, Any
+from typing import Dict, List, Union, Any, Iterator, BinaryIO, Tuple
+from .dataframe_formatter import format_rows
 from .base_extractor import BaseExtractor
 
 import pandas as pd
@@ -12,34 +13,36 @@ class ExcelExtractor(BaseExtractor):
         self.supported_formats = ['.xlsx', '.xls', '.csv']
         self.chunk_size = 1000  # Number of cells to include in each chunk
 
-    def validate_file(self, file_path: str) -> bool:
+    def validate_file(self, file_path: Union[str, BinaryIO], file_name: str = None) -> bool:
         """
         Validate if the file is an Excel/CSV file
         
         Args:
-            file_path: Path to the Excel/CSV file
+            file_path: Path to the Excel/CSV file, or a binary file object with its content
+            file_name: Name of the file, required when file_path is a file object
         Returns:
             Boolean indicating if file is valid
         """
-        if not os.path.exists(file_path):
+        if isinstance(file_path, str) and not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
             
-        file_ext = os.path.splitext(file_path)[1].lower()
+        file_ext = self.get_file_extension(file_path, file_name)
         if file_ext not in self.supported_formats:
             raise ValueError(f"Unsupported file format. Supported formats: {self.supported_formats}")
         
         return True
 
-    def read_file(self, file_path: str) -> Dict[str, pd.DataFrame]:
+    def read_file(self, file_path: Union[str, BinaryIO], file_name: str = None) -> Dict[str, pd.DataFrame]:
         """
         Read Excel/CSV file into pandas DataFrames
         
         Args:
-            file_path: Path to the file
+            file_path: Path to the file, or a binary file object with its content
+            file_name: Name of the file, required when file_path is a file object
         Returns:
             Dictionary of sheet names and their corresponding DataFrames
         """
-        file_ext = os.path.splitext(file_path)[1].lower()
+        file_ext = self.get_file_extension(file_path, file_name)
         
         if file_ext == '.csv':
             # For CSV, create a single sheet dictionary
@@ -58,73 +61,92 @@ class ExcelExtractor(BaseExtractor):
         Returns:
             List of text chunks, one per row
         """
-        chunks = []
+        # Rows are formatted column by column, with missing values as "None"
+        return format_rows(df, na_rep="None")
 
-        # Process each row as a separate chunk
-        for idx, row in df.iterrows():
-            
-            row_text = ""
-            for header, row in row.items():
-                if not pd.isna(row):
-                    row_text += f"{header}: \n{row}\n\n"
-                else:
-                    row_text += f"{header}: \nNone\n\n"
-            chunks.append(row_text)
+    def iter_sheets(self, file_path: Union[str, BinaryIO], file_name: str = None) -> Iterator[Tuple[str, pd.DataFrame]]:
+        """
+        Read Excel/CSV file one sheet at a time, so only one DataFrame is held in memory
+        
+        Args:
+            file_path: Path to the file, or a binary file object with its content
+            file_name: Name of the file, required when file_path is a file object
+        Returns:
+            Iterator of sheet names and their corresponding DataFrames
+        """
+        file_ext = self.get_file_extension(file_path, file_name)
         
-        return chunks
+        if file_ext == '.csv':
+            # For CSV, yield a single sheet
+            yield 'Sheet1', pd.read_csv(file_path)
+        else:
+            # For Excel, parse sheets lazily
+            with pd.ExcelFile(file_path) as excel_file:
+                for sheet_name in excel_file.sheet_names:
+                    yield sheet_name, excel_file.parse(sheet_name)
 
-    def extract_content(self, file_path: str) -> List[Dict[str, Union[int, str]]]:
+    def iter_content(self, file_path: Union[str, BinaryIO], file_name: str = None) -> Iterator[Dict[str, Union[int, str]]]:
         """
-        Extract content from Excel/CSV file
+        Lazily extract content from Excel/CSV file, one sheet at a time
         
         Args:
-            file_path: Path to the Excel/CSV file
+            file_path: Path to the Excel/CSV file, or a binary file object with its content
+            file_name: Name of the file, required when file_path is a file object
         Returns:
-            List of dictionaries containing sheet information and content
+            Iterator of dictionaries containing sheet information and content
         """
-        self.validate_file(file_path)
-        sheets_data = self.read_file(file_path)
-        content = []
+        self.validate_file(file_path, file_name)
         
-        for sheet_name, df in sheets_data.items():
+        for sheet_name, df in self.iter_sheets(file_path, file_name):
             chunks = self.process_dataframe(df)
             
             for chunk_number, chunk_content in enumerate(chunks, 1):
-                content.append({
+                yield {
                     'sheet_name': sheet_name,
                     'chunk_number': chunk_number,
                     'total_chunks': len(chunks),
                     'content': chunk_content
-                })
+                }
+
+    def extract_content(self, file_path: Union[str, BinaryIO], file_name: str = None) -> List[Dict[str, Union[int, str]]]:
+        """
+        Extract content from Excel/CSV file
         
-        return content
+        Args:
+            file_path: Path to the Excel/CSV file, or a binary file object with its content
+            file_name: Name of the file, required when file_path is a file object
+        Returns:
+            List of dictionaries containing sheet information and content
+        """
+        return list(self.iter_content(file_path, file_name))
 
-    def extract_documents(
+    def iter_documents(
         self, 
-        file_path: str, 
+        file_path: Union[str, BinaryIO], 
         project_id: int, 
         user_id: int,
-        file_id: int
-    ) -> List[Dict[str, Any]]:
+        file_id: int,
+        file_name: str = None,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
         """
-        Extract content from Excel/CSV file in Qdrant format
+        Extract content from Excel/CSV file in Qdrant format, one row at a time
         
         Args:
-            file_path: Path to the Excel/CSV file
+            file_path: Path to the Excel/CSV file, or a binary file object with its content
             project_id: Project identifier
             user_id: User identifier
             file_id: File identifier
+            file_name: Name of the file, required when file_path is a file object
             
         Returns:
-            List of documents with page_content and metadata
+            Iterator of documents with page_content and metadata
         """
-        content = self.extract_content(file_path)
-        file_ext = os.path.splitext(file_path)[1].lower()
-        documents = []
+        file_ext = self.get_file_extension(file_path, file_name)
         
-        for item in content:
+        for item in self.iter_content(file_path, file_name):
             vector_id = str(uuid.uuid4())
-            document = {
+            yield {
                 "page_content": item['content'],
                 "vector_id": vector_id,
                 "metadata": {
@@ -137,8 +159,3 @@ class ExcelExtractor(BaseExtractor):
                     "total_chunks": item['total_chunks']
                 }
             }
-
-            self.insert_vector(document)
-            documents.append(document)
-        
-        return documents
\ No newline at end of file
@@ -1,13 +1,18 @@
 # app/utils/gcp.py
 
 from google.api_core.exceptions import NotFound
+from google.cloud.storage import transfer_manager
 from google.cloud import storage
 
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable, List, Tuple
 from loguru import logger
-from pathlib import Path
 from config import config
 
+import threading
+import shutil
+import time
+import io
 import os
 
 
@@ -27,48 +32,105 @@ class GCPStorageClient:
             self.client = storage.Client(
                 project=config['env'][self.env]['GCP_PROJECT_ID'],
             )
+        self.download_chunk_size = int(config['env'][self.env].get('GCS_DOWNLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+        
+        # Files from this size up are transferred in slices of slice_size over several connections
+        self.sliced_transfer_threshold = int(config['env'][self.env].get('GCS_SLICED_TRANSFER_THRESHOLD', 32 * 1024 * 1024))
+        self.slice_size = int(config['env'][self.env].get('GCS_SLICE_SIZE', 16 * 1024 * 1024))
+        self.transfer_workers = int(config['env'][self.env].get('GCS_TRANSFER_WORKERS', 8))
+
+    def _log_transfer(self, action: str, gcp_file_path: str, size: int, start_time: float, slices: int = 1) -> None:
+        """Log the size and throughput of a finished download or upload"""
+        elapsed = time.perf_counter() - start_time
+        size_mb = size / (1024 * 1024)
+        logger.info(
+            f"{action} {gcp_file_path}: {size_mb:.2f} MB in {elapsed:.2f}s "
+            f"({size_mb / max(elapsed, 1e-6):.2f} MB/s, {slices} slice/s)"
+        )
+
+    def _is_sliced(self, size: int) -> bool:
+        """Whether a file of size bytes is transferred in slices"""
+        return size >= self.sliced_transfer_threshold and size > self.slice_size and self.transfer_workers > 1
+
+    def _download_slices(self, blob: storage.Blob, write: Callable[[int, bytes], None]) -> int:
+        """
+        Download a blob as ranged requests of slice_size, transfer_workers at a time
+        
+        Args:
+            blob (storage.Blob): Blob with its size and generation loaded
+            write (Callable[[int, bytes], None]): Stores a slice at its offset, called from worker threads
+            
+        Returns:
+            int: Number of slices
+        """
+        ranges = [
+            (start, min(start + self.slice_size, blob.size) - 1)
+            for start in range(0, blob.size, self.slice_size)
+        ]
+        
+        def download(byte_range: Tuple[int, int]) -> None:
+            start, end = byte_range
+            # Pinned to the generation so a concurrent overwrite fails instead of mixing versions
+            data = blob.download_as_bytes(start=start, end=end, if_generation_match=blob.generation, checksum=None)
+            write(start, data)
+        
+        with ThreadPoolExecutor(max_workers=min(self.transfer_workers, len(ranges)), thread_name_prefix="gcs-download") as executor:
+            list(executor.map(download, ranges))
+        
+        return len(ranges)
+
+    def _get_blob(self, bucket: str, gcp_file_path: str) -> storage.Blob:
+        """Blob with its metadata loaded, raises NotFound if it doesn't exist"""
+        blob = self.client.bucket(bucket).get_blob(gcp_file_path)
+        if blob is None:
+            raise NotFound(f"File not found: {gcp_file_path} in bucket: {bucket}")
+        return blob
 
-    def download_blob_to_temp(
+    def download_blob_to_buffer(
         self,
         bucket: str,
         gcp_file_path: str,
-    ) -> str:
+    ) -> io.BytesIO:
         """
-        Downloads a file from GCP Storage to a temporary file
+        Downloads a file from GCP Storage into memory. Files above GCS_SLICED_TRANSFER_THRESHOLD are
+        downloaded in parallel slices, smaller ones streamed in chunks of GCS_DOWNLOAD_CHUNK_SIZE
         
         Args:
-            gcp_file_path (str): Path to the file in the bucket. Eg gs://dev/user_id/project_id/file_name.pptx
-            prefix (str): Prefix for the temporary file name
+            bucket (str): Name of the GCP bucket
+            gcp_file_path (str): Path to the file in the bucket. Eg user_id/project_id/file_name.pptx
             
         Returns:
-            str: Path to the temporary file
+            io.BytesIO: Seekable buffer with the file content, positioned at the start
             
         Raises:
             Exception: If download fails
         """
-        
         try:
-            # Get bucket and blob
-            bucket = self.client.bucket(bucket)
-            blob = bucket.blob(gcp_file_path)
+            blob = self._get_blob(bucket, gcp_file_path)
             
-            # Convert to Path object and split parts
-            parts = Path(gcp_file_path).parts
-            
-            # For meaningful filenames, so we don't end up with empty folders.
-            user_id = parts[0]
-            project_name = parts[1]
-            file_name = parts[-1]
-
-            # Download to temporary file
-            temp_file_path = os.path.join("/tmp", f"{user_id}_{project_name}_{file_name}")
-            blob.download_to_filename(temp_file_path)
+            start_time = time.perf_counter()
+            buffer = io.BytesIO()
+            slices = 1
+            if self._is_sliced(blob.size):
+                buffer_lock = threading.Lock()
+                
+                def write(offset: int, data: bytes) -> None:
+                    with buffer_lock:
+                        buffer.seek(offset)
+                        buffer.write(data)
+                
+                slices = self._download_slices(blob, write)
+            else:
+                with blob.open('rb', chunk_size=self.download_chunk_size) as stream:
+                    shutil.copyfileobj(stream, buffer, self.download_chunk_size)
             
-            return temp_file_path
+            self._log_transfer("Downloaded", gcp_file_path, blob.size, start_time, slices)
+            buffer.seek(0)
+            return buffer
             
         except Exception as e:
             raise Exception(f"Failed to download file: {str(e)}")
-    
+
     def cleanup_temp_file(self, temp_file_path: str) -> None:
         """
         Removes the temporary file
@@ -87,13 +149,15 @@ class GCPStorageClient:
         except Exception as e:
             logger.exception(f"Warning: Failed to remove temporary file {temp_file_path}: {str(e)}")
     
-    def _upload_to_gcp(self, filename, bucket, username, project_name):
+    def _upload_to_gcp(self, filename, bucket, username, project_name, file_path: str = None):
         
         """
         Uploads a file to the bucket.
         
         Args:
-            file (file): The file to upload.
+            filename (str): Name of the file in the bucket.
+            file_path (str, optional): Local file to upload, defaults to /tmp/{filename}.
+                Pass a path of its own when the same filename may be uploaded concurrently.
         
         Returns:
             str: The path to the uploaded file in the bucket.
@@ -105,7 +169,23 @@ class GCPStorageClient:
         gcp_path = f"{username}/{project_name}/rfp_processed/{filename}" # Path to be stored at
         blob = bucket.blob(gcp_path)
         
-        blob.upload_from_filename(f"/tmp/{filename}")
+        file_path = file_path or f"/tmp/{filename}"
+        size = os.path.getsize(file_path)
+        start_time = time.perf_counter()
+        slices = 1
+        if self._is_sliced(size):
+            # Parts of slice_size uploaded in parallel as an XML multipart upload
+            transfer_manager.upload_chunks_concurrently(
+                file_path,
+                blob,
+                chunk_size=self.slice_size,
+                max_workers=self.transfer_workers,
+                worker_type=transfer_manager.THREAD
+            )
+            slices = -(-size // self.slice_size)
+        else:
+            blob.upload_from_filename(file_path)
+        self._log_transfer("Uploaded", gcp_path, size, start_time, slices)
 
         logger.info(f"File {filename} uploaded to {bucket}.")
 
@@ -142,3 +222,30 @@ class GCPStorageClient:
         except Exception as e:
             logger.error(f"Error deleting file: {gcp_file_path} from bucket: {bucket}")
             raise Exception(f"Failed to delete file: {str(e)}")
+    
+    def delete_files(self, files: List[Tuple[str, str]], max_workers: int = 16) -> None:
+        """
+        Deletes several files concurrently
+        
+        Args:
+            files (List[Tuple[str, str]]): (bucket, gcp_file_path) of each file
+            max_workers (int): Number of deletes in flight
+            
+        Raises:
+            Exception: If any deletion fails, once every file has been tried
+        """
+        if not files:
+            return
+        
+        def delete(file: Tuple[str, str]) -> Optional[str]:
+            try:
+                self.delete_file(bucket=file[0], gcp_file_path=file[1])
+                return None
+            except Exception as e:
+                return f"{file[1]}: {str(e)}"
+        
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(files)), thread_name_prefix="gcs-delete") as executor:
+            errors = [error for error in executor.map(delete, files) if error]
+        
+        if errors:
+            raise Exception(f"Failed to delete {len(errors)} out of {len(files)} file/s: {errors}")
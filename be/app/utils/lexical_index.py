@@ -0,0 +1,322 @@
+from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import MatchNeighbor
+from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import Namespace
+
+from typing import List, Dict, Tuple, Set, Optional, Callable
+from collections import OrderedDict, Counter
+from utils.database import Database
+from loguru import logger
+from config import config
+
+import threading
+import heapq
+import math
+import time
+import re
+import os
+
+# Words, numbers and codes joined by - . / such as "27001", "nfpa" or "ab-1234/x"
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+# A word followed by a number across whitespace, the shape of standards codes like "ISO 27001"
+STANDARD_CODE_PATTERN = re.compile(r"[^\W\d_]+\s+\d[\w\-./]*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase terms of a text. Codes such as part numbers are kept whole and also split
+    into their parts, so "AB-1234" matches both "ab-1234" and "1234". A word followed by
+    a number, like "ISO 27001", is also kept as one "iso 27001" term next to its words
+    """
+    text = text.lower()
+    terms = []
+    previous = None
+    for match in TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if (
+            previous is not None
+            and previous.group() not in STOPWORDS
+            and STANDARD_CODE_PATTERN.fullmatch(text, previous.start(), match.end())
+        ):
+            terms.append(f"{previous.group()} {token}")
+        previous = match
+
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        parts = re.split(r"[-./]", token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part and part not in STOPWORDS)
+    return terms
+
+
+class ProjectIndex:
+    """BM25 inverted index over the chunks of one project"""
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self):
+        # vector_id -> (file_id, chunk_number, length)
+        self.documents: Dict[str, Tuple[int, int, int]] = {}
+        # term -> vector_id -> term frequency
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.file_documents: Dict[int, Set[str]] = {}
+        self.total_length = 0
+
+    def add(self, vector_id: str, file_id: int, chunk_number: int, text: str) -> None:
+        if vector_id in self.documents:
+            return
+
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        self.documents[vector_id] = (file_id, chunk_number, length)
+        self.file_documents.setdefault(file_id, set()).add(vector_id)
+        self.total_length += length
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[vector_id] = frequency
+
+    def remove_file(self, file_id: int) -> int:
+        vector_ids = self.file_documents.pop(file_id, set())
+        for vector_id in vector_ids:
+            _, _, length = self.documents.pop(vector_id)
+            self.total_length -= length
+
+        if vector_ids:
+            for term in list(self.postings):
+                postings = self.postings[term]
+                for vector_id in vector_ids & postings.keys():
+                    del postings[vector_id]
+                if not postings:
+                    del self.postings[term]
+        return len(vector_ids)
+
+    def search(self, query: str, limit: int) -> List[Tuple[str, float]]:
+        """Top limit (vector_id, BM25 score) pairs for the query"""
+        if not self.documents:
+            return []
+
+        count = len(self.documents)
+        average_length = self.total_length / count or 1
+        scores: Dict[str, float] = {}
+
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for vector_id, frequency in postings.items():
+                length = self.documents[vector_id][2]
+                scores[vector_id] = scores.get(vector_id, 0.0) + idf * frequency * (self.K1 + 1) / (
+                    frequency + self.K1 * (1 - self.B + self.B * length / average_length)
+                )
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 indexes over vectors.text, one per project, for the part numbers,
+    standards codes and acronyms that dense embeddings retrieve poorly.
+
+    A project's index is built from the database on its first search, outside the shared
+    lock so other projects keep being searched, and kept up to date as chunks are inserted
+    or files deleted. Least recently searched projects are dropped once more than
+    max_projects are loaded, and simply rebuilt when searched again.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(LexicalIndex, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        env = os.environ['ENV']
+        self.enabled = bool(config['env'][env].get('LEXICAL_SEARCH_ENABLED', True))
+        self.max_projects = int(config['env'][env].get('LEXICAL_INDEX_MAX_PROJECTS', 20))
+
+        self.db = Database.get_instance()
+        # (user_id, project_id) -> index
+        self._projects: OrderedDict[Tuple[int, int], ProjectIndex] = OrderedDict()
+        # Updates to projects being built, replayed onto the index once it is stored
+        self._pending: Dict[Tuple[int, int], List[Callable[[ProjectIndex], None]]] = {}
+        self._build_locks: Dict[Tuple[int, int], threading.Lock] = {}
+        self._lock = threading.RLock()
+
+        self._initialized = True
+
+    def _loaded_project(self, key: Tuple[int, int]) -> Optional[ProjectIndex]:
+        """Loaded index of a project, marked as most recently searched. Caller holds the lock"""
+        project = self._projects.get(key)
+        if project is not None:
+            self._projects.move_to_end(key)
+        return project
+
+    def _get_project(self, user_id: int, project_id: int) -> ProjectIndex:
+        """
+        Loaded index of a project, built from the database if missing. Only one thread
+        builds a given project, the others wait for its index
+        """
+        key = (user_id, project_id)
+        with self._lock:
+            project = self._loaded_project(key)
+            if project is not None:
+                return project
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                project = self._loaded_project(key)
+                if project is not None:
+                    return project
+                self._pending[key] = []
+
+            try:
+                start_time = time.perf_counter()
+                project = ProjectIndex()
+                for row in self.db.get_project_vector_texts(project_id=project_id, user_id=user_id):
+                    project.add(row['vector_id'], row['file_id'], row['chunk_number'], row['text'] or "")
+            except Exception:
+                with self._lock:
+                    self._pending.pop(key, None)
+                raise
+
+            with self._lock:
+                pending = self._pending.pop(key, None)
+                for update in pending or []:
+                    update(project)
+                # An invalidation during the build drops the pending updates, the index
+                # still answers this search but is not kept
+                if pending is not None:
+                    self._projects[key] = project
+                    self._projects.move_to_end(key)
+                    while len(self._projects) > self.max_projects:
+                        self._projects.popitem(last=False)
+
+        logger.info(
+            f"Built lexical index for project {project_id} with {len(project.documents)} chunks "
+            f"and {len(project.postings)} terms in {time.perf_counter() - start_time:.2f}s"
+        )
+        return project
+
+    def add_vectors(self, vectors: List[Dict]) -> None:
+        """
+        Add newly inserted chunks to the indexes of their projects, if loaded or being built.
+        Unloaded projects pick the chunks up from the database when they are built
+
+        Args:
+            vectors (List[Dict]): Vector records with vector_id, file_id, user_id, project_id, chunk_number and text
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            for vector in vectors:
+                key = (vector['user_id'], vector['project_id'])
+                add = lambda project, vector=vector: project.add(
+                    vector['vector_id'], vector['file_id'], vector['chunk_number'], vector['text'] or ""
+                )
+                if key in self._projects:
+                    add(self._projects[key])
+                if key in self._pending:
+                    self._pending[key].append(add)
+
+    def remove_file(self, file_id: int, user_id: int) -> None:
+        """
+        Drop a deleted file's chunks from the loaded indexes and those being built
+
+        Args:
+            file_id (int): ID of the deleted file
+            user_id (int): ID of the user who owns the file
+        """
+        with self._lock:
+            for (project_user_id, _), project in self._projects.items():
+                if project_user_id == user_id:
+                    project.remove_file(file_id)
+            for (project_user_id, _), pending in self._pending.items():
+                if project_user_id == user_id:
+                    pending.append(lambda project: project.remove_file(file_id))
+
+    def invalidate(self, project_id: int, user_id: int) -> None:
+        """
+        Drop the index of a project, eg once it is deleted
+
+        Args:
+            project_id (int): ID of the project
+            user_id (int): ID of the user who owns the project
+        """
+        with self._lock:
+            self._projects.pop((user_id, project_id), None)
+            self._pending.pop((user_id, project_id), None)
+
+    def search(
+        self,
+        query: str,
+        user_id: int,
+        project_id: int,
+        limit: int = 5
+    ) -> List[MatchNeighbor]:
+        """
+        BM25 search of a project's chunks
+
+        Args:
+            query (str): The query to search for
+            user_id (int): User ID for filtering
+            project_id (int): Project ID for filtering
+            limit (int): Number of results to return
+
+        Returns:
+            List[MatchNeighbor]: Matches shaped like Vector Search results, with the BM25
+                                 score as distance and file_id and chunk_number restricts
+        """
+        if not self.enabled:
+            return []
+
+        project = self._get_project(user_id, project_id)
+        with self._lock:
+            hits = project.search(query, limit)
+            documents = [project.documents[vector_id] for vector_id, _ in hits]
+
+        return [
+            MatchNeighbor(
+                id=vector_id,
+                distance=score,
+                restricts=[
+                    Namespace(name="project_id", allow_tokens=[str(project_id)], deny_tokens=[]),
+                    Namespace(name="user_id", allow_tokens=[str(user_id)], deny_tokens=[]),
+                    Namespace(name="file_id", allow_tokens=[str(file_id)], deny_tokens=[]),
+                    Namespace(name="chunk_number", allow_tokens=[str(chunk_number)], deny_tokens=[])
+                ]
+            )
+            for (vector_id, score), (file_id, chunk_number, _) in zip(hits, documents)
+        ]
+
+
+def reciprocal_rank_fusion(result_lists: List[List[MatchNeighbor]], limit: int, k: int = 60) -> List[MatchNeighbor]:
+    """
+    Merge ranked result lists by reciprocal rank fusion, sum of 1 / (k + rank) over the lists
+
+    Args:
+        result_lists (List[List[MatchNeighbor]]): Ranked results, eg from vector and lexical search
+        limit (int): Number of results to return
+        k (int): Damping constant, 60 as in the original RRF paper
+
+    Returns:
+        List[MatchNeighbor]: Fused results, the first list's match object is kept for duplicates
+    """
+    scores: Dict[str, float] = {}
+    matches: Dict[str, MatchNeighbor] = {}
+
+    for results in result_lists:
+        for rank, match in enumerate(results, 1):
+            scores[match.id] = scores.get(match.id, 0.0) + 1 / (k + rank)
+            matches.setdefault(match.id, match)
+
+    ranked = sorted(scores, key=lambda vector_id: scores[vector_id], reverse=True)
+    return [matches[vector_id] for vector_id in ranked[:limit]]
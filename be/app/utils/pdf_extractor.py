@@ -1,94 +1,199 @@
-from typing import Dict, List, Union, Any
-from pdf2image import convert_from_path
+from typing import Dict, List, Union, Any, Iterator, BinaryIO, Optional
 from PyPDF2 import PdfReader
+from concurrent.futures.process import BrokenProcessPool
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
+from loguru import logger
 
 from .base_extractor import BaseExtractor
+from .pdf_ocr import ocr_page
 
-import pytesseract
+import multiprocessing
+import threading
+import tempfile
+import shutil
 import uuid
 import os
 
+_ocr_executor: Optional[ProcessPoolExecutor] = None
+_ocr_executor_lock = threading.Lock()
+
+def get_ocr_executor() -> ProcessPoolExecutor:
+    """
+    Process pool shared by the OCR of every PDF, sized to the available cores. Its
+    processes are spawned, forking a worker that runs gRPC and other threads can deadlock
+    
+    Returns:
+        ProcessPoolExecutor: The shared pool, created on first use
+    """
+    global _ocr_executor
+    with _ocr_executor_lock:
+        if _ocr_executor is None:
+            _ocr_executor = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _ocr_executor
+
+def reset_ocr_executor(executor: ProcessPoolExecutor) -> None:
+    """Drop a broken pool, eg after one of its processes was killed, so the next OCR starts a new one"""
+    global _ocr_executor
+    with _ocr_executor_lock:
+        if _ocr_executor is executor:
+            _ocr_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
 class PDFExtractor(BaseExtractor):
     def __init__(self):
         """Initialize the PDF extractor"""
         super().__init__()
         self.supported_formats = ['.pdf']
+        self.ocr_dpi = 200
+        self.page_window = 32  # Pages extracted before OCR'ing the empty ones among them
     
-    def validate_file(self, file_path: str) -> bool:
+    def validate_file(self, file_path: Union[str, BinaryIO], file_name: str = None) -> bool:
         """
         Validate if the file is a PDF
-        :param file_path: Path to the PDF file
+        :param file_path: Path to the PDF file, or a binary file object with its content
+        :param file_name: Name of the file, required when file_path is a file object
         :return: Boolean indicating if file is valid
         """
-        if not os.path.exists(file_path):
+        if isinstance(file_path, str) and not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
             
-        file_ext = os.path.splitext(file_path)[1].lower()
+        file_ext = self.get_file_extension(file_path, file_name)
         if file_ext not in self.supported_formats:
             raise ValueError(f"Unsupported file format. Supported formats: {self.supported_formats}")
         
         return True
 
-    def extract_text_with_ocr(self, file_path: str) -> str:
-        """Extract text using OCR when regular extraction fails"""
-        pages = convert_from_path(file_path, dpi=200)
-        text_data = ''
-        for page in pages:
-            text = pytesseract.image_to_string(page)
-            text_data += text + '\n'
-        return text_data.strip()
+    def extract_text_with_ocr(self, file_path: str, page_number: int) -> str:
+        """Extract text of a single page using OCR when regular extraction fails"""
+        return ocr_page(file_path, page_number, self.ocr_dpi)
 
-    def extract_content(self, file_path: str) -> List[Dict[str, Union[int, str]]]:
+    def ocr_pages(self, file_path: str, page_numbers: List[int]) -> List[str]:
         """
-        Extract content from PDF file
-        :param file_path: Path to the PDF file
-        :return: List of dictionaries containing page numbers and content
+        OCR several pages in parallel across the process pool shared by every PDF
+        
+        Args:
+            file_path: Path to the PDF file
+            page_numbers: 1-based page numbers to OCR
+            
+        Returns:
+            List of page texts, in the same order as page_numbers
         """
-        self.validate_file(file_path)
-        reader = PdfReader(file_path)
-        content = []
+        if not page_numbers:
+            return []
+        
+        if len(page_numbers) == 1 or (os.cpu_count() or 1) == 1:
+            return [self.extract_text_with_ocr(file_path, page_number) for page_number in page_numbers]
+        
+        executor = get_ocr_executor()
+        try:
+            return list(executor.map(
+                ocr_page,
+                repeat(file_path),
+                page_numbers,
+                repeat(self.ocr_dpi)
+            ))
+        except BrokenProcessPool:
+            reset_ocr_executor(executor)
+            raise
 
-        for page_number, page in enumerate(reader.pages, 1):
-            # Try regular text extraction first
-            text = page.extract_text().strip()
-            
-            # If no text was extracted, try OCR
-            if not text:
-                text = self.extract_text_with_ocr(file_path)
+    def write_temp_file(self, file: BinaryIO) -> str:
+        """
+        Copy a PDF held in a file object to a temporary file of its own, for pdf2image which only reads paths
+        
+        Args:
+            file: Binary file object with the PDF content
             
-            content.append({
-                'content': text,
-                'chunk_number': page_number,
-            })
+        Returns:
+            str: Path to the temporary file, to be removed by the caller
+        """
+        position = file.tell()
+        file.seek(0)
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
+            shutil.copyfileobj(file, temp_file)
+        file.seek(position)
+        return temp_file.name
+
+    def iter_content(self, file_path: Union[str, BinaryIO], file_name: str = None) -> Iterator[Dict[str, Union[int, str]]]:
+        """
+        Lazily extract content from PDF file, a window of pages at a time, so
+        empty pages within the window can be OCR'd together
+        :param file_path: Path to the PDF file, or a binary file object with its content
+        :param file_name: Name of the file, required when file_path is a file object
+        :return: Iterator of dictionaries containing page numbers and content
+        """
+        self.validate_file(file_path, file_name)
+        reader = PdfReader(file_path)
+        total_pages = len(reader.pages)
+
+        # OCR needs a path, a file object is only written to disk once a page needs OCR
+        ocr_path = file_path if isinstance(file_path, str) else None
+        try:
+            for window_start in range(0, total_pages, self.page_window):
+                window = []
+                for page_number in range(window_start + 1, min(window_start + self.page_window, total_pages) + 1):
+                    # Try regular text extraction first
+                    text = reader.pages[page_number - 1].extract_text().strip()
+                    
+                    window.append({
+                        'content': text,
+                        'chunk_number': page_number,
+                        'total_chunks': total_pages
+                    })
+
+                # OCR only the pages where no text was extracted
+                empty_pages = [item['chunk_number'] for item in window if not item['content']]
+                if empty_pages:
+                    if ocr_path is None:
+                        ocr_path = self.write_temp_file(file_path)
+                    logger.info(f"Running OCR on {len(empty_pages)} of {len(window)} pages starting at page {window_start + 1}")
+                    for page_number, text in zip(empty_pages, self.ocr_pages(ocr_path, empty_pages)):
+                        window[page_number - window_start - 1]['content'] = text
 
-        return content
+                yield from window
+        finally:
+            if ocr_path is not None and ocr_path is not file_path:
+                os.remove(ocr_path)
 
-    def extract_documents(
+    def extract_content(self, file_path: Union[str, BinaryIO], file_name: str = None) -> List[Dict[str, Union[int, str]]]:
+        """
+        Extract content from PDF file
+        :param file_path: Path to the PDF file, or a binary file object with its content
+        :param file_name: Name of the file, required when file_path is a file object
+        :return: List of dictionaries containing page numbers and content
+        """
+        return list(self.iter_content(file_path, file_name))
+
+    def iter_documents(
         self, 
-        file_path: str, 
+        file_path: Union[str, BinaryIO], 
         project_id: int, 
         user_id: int,
-        file_id: int
-    ) -> List[Dict[str, Any]]:
+        file_id: int,
+        file_name: str = None,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
         """
-        Extract content from PDF file in Qdrant format
+        Extract content from PDF file in Qdrant format, one page at a time
         
         Args:
-            file_path (str): Path to the PDF file
+            file_path (Union[str, BinaryIO]): Path to the PDF file, or a binary file object with its content
             project_id (int): Project identifier
             user_id (int): User identifier
             file_id (int): File identifier
+            file_name (str, optional): Name of the file, required when file_path is a file object
             
         Returns:
-            List[Dict]: List of documents with page_content and metadata
+            Iterator[Dict]: Documents with page_content and metadata
         """
-        content = self.extract_content(file_path)
-        documents = []
-        
-        for item in content:
+        for item in self.iter_content(file_path, file_name):
             vector_id = str(uuid.uuid4())
-            document = {
+            yield {
                 "page_content": item['content'],
                 "vector_id": vector_id,
                 "metadata": {
@@ -97,11 +202,6 @@ class PDFExtractor(BaseExtractor):
                     "file_id": file_id,
                     "file_type": "pdf",
                     "chunk_number": item['chunk_number'],
-                    "total_chunks": len(content)
+                    "total_chunks": item['total_chunks']
                 },
             }
-
-            self.insert_vector(document)
-            documents.append(document)
-        
-        return documents 
\ No newline at end of file
@@ -0,0 +1,25 @@
+from pdf2image import convert_from_path
+
+import pytesseract
+
+# Kept free of the extractors' imports (vertexai, mysql-connector), every spawned OCR
+# process imports this module to unpickle ocr_page
+
+def ocr_page(file_path: str, page_number: int, dpi: int = 200) -> str:
+    """
+    Rasterize and OCR a single page of a PDF. Module level so it can run in a process pool
+    
+    Args:
+        file_path: Path to the PDF file
+        page_number: 1-based page number
+        dpi: Rasterization resolution
+        
+    Returns:
+        str: OCR text of the page
+    """
+    pages = convert_from_path(file_path, dpi=dpi, first_page=page_number, last_page=page_number)
+    text_data = ''
+    for page in pages:
+        text = pytesseract.image_to_string(page)
+        text_data += text + '\n'
+    return text_data.strip()
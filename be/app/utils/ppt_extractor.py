@@ -1,5 +1,5 @@
 from .base_extractor import BaseExtractor
-from typing import Dict, List, Union, Any
+from typing import Dict, List, Union, Any, Iterator, BinaryIO
 from pptx import Presentation
 
 import uuid
@@ -11,16 +11,17 @@ class PPTExtractor(BaseExtractor):
         super().__init__()
         self.supported_formats = ['.pptx', '.ppt']
 
-    def validate_file(self, file_path: str) -> bool:
+    def validate_file(self, file_path: Union[str, BinaryIO], file_name: str = None) -> bool:
         """
         Validate if the file is a PowerPoint presentation
-        :param file_path: Path to the PowerPoint file
+        :param file_path: Path to the PowerPoint file, or a binary file object with its content
+        :param file_name: Name of the file, required when file_path is a file object
         :return: Boolean indicating if file is valid
         """
-        if not os.path.exists(file_path):
+        if isinstance(file_path, str) and not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
             
-        file_ext = os.path.splitext(file_path)[1].lower()
+        file_ext = self.get_file_extension(file_path, file_name)
         if file_ext not in self.supported_formats:
             raise ValueError(f"Unsupported file format. Supported formats: {self.supported_formats}")
         
@@ -65,15 +66,15 @@ class PPTExtractor(BaseExtractor):
             
         return text.strip()
 
-    def extract_content(self, file_path: str) -> List[Dict[str, Union[int, str]]]:
+    def iter_content(self, file_path: Union[str, BinaryIO], file_name: str = None) -> Iterator[Dict[str, Union[int, str]]]:
         """
-        Extract content from PowerPoint presentation
-        :param file_path: Path to the PowerPoint file
-        :return: List of dictionaries containing slide numbers and content
+        Lazily extract content from PowerPoint presentation, one slide at a time
+        :param file_path: Path to the PowerPoint file, or a binary file object with its content
+        :param file_name: Name of the file, required when file_path is a file object
+        :return: Iterator of dictionaries containing slide numbers and content
         """
-        self.validate_file(file_path)
+        self.validate_file(file_path, file_name)
         presentation = Presentation(file_path)
-        slides_content = []
 
         for slide_number, slide in enumerate(presentation.slides, 1):
             slide_content = {
@@ -101,40 +102,47 @@ class PPTExtractor(BaseExtractor):
             slide_content['content'] = '\n'.join(slide_content['content'])
             slide_content['notes'] = slide_content['notes'].strip()
             
-            slides_content.append(slide_content)
+            yield slide_content
 
-        return slides_content
+    def extract_content(self, file_path: Union[str, BinaryIO], file_name: str = None) -> List[Dict[str, Union[int, str]]]:
+        """
+        Extract content from PowerPoint presentation
+        :param file_path: Path to the PowerPoint file, or a binary file object with its content
+        :param file_name: Name of the file, required when file_path is a file object
+        :return: List of dictionaries containing slide numbers and content
+        """
+        return list(self.iter_content(file_path, file_name))
     
-    def extract_documents(
+    def iter_documents(
         self, 
-        file_path: str, 
+        file_path: Union[str, BinaryIO], 
         project_id: int, 
         user_id: int,
-        file_id: int
-    ) -> List[Dict[str, Any]]:
+        file_id: int,
+        file_name: str = None,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
         """
-        Extract content from PowerPoint presentation in Qdrant format
+        Extract content from PowerPoint presentation in Qdrant format, one slide at a time
         
         Args:
-            file_path (str): Path to the PowerPoint file
+            file_path (Union[str, BinaryIO]): Path to the PowerPoint file, or a binary file object with its content
             project_id (int): Project identifier
             user_id (int): User identifier
             file_id (int): File identifier
+            file_name (str, optional): Name of the file, required when file_path is a file object
             
         Returns:
-            List[Dict]: List of documents with page_content and metadata
+            Iterator[Dict]: Documents with page_content and metadata
         """
-        slides_content = self.extract_content(file_path)
-        documents = []
-        
-        for slide in slides_content:
+        for slide in self.iter_content(file_path, file_name):
             # Combine content and notes if notes exist
             page_content = slide['content']
             if slide['notes']:
                 page_content += f"\nNotes: \n{slide['notes']}"
             
             # Create document with content and metadata
-            document = {
+            yield {
                 "vector_id": str(uuid.uuid4()),
                 "page_content": page_content,
                 "metadata": {
@@ -146,8 +154,3 @@ class PPTExtractor(BaseExtractor):
                     "total_chunks": slide['total_chunks']
                 }
             }
-            
-            self.insert_vector(document)
-            documents.append(document)
-        
-        return documents
\ No newline at end of file
@@ -0,0 +1,247 @@
+from google.api_core.exceptions import TooManyRequests
+
+from typing import Callable, Awaitable, Dict, Tuple, Type, Any
+from loguru import logger
+from config import config
+
+import threading
+import asyncio
+import random
+import time
+import os
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate units per second.
+
+    Reservations are granted immediately and may take the bucket into debt, the caller
+    is told how long to wait before its reservation is covered. Requests therefore queue
+    up in arrival order instead of racing each other when the bucket refills.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount out of the bucket
+
+        Args:
+            amount (float): Units to take
+
+        Returns:
+            float: Seconds to wait before using them
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RateLimiter:
+    """
+    Client-side limiter for one model or API, shared by every thread and coroutine of the process.
+
+    Paces calls to the configured requests and tokens per minute, and on a 429 pauses all
+    callers for a jittered, exponentially growing delay instead of each retrying on its own.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_retries: int = 5,
+        backoff_base: float = 2.0,
+        backoff_max: float = 60.0
+    ):
+        self.name = name
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # A zero budget means unlimited, bursts of up to one second of budget are allowed
+        self._requests = TokenBucket(requests_per_minute / 60, max(1.0, requests_per_minute / 60)) if requests_per_minute else None
+        self._tokens = TokenBucket(tokens_per_minute / 60, max(1.0, tokens_per_minute / 60)) if tokens_per_minute else None
+
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+
+        self.throttled = 0
+        self.rate_limited = 0
+
+    def _reserve(self, tokens: int) -> float:
+        """Seconds to wait before a call using tokens fits the budget and any pause is over"""
+        wait = 0.0
+        if self._requests:
+            wait = max(wait, self._requests.reserve(1))
+        if self._tokens and tokens:
+            wait = max(wait, self._tokens.reserve(tokens))
+        with self._lock:
+            wait = max(wait, self._paused_until - time.monotonic())
+        if wait > 0:
+            self.throttled += 1
+        return wait
+
+    def acquire(self, tokens: int = 0) -> None:
+        """
+        Block until a call using tokens can be made
+
+        Args:
+            tokens (int): Estimated tokens used by the call
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        """
+        Async version of acquire, waits on the event loop
+
+        Args:
+            tokens (int): Estimated tokens used by the call
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_tokens(self, tokens: int) -> None:
+        """Charge tokens that were not known up front, eg the difference to the actual usage"""
+        if self._tokens and tokens > 0:
+            self._tokens.reserve(tokens)
+
+    def _backoff(self, attempt: int, rate_limited: bool) -> float:
+        """
+        Full jitter exponential backoff. A 429 pauses every caller of the limiter, so
+        the retries of concurrent calls spread out instead of all hitting the quota again
+
+        Args:
+            attempt (int): Zero based attempt that failed
+            rate_limited (bool): Whether the failure was a 429
+
+        Returns:
+            float: Seconds to wait before the next attempt
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if rate_limited:
+            self.rate_limited += 1
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def call(
+        self,
+        func: Callable[..., Any],
+        *args,
+        tokens: int = 0,
+        retry_on: Tuple[Type[Exception], ...] = (TooManyRequests,),
+        max_retries: int = None,
+        **kwargs
+    ) -> Any:
+        """
+        Call func once the budget allows, retrying with backoff on retry_on errors
+
+        Args:
+            func (Callable): Function making the API call
+            tokens (int): Estimated tokens used by the call
+            retry_on (Tuple[Type[Exception], ...]): Errors worth retrying
+            max_retries (int, optional): Attempts before giving up, defaults to the limiter's
+
+        Returns:
+            Any: Result of func
+        """
+        max_retries = max_retries or self.max_retries
+        for attempt in range(max_retries):
+            self.acquire(tokens)
+            try:
+                return func(*args, **kwargs)
+            except retry_on as e:
+                if attempt == max_retries - 1:
+                    raise e
+
+                delay = self._backoff(attempt, isinstance(e, TooManyRequests))
+                logger.warning(f"{self.name} call failed with {type(e).__name__}, retrying in {delay:.1f} seconds... (Attempt {attempt + 1}/{max_retries})")
+                time.sleep(delay)
+
+    async def acall(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        *args,
+        tokens: int = 0,
+        retry_on: Tuple[Type[Exception], ...] = (TooManyRequests,),
+        max_retries: int = None,
+        **kwargs
+    ) -> Any:
+        """
+        Async version of call, func returns an awaitable
+
+        Args:
+            func (Callable): Function returning an awaitable making the API call
+            tokens (int): Estimated tokens used by the call
+            retry_on (Tuple[Type[Exception], ...]): Errors worth retrying
+            max_retries (int, optional): Attempts before giving up, defaults to the limiter's
+
+        Returns:
+            Any: Result of the awaited func
+        """
+        max_retries = max_retries or self.max_retries
+        for attempt in range(max_retries):
+            await self.aacquire(tokens)
+            try:
+                return await func(*args, **kwargs)
+            except retry_on as e:
+                if attempt == max_retries - 1:
+                    raise e
+
+                delay = self._backoff(attempt, isinstance(e, TooManyRequests))
+                logger.warning(f"{self.name} call failed with {type(e).__name__}, retrying in {delay:.1f} seconds... (Attempt {attempt + 1}/{max_retries})")
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters since process start
+
+        Returns:
+            Dict[str, int]: calls that had to wait for budget, and 429s seen
+        """
+        return {
+            "throttled": self.throttled,
+            "rate_limited": self.rate_limited
+        }
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """
+    Get the process-wide limiter for a model or API, configured by the RATE_LIMITS.<name>
+    config table with requests_per_minute, tokens_per_minute, max_retries, backoff_base
+    and backoff_max. Missing budgets are unlimited
+
+    Args:
+        name (str): Model or API name, eg the Vertex model name
+
+    Returns:
+        RateLimiter: The shared limiter
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            env = os.environ['ENV']
+            limits = config['env'][env].get('RATE_LIMITS', {}).get(name, {})
+            _limiters[name] = RateLimiter(
+                name=name,
+                requests_per_minute=float(limits.get('requests_per_minute', 0)),
+                tokens_per_minute=float(limits.get('tokens_per_minute', 0)),
+                max_retries=int(limits.get('max_retries', 5)),
+                backoff_base=float(limits.get('backoff_base', 2.0)),
+                backoff_max=float(limits.get('backoff_max', 60.0))
+            )
+            logger.info(f"Rate limiter for {name}: {limits or 'unlimited'}")
+        return _limiters[name]
@@ -1,8 +1,7 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterator
 from .base_extractor import BaseExtractor
 
 import uuid
-import re
 
 class WebsiteExtractor(BaseExtractor):
     def __init__(self):
@@ -65,7 +64,7 @@ class WebsiteExtractor(BaseExtractor):
             for i, chunk in enumerate(chunks, 1)
         ]
 
-    def extract_documents(
+    def iter_documents(
         self,
         file_path: str,  # In this case, this will be the URL
         project_id: int,
@@ -73,9 +72,9 @@ class WebsiteExtractor(BaseExtractor):
         file_id: int,
         raw_markdown: str = None,
         **kwargs
-    ) -> List[Dict[str, Any]]:
+    ) -> Iterator[Dict[str, Any]]:
         """
-        Extract content from website in Qdrant format
+        Extract content from website in Qdrant format, one chunk at a time
         
         Args:
             file_path: URL of the website
@@ -85,13 +84,10 @@ class WebsiteExtractor(BaseExtractor):
             raw_markdown: Raw markdown content from crawler
             
         Returns:
-            List of documents with page_content and metadata
+            Iterator of documents with page_content and metadata
         """
-        content = self.extract_content(raw_markdown)
-        documents = []
-        
-        for item in content:
-            document = {
+        for item in self.extract_content(raw_markdown):
+            yield {
                 "vector_id": str(uuid.uuid4()),
                 "page_content": item['content'],
                 "metadata": {
@@ -104,8 +100,3 @@ class WebsiteExtractor(BaseExtractor):
                     "total_chunks": item['total_chunks']
                 }
             }
-            
-            self.insert_vector(document)
-            documents.append(document)
-        
-        return documents     
\ No newline at end of file
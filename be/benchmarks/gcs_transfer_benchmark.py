@@ -0,0 +1,138 @@
+"""
+GCS transfer benchmark of the worker.
+
+Uploads a random payload to a bucket of a local GCS emulator, then times
+GCPStorageClient.download_blob_to_buffer and GCPStorageClient._upload_to_gcp with a single
+stream and with sliced, parallel transfers for each number of workers. Downloads are
+checked against the payload's sha256. The speedup is relative to the single stream.
+
+Start an emulator, eg fake-gcs-server, and point the client at it:
+    docker run -d --rm -p 4443:4443 fsouza/fake-gcs-server -scheme http
+    export STORAGE_EMULATOR_HOST=http://localhost:4443
+
+Usage, from be/ with a config.toml in app/config:
+    ENV=<env> python benchmarks/gcs_transfer_benchmark.py
+    ENV=<env> python benchmarks/gcs_transfer_benchmark.py --size-mb 512 --slice-size-mb 32 --workers 4 8 16
+"""
+from typing import Callable, List, Dict
+
+import argparse
+import hashlib
+import pathlib
+import time
+import sys
+import os
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent / "app"
+MB = 1024 * 1024
+
+
+def time_best(func: Callable[[], object], repeat: int) -> float:
+    """Fastest of repeat runs of func, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def configure(client, workers: int, slice_size: int) -> None:
+    """Single stream for one worker, otherwise slices of slice_size across workers"""
+    client.transfer_workers = workers
+    client.slice_size = slice_size
+    client.sliced_transfer_threshold = 0 if workers > 1 else float("inf")
+
+
+def benchmark_downloads(client, bucket: str, blob_path: str, digest: str, size: int, args) -> List[Dict]:
+    """Time download_blob_to_buffer per number of workers"""
+    results = []
+    for workers in [1] + args.workers:
+        configure(client, workers, args.slice_size_mb * MB)
+
+        def download():
+            buffer = client.download_blob_to_buffer(bucket, blob_path)
+            if hashlib.sha256(buffer.getbuffer()).hexdigest() != digest:
+                raise RuntimeError(f"Downloaded content differs from the payload with {workers} worker/s")
+
+        elapsed = time_best(download, args.repeat)
+        results.append({"workers": workers, "seconds": elapsed, "mb_per_second": size / MB / elapsed})
+    return results
+
+
+def benchmark_uploads(client, bucket: str, filename: str, size: int, args) -> List[Dict]:
+    """Time _upload_to_gcp per number of workers, emulators may not support multipart uploads"""
+    results = []
+    for workers in [1] + args.workers:
+        configure(client, workers, args.slice_size_mb * MB)
+        try:
+            elapsed = time_best(
+                lambda: client._upload_to_gcp(filename, bucket, "benchmark", "gcs_transfer"),
+                args.repeat
+            )
+        except Exception as e:
+            print(f"  Upload with {workers} worker/s failed: {type(e).__name__}: {str(e)[:200]}")
+            continue
+        results.append({"workers": workers, "seconds": elapsed, "mb_per_second": size / MB / elapsed})
+    return results
+
+
+def summarize(title: str, results: List[Dict]) -> None:
+    """Print throughput and speedup over the single stream"""
+    print(f"\n=== {title} ===")
+    if not results:
+        print("  No successful runs")
+        return
+
+    baseline = next((result["seconds"] for result in results if result["workers"] == 1), None)
+    for result in results:
+        speedup = f"{baseline / result['seconds']:5.2f}x" if baseline else "    -"
+        mode = "single stream" if result["workers"] == 1 else f"{result['workers']} workers"
+        print(f"  {mode:>14}  {result['seconds']:8.2f}s  {result['mb_per_second']:9.1f} MB/s  {speedup}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sliced GCS downloads and uploads against a local emulator")
+    parser.add_argument("--bucket", default="gcs-transfer-benchmark", help="Bucket to create in the emulator")
+    parser.add_argument("--size-mb", type=int, default=256, help="Size of the random payload")
+    parser.add_argument("--slice-size-mb", type=int, default=16, help="Slice size of sliced transfers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8, 16], help="Workers of sliced transfers")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per setting, the fastest is reported")
+    parser.add_argument("--skip-uploads", action="store_true", help="Only benchmark downloads")
+    args = parser.parse_args()
+
+    if "ENV" not in os.environ:
+        parser.error("ENV must be set to an environment of app/config/config.toml")
+    if "STORAGE_EMULATOR_HOST" not in os.environ:
+        parser.error("STORAGE_EMULATOR_HOST must point at a GCS emulator, eg http://localhost:4443")
+
+    sys.path.insert(0, str(APP_DIR))
+    from utils.gcp import GCPStorageClient
+
+    client = GCPStorageClient()
+    bucket = client.client.lookup_bucket(args.bucket) or client.client.create_bucket(args.bucket)
+
+    size = args.size_mb * MB
+    payload = os.urandom(size)
+    digest = hashlib.sha256(payload).hexdigest()
+    blob_path = f"benchmark/gcs_transfer/payload_{size}.bin"
+    filename = f"gcs_transfer_benchmark_{os.getpid()}.bin"
+
+    print(f"Uploading a {args.size_mb} MB payload to {args.bucket} at {os.environ['STORAGE_EMULATOR_HOST']}")
+    bucket.blob(blob_path).upload_from_string(payload)
+    with open(f"/tmp/{filename}", "wb") as file:
+        file.write(payload)
+    del payload
+
+    try:
+        summarize(f"Download of {args.size_mb} MB", benchmark_downloads(client, args.bucket, blob_path, digest, size, args))
+        if not args.skip_uploads:
+            summarize(f"Upload of {args.size_mb} MB", benchmark_uploads(client, args.bucket, filename, size, args))
+    finally:
+        os.remove(f"/tmp/{filename}")
+        for blob in client.client.list_blobs(args.bucket, prefix="benchmark/"):
+            blob.delete()
+
+
+if __name__ == "__main__":
+    main()
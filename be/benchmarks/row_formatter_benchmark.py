@@ -0,0 +1,113 @@
+"""
+Row formatter benchmark.
+
+Times utils.dataframe_formatter.format_rows against the iterrows loops it replaced in
+ExcelExtractor.process_dataframe (missing values as "None") and RFPGraphService.process_rfp
+(missing values as they are), on a generated sheet of text, numbers, dates and blanks, and
+checks both give byte-identical output. Pass --file to use a real sheet instead.
+
+Usage, from be/:
+    python benchmarks/row_formatter_benchmark.py
+    python benchmarks/row_formatter_benchmark.py --rows 50000 --columns 12
+    python benchmarks/row_formatter_benchmark.py --file path/to/sheet.xlsx
+"""
+from typing import Callable, List
+
+import argparse
+import pathlib
+import time
+import sys
+
+import pandas as pd
+import numpy as np
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent / "app"
+sys.path.insert(0, str(APP_DIR))
+
+from utils.dataframe_formatter import format_rows
+
+
+def iterrows_excel(df: pd.DataFrame) -> List[str]:
+    """The former ExcelExtractor.process_dataframe"""
+    chunks = []
+    for idx, row in df.iterrows():
+        row_text = ""
+        for header, value in row.items():
+            if not pd.isna(value):
+                row_text += f"{header}: \n{value}\n\n"
+            else:
+                row_text += f"{header}: \nNone\n\n"
+        chunks.append(row_text)
+    return chunks
+
+
+def iterrows_rfp(df: pd.DataFrame) -> List[str]:
+    """The former requirements build of RFPGraphService.process_rfp"""
+    requirements_list = []
+    for idx, row in df.iterrows():
+        requirements = ""
+        for column in row.index:
+            requirements += f"{column}: \n{row[column]}\n\n"
+        requirements_list.append(requirements)
+    return requirements_list
+
+
+def generate_sheet(rows: int, columns: int, seed: int) -> pd.DataFrame:
+    """Sheet cycling through text, integer, float and date columns, a fifth of cells blank"""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for position in range(columns):
+        kind = position % 4
+        if kind == 0:
+            values = pd.Series([f"Requirement {i} of section {position}: supports SSO, ISO 27001 and AB-{i % 997}" for i in range(rows)])
+        elif kind == 1:
+            values = pd.Series(rng.integers(0, 10000, rows)).astype(float)
+        elif kind == 2:
+            values = pd.Series(rng.normal(100, 25, rows))
+        else:
+            values = pd.Series(pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 1000, rows), unit="D"))
+        data[f"Column {position}"] = values.mask(rng.random(rows) < 0.2)
+    return pd.DataFrame(data)
+
+
+def time_best(func: Callable[[], List[str]], repeat: int) -> float:
+    """Fastest of repeat runs of func, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark format_rows against iterrows")
+    parser.add_argument("--rows", type=int, default=50000, help="Rows of the generated sheet")
+    parser.add_argument("--columns", type=int, default=8, help="Columns of the generated sheet")
+    parser.add_argument("--file", type=pathlib.Path, help="CSV or Excel sheet to use instead of a generated one")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per formatter, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated sheet")
+    args = parser.parse_args()
+
+    if args.file:
+        df = pd.read_csv(args.file) if args.file.suffix.lower() == ".csv" else pd.read_excel(args.file)
+    else:
+        df = generate_sheet(args.rows, args.columns, args.seed)
+    print(f"Sheet of {len(df)} rows and {len(df.columns)} columns")
+
+    for title, baseline, na_rep in [
+        ("ExcelExtractor.process_dataframe", iterrows_excel, "None"),
+        ("RFPGraphService.process_rfp requirements", iterrows_rfp, None)
+    ]:
+        if format_rows(df, na_rep=na_rep) != baseline(df):
+            raise RuntimeError(f"format_rows output differs from iterrows for {title}")
+
+        baseline_seconds = time_best(lambda: baseline(df), args.repeat)
+        formatter_seconds = time_best(lambda: format_rows(df, na_rep=na_rep), args.repeat)
+        print(f"\n=== {title}, identical output ===")
+        print(f"  {'iterrows':>12}  {baseline_seconds:8.3f}s")
+        print(f"  {'format_rows':>12}  {formatter_seconds:8.3f}s  {baseline_seconds / formatter_seconds:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Startup benchmark of the worker.
+
+Imports each target module in a fresh interpreter with `python -X importtime` and
+summarizes the report: wall time, the slowest imports by cumulative time, and the self
+time grouped by top-level package. `main`, plus the Pub/Sub client its main() imports,
+is what a worker pays before its first message, the routers are what each request type
+pays on its first message.
+
+Usage, from be/ with a config.toml in app/config:
+    ENV=<env> python benchmarks/startup_benchmark.py
+    ENV=<env> python benchmarks/startup_benchmark.py --targets main routers.rfp --top 15
+"""
+from typing import List, Dict, Tuple
+from collections import defaultdict
+
+import subprocess
+import argparse
+import pathlib
+import time
+import sys
+import os
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent / "app"
+DEFAULT_TARGETS = ["main", "google.cloud.pubsub_v1", "routers.rfp", "routers.document", "routers.crawler"]
+
+
+def run_importtime(target: str, app_dir: pathlib.Path) -> Tuple[float, str]:
+    """
+    Import target in a fresh interpreter
+
+    Returns:
+        Tuple[float, str]: Wall time in seconds and the -X importtime report
+    """
+    start_time = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=app_dir,
+        env={**os.environ, "PYTHONPATH": str(app_dir)},
+        capture_output=True,
+        text=True
+    )
+    elapsed = time.perf_counter() - start_time
+
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"Importing {target} failed:\n" + "\n".join(errors[-20:]))
+
+    return elapsed, result.stderr
+
+
+def parse_importtime(report: str) -> List[Dict]:
+    """
+    Parse `import time: self [us] | cumulative | imported package` lines
+
+    Returns:
+        List[Dict]: module, depth, self_us and cumulative_us per imported module
+    """
+    rows = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        module = name.strip()
+        rows.append({
+            "module": module,
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us)
+        })
+    return rows
+
+
+def summarize(target: str, elapsed: float, rows: List[Dict], top: int) -> None:
+    """Print the summary of one target"""
+    total_us = sum(row["self_us"] for row in rows)
+    print(f"\n=== import {target}: {elapsed:.2f}s wall, {total_us / 1e6:.2f}s importing {len(rows)} modules ===")
+
+    print(f"\nSlowest {top} imports by cumulative time:")
+    for row in sorted(rows, key=lambda row: row["cumulative_us"], reverse=True)[:top]:
+        print(f"  {row['cumulative_us'] / 1e3:10.1f} ms  {'  ' * row['depth']}{row['module']}")
+
+    by_package = defaultdict(int)
+    for row in rows:
+        by_package[row["module"].split(".")[0]] += row["self_us"]
+
+    print(f"\nSelf time of the {top} heaviest top-level packages:")
+    for package, self_us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"  {self_us / 1e3:10.1f} ms  {100 * self_us / total_us:5.1f}%  {package}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize python -X importtime for the worker's startup")
+    parser.add_argument("--targets", nargs="+", default=DEFAULT_TARGETS, help="Modules to import, each in a fresh interpreter")
+    parser.add_argument("--top", type=int, default=10, help="Rows shown per table")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per target, the fastest is reported")
+    parser.add_argument("--app-dir", type=pathlib.Path, default=APP_DIR, help="Directory containing main.py")
+    args = parser.parse_args()
+
+    if "ENV" not in os.environ:
+        parser.error("ENV must be set to an environment of app/config/config.toml")
+
+    for target in args.targets:
+        runs = [run_importtime(target, args.app_dir) for _ in range(args.repeat)]
+        elapsed, report = min(runs, key=lambda run: run[0])
+        summarize(target, elapsed, parse_importtime(report), args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+-- Answers of processed RFP rows, so a retried or resubmitted RFP skips the rows it already answered
+CREATE TABLE IF NOT EXISTS rfp_row_answers (
+    rfp_id INT NOT NULL,
+    row_index INT NOT NULL,
+    requirement_hash CHAR(64) NOT NULL,
+    answer MEDIUMTEXT NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (rfp_id, row_index)
+);
@@ -0,0 +1,2 @@
+-- Last heartbeat of the run processing an RFP, so a redelivered message doesn't resume an RFP that is still running
+ALTER TABLE rfps ADD COLUMN heartbeat_at DATETIME NULL;
@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# Tests import the worker's modules the way main.py does, from the app directory
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "app"))
@@ -0,0 +1,88 @@
+import pytest
+
+pytest.importorskip("google.cloud.aiplatform")
+
+from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import Namespace
+from google.cloud.aiplatform.compat.types import matching_engine_index as meidx_types
+
+from services.vector_backend import LocalVectorBackend
+
+
+def make_datapoint(datapoint_id, vector, project_id, file_id):
+    return meidx_types.IndexDatapoint(
+        datapoint_id=datapoint_id,
+        feature_vector=vector,
+        restricts=[
+            meidx_types.IndexDatapoint.Restriction(namespace="project_id", allow_list=[str(project_id)]),
+            meidx_types.IndexDatapoint.Restriction(namespace="file_id", allow_list=[str(file_id)])
+        ]
+    )
+
+
+def project_filter(project_id):
+    return [Namespace(name="project_id", allow_tokens=[str(project_id)], deny_tokens=[])]
+
+
+def neighbor_ids(backend, query, project_id, num_neighbors=10):
+    return [match.id for match in backend.find_neighbors([query], num_neighbors, project_filter(project_id))[0]]
+
+
+def test_upsert_query_remove_and_reload(tmp_path):
+    backend = LocalVectorBackend(str(tmp_path))
+    backend.upsert([
+        make_datapoint("a", [1.0, 0.0], project_id=1, file_id=10),
+        make_datapoint("b", [0.0, 1.0], project_id=1, file_id=10),
+        make_datapoint("c", [1.0, 1.0], project_id=2, file_id=20)
+    ])
+
+    assert neighbor_ids(backend, [1.0, 0.1], project_id=1) == ["a", "b"]
+    assert neighbor_ids(backend, [1.0, 0.1], project_id=2) == ["c"]
+
+    # Replacing a datapoint keeps a single copy of it
+    backend.upsert([make_datapoint("a", [0.0, -1.0], project_id=1, file_id=10)])
+    assert neighbor_ids(backend, [1.0, 0.1], project_id=1) == ["b", "a"]
+
+    backend.remove(["b", "missing"])
+    assert neighbor_ids(backend, [1.0, 0.1], project_id=1) == ["a"]
+
+    reloaded = LocalVectorBackend(str(tmp_path))
+    assert neighbor_ids(reloaded, [1.0, 0.1], project_id=1) == ["a"]
+    assert neighbor_ids(reloaded, [1.0, 0.1], project_id=2) == ["c"]
+
+    matches = reloaded.find_neighbors([[0.0, -1.0]], 1, project_filter(1))[0]
+    assert matches[0].distance == pytest.approx(1.0)
+    assert {namespace.name: namespace.allow_tokens for namespace in matches[0].restricts} == {
+        "project_id": ["1"],
+        "file_id": ["10"]
+    }
+
+
+def test_upserts_grow_the_preallocated_vectors(tmp_path):
+    backend = LocalVectorBackend(str(tmp_path))
+    count = LocalVectorBackend.INITIAL_CAPACITY + 5
+    for start in range(0, count, 250):
+        backend.upsert([
+            make_datapoint(f"v{i}", [float(i), 1.0], project_id=1, file_id=i % 3)
+            for i in range(start, min(start + 250, count))
+        ])
+
+    assert len(backend._vectors) >= count
+    assert neighbor_ids(backend, [1.0, 0.0], project_id=1, num_neighbors=1) == [f"v{count - 1}"]
+
+    reloaded = LocalVectorBackend(str(tmp_path))
+    assert len(reloaded._datapoints) == count
+    assert neighbor_ids(reloaded, [1.0, 0.0], project_id=1, num_neighbors=1) == [f"v{count - 1}"]
+
+
+def test_file_filter_and_deny_tokens(tmp_path):
+    backend = LocalVectorBackend(str(tmp_path))
+    backend.upsert([
+        make_datapoint("a", [1.0, 0.0], project_id=1, file_id=10),
+        make_datapoint("b", [0.9, 0.0], project_id=1, file_id=11)
+    ])
+
+    denied = [
+        Namespace(name="project_id", allow_tokens=["1"], deny_tokens=[]),
+        Namespace(name="file_id", allow_tokens=[], deny_tokens=["10"])
+    ]
+    assert [match.id for match in backend.find_neighbors([[1.0, 0.0]], 10, denied)[0]] == ["b"]